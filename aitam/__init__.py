@@ -0,0 +1,6 @@
+# Core of the Threat AI app: document extraction, examination, library search
+# and the advisory panel, with the clients, caches, metering and tracing they
+# share. The Streamlit page (main.py), the batch CLI and the load driver are
+# thin layers on top. Heavy dependencies (pandas, openpyxl, PyPDF2, the OCR
+# stack, tiktoken, cryptography and the Agents SDK) are imported on first use,
+# so importing the package is cheap.
@@ -0,0 +1,260 @@
+import asyncio
+from dataclasses import dataclass
+from functools import lru_cache
+
+from aitam.library import CITATION_PATTERN
+from aitam.metering import metered_stage
+
+# Encrypted instructions for the fallback summary and the advisory agents.
+INSTRUCTION_ENCRYPTED = b'gAAAAABohtGfHcmOGHFRTsdWg0GtzwWFPathTsqYs87K2kr2siCM-sZ7WhLDNj1Nn39tYpktrByZSbCf8JakwTLupxkfJNDoET3aLhhp8kZIMQPNSsAtDN5vp48I6TeJjBYI7qMwtEI3Sa3RIF2W-_uZFtR2ee6PFEhvKtxa_84_CILAgsJ9Fy6KP1Fi6mwFTftYDnKydQRHQpBQX_YTgkjfZZ7eYNbdNLsHQApJ17yPkSGyP4CBk6ucbiIR8osMNTPis2vQZ2RrmsfLdMN7dDU7uhmW9YkVIl3tCmcKrMZnAnP-8p-BN2lIoKOn2iPxZjlZCwFYBYkFia3yopsh9_bR9mSdn3wiqkIjYjZwRRHWRkBnolzlSTVC5flMkp9YJY75n-wqdvvcrWSKjrSQRoE-dtaa2zl6msFeyLugD9TCk_XjDfMpBrCTUzUtA7raDQhOevlZtDbvWsbr_bQ-YNRVwlBm0oBhNXmBKmmN0wrIqA1iRd7cOM_XXZVf0LsirCTg_R-GpIqwE5Mfj8QVRxla2oXdpMGCMwfz1LF0gLxRupcRZI6u7zgBlG7dXHqrYLTgSXSlBC7knkWcVbI3FXVCb3B4jmTnZjbLbSZk7fv6lovglgoh-TU6fVue26SgxMWH8SHDRe3zaK7QWlp7xLvb0Ar7LWg01DsRuBU1sgn7aMX6et8et7BQSOPWrrD9TYNHUyWam_6PagGA0EYg0pt7Om4noWJx_EtYbh9SrVtJsqDFaOJvtgYEsjmu_8iCjB0aHiLRSpWji2aaeewXXVtMjtWJp9ZM0u_w9NJHh-LdvqTPWZLxvWpRJaeSkVl4ip_macM1oOBlvO81y7jWkNv_ivQLgRYXPNESBcrt71zc4XT_1alvvzShueycx8Je-k21bOlYZzZ3TCjUc93010h07Fr-JPiLYUEUE4Zui4FWh5Ogv0QwsTvhgr7pXFsLcpzyCaS8Jxp_Z_nmFyixpMcAri7XwBL0eh1js1pVNsfvqhw6UqCWOkbrnK1254z41nuEDChNOty9dydU_OYHw7a_Sm8no3c9IGoa-j5m-sP-8ES4NeXleNHD_gm8XsLYJv1o_3O4D5tGGq_Xtr94SWcE1klOGCva6f72TzyEfIs6UvcBde7rxTiY6s2OlOA1FypuP_A1pCEkh24xGd2MN6px-x2f-UiSOm5NJbCCJTG2gK69y6b_dYD-zflAd2pMn_F0YeKrMMU3qWh-ILjQ29yJaJf8Ri19XqgZyBgE62Z5GOlQiNXmIDwnvq03FWjTx5ySUAYflChe1wgikuNHNXBa-xFK7qV0ySP_szOQiYHRDrUKjiDKGT32JwiItVmeYkt_zE_Bf1A3HCcOFiQ3Hdvd_xVETOAxsxECn58kCPgwdPd1JlICXS03xseAlQyIx4OYs-2B50iBi6Mk83YHOPOKtQ1TGnpBpDeCrwZb1YFIsAuc5QmScreH_P8s847AW9WhoVH3DcVtuf4LEFsoDysZbL-zKkBM6NecuAyLxraoTy9Ayu6IZ0k='
+INSTRUCTION1_ENCRYPTED = b'gAAAAABohrfKeKyi7cJNlxQFjKlgnElw4zs3DyDqmUrMelL84BbaB7fABpc5SdaBgk8LtQpqYfBSext5KVJ3IEMipmiQo68TKiE3U-CCVbkSrBlQ2soPLroxZe90vgmFwPSVzGLmkAgVGYu_Hfkj6JJOJz4_ILG9gJNYJZgZBbqcmTnxZiLRUIYhOctURCuVGyx_QupFwCaLxrA5UplM0EkBs41NflecvtbnPf-bh5FYqJ8POxkIjzxViZa10bemGn9G52_e5FcydRj0a7Odz99cKWRsHP8bwmlqEA5IwQ0llDQEL1AbmmPgY5PlXOJQjRjx3eNCF9IP'
+INSTRUCTION2_ENCRYPTED = b'gAAAAABohrikHHiMjsrUNWcfWOKRXxdS2GLyFvi89a1Dz0g4WbHnFesTWPYk-gjIicWWqFIK5ylBqVogkKRRatczEoV9koinYg8SCvshUMTy3N3VjDNs6uxJqHbbbP5yU-P0tWLT1oWmV5ij7THbedi1Ay_ksXLFXcf7RrcgS4PitvRcpTVqFzfbMQubAHlVQUq_QkV3hiFuicb7wMFKMNE3XlmXIPElUqt6msXIsooYQm7DsRZVDoQyw4DcPhwQyYY7ljYbISqnNNsCaVSLV7zmQ_srbrTdWmjnx2LnQaT29_QobRN2IG4='
+INSTRUCTION3_ENCRYPTED = b'gAAAAABohrl4WetHeGSipX0T2BV7PprVCiO42Vq77Ln_bfV9mxBGBEgFXYdSGee28ZO6E5nPqKo3Vtq8rMi5W_ixAJEC1NmGuw-dY5uIJjDbRuFQCUqru-M_mh6z3oaYXPoIz58cHrs2JyWUIXtJllsb16jE83Z26bjt1ihJxEaI-OPrp3B2bmrKNdtH-t-345PRjV3ozYqtIOdywQiOEb-nGBtb8JHoyBNZj5nVKS_3SZhNNzjHPOTLAMFPdnZTQCX-DO85AUgy5ygGpS-7I-nnxe-PgGaBw4KumKuN0x_suBtvi6sTdr0='
+INSTRUCTION4_ENCRYPTED = b'gAAAAABohroZYUOEDOJEk3uahy7f7YESV77xekvW1OT0HVgU0uhVj4xyvSvfsdw4EPfUGxuPHJAXEd9cAfHFPdCpw21oLr8H6rSsLt4lwJ8AjRa8Wr29V2trNH-1fV8bJs3j-NTfYLB_vomAT9SYtNa4wKQyxSDKi1Q7owZkJ4mM_qqkVa6dn9n0vfqYsHfMdMx9TFL9uUZeoTKyZx1VAzG_cvf9Hj1dDcMTQlKEku-BOIMdiPzFsRPMkV690KtFhoLChTAWNdOrVVjRrxLZxyQptVxp14egx3WUpf6dgWvl2-Sh5MpjDs8P6GaIcEjm5_OqZrd2kjXC1xGgoGvjzqAlna1umILRug=='
+INSTRUCTION_ORCH_ENCRYPTED = b'gAAAAABohsoPvOB9VD4AXKY7wctD5iW69QZTIs5n7RGySuirQBPPy__4qcyRwyMIZq2gJZZG_B3cTRbEoPCb2XRe8TmemLx0nQMkwfp5LR2zOeqN6u2sgfEX4vJG5XP9rOJP4Pn5Lgav1ADFaFCzPRQofJ5on6zLhyvv8hrDHygto85PvhKwHeL9WMgEATfKmX-NX3IpOrSFup-v5thWB-Ns21Dq1zNMj7XXpmKE7PvWEY7f5jhH8JaDVvaB0KWEUAP6kfmrjbUhI4yuf2RJRRCRZLrr_IZ60A7V6PSSZln5aNdJdea-DQ-auWlaAztU3tdM4UT2edXhNvpuOtacOayLi3RMKC-oN9HJo02onybR6E4I8Par_Gk_0U5BKmUa-LT6GutY6MXDEonYHk4oJFwHni6agQeldUkvWWC7s7RQfVh-NwUwRr9HeFSBpQjPUQN8ad0cE9EYpFAMLGUwUZXexHqrmO2w31p0nhQ9fYEyXjiEk9JBRGmBQHG3W1dD0xKpPVdVj4v9nmBB6QxOlQW-bMzCaBNZrP0i_2HniO8x3BnBaCcK4TwZPjjQXNlbX1wVWx6TMSwXcFG0k1B4NcL4SuF5aLo5mFymYYgIbBRWFQCNs6vw8EhXscCKb_Wo04yCiqXnlfN0cbY65JcXwkqap920nWPhxiaQBE3D311a-N3hcJozTR-VDsZcSw3mhL0BcTRqg8KuKsZ57ftZUXJTdtnYncNT_sUeEmNcJ7cwNZswEV35qd3Q5XeEcmKfIEDWdD-Qu_lOsw3Ac-qyFh9eInWoKPzRUaFbcUu401YZC4eB6KHit_8rb_LbQP7C8IIglV7qdd0Hrb0c_ea7ZWJ_VFbTbH2os9oT6JZTK7sEN3MKLrjbJL2Z9LQ8NusFjPke0u9PcmV4JA_aKbnQBd3dtfNRMsdEXLOBt64t8LtHqT4Q9MBDe7rIQny1FBCgVFYlPceYeVZGHgZqsQZTkAix0AYN8B1pd49Z9k7h4f7q-1ScM9kck_NDBmdK0830uRSJVEap4vZwThRaHimgd4fsk-s3fO8_FkVIoKunncnunIPI5s39vmrl1kdyHW1A6vi29PUQcYonq0LLPrgj5o4dIYk3ztARhhM6nIZSajzkOj6P69Es6bW3j17W3hP7LF2eKHWwsQf6xQBlTvUmn92TIJkglsuOhOj3c48AS3Yd309M6xKYrRA8_esSXDUzJ2T7c4-zBoPnMtl8DrNSF6dDfAf2sR9EsdnbhMDyFrIjqULdQLh9ZRD8B4iuGYO3vSwnq7e-jaZnfImhdBEJFmjqYGOtch_fXcZ85CAfQ8RgP3zdtIJlq84mjrU9pY_qQvzMolOl6r3evrIDcnZmjRzHQ0_dspPIP8FVY2lHbK8--W0jHZ4-1j1WxDAgJd_qwmTXyY4IGNBOkeTqAkHGuKjRAfjeD-MMn9Al2rllqNi_vKQr4ILxwdiuYXLjapDeM-p3RCDNLABakzyTBL1trDOw1kFuEJCdx8LsEl3TKIanBuupRAKh5Ix0l4Bw57D3uoUXj4kz_FqeE9lY_vTJUyREmssvHfXIHA=='
+INSTRUCTION_SYNTH_ENCRYPTED = b'gAAAAABoktL314amlDlkjpYnPtvC3U7Wey79pVnGnTq9TB16AIlSTXvhr_WMXN_nyb_qc8bnd_4QhiUeRq-Ss6x88ebwK7YdBC0kl69UDSLVCUG0KzPJTGDVarxva5ByVgD-Cqkxw0CKUtx4cX5efleDNXD7HAo_ep874sYdzzTx-vVejcrm2Vrt0bavYeNUwiHKqkwpHbVyPjrGfdoJS05BF2eUKB7f-I43kVjQeEviB0D4sUt5gTSABmSIyQOqxVFYhHiCipgOOQgMO7bd3aqgbddgTdrR1X2SJEfHer01CUhCnYYfARr-nTYLq0fzvLEe5YYX4GglhAnJuxsfskDla1VZk23pu6mSeNYuuLF-5bfHH7UDK90eVbLafy2Wj8WcxrERW5aaqh8PeLHDxgwa2j6gus7B-ytSWt7Yidrzde8E9Bs3VFwydqmxgZ63pdj4a1L7vPAiadvGhaFhXP6dvHCkKqVx7LufzTwaeDPQlEE2b2k-k34aSBcFlK2bgWMuLZoSe3RFUjs6j3iI8P1RZu4YlVOlNHWsMQwLNXh6lGGNnrNmyLHOwjRHA8BAB7MITpTUcQLohZBRGatAYgGYzticquVDn_VdWGjICADRiVvDgbBCX9DjTM6x7hds5V8hKZ4zXhNKzLyqoKlF4g82HVs_74_PBJXUunrvVMCwXkkPOUogRS-6zkgA0hQO_4xI0IaP7ooNXKEb6vc2e1yx_OWrP8d9IiAO6q-a2jZ8wqP7Lr55R1Vdzktd_CZVc-qfzzCjoNfRvcNCA1tW3poRIeVS0mxUtX7dretsjEANqya8rbjrr8Y0iENTMQ7eGtznylimFTcmWOba8TuoXaaLOU6zXlyzOyzv0zbLWcbuUuoAzVrYqjEd6e88EHldh4wquqzomjSWQV8_2L7YV7pEWKQ9vK7A0bEhejqW1H34WqjUhZcCfzoTsitbSEHlDpSEx1NXXIQTDMB14E-Zr8liTZ7SIHY0Rk-pT1mL7eBm3RlB2EYmX9-GW6L7bjQ3sChDXnq6BHjNrvNKTF9RgGZdTTms35PnUUjEfYEz8BlvpG8oBTZF9MaGw76-B_eg4J8ZtNy41Ig9y0N-QsQytZDSYERgyRLHL5kPWD-BNm4l3s-Wo8Gs9ztJxCgPk8NPnCvrJ3ETGyRGl8QjlgArZH6VQCAdztfCSpVBBHsTTVIY_14vLcHumCUu3b0fL7VdtFhjsGloLUcZWKtIQFaQLSsLgMRUK7xlxtJj8gCpr78txPcT1nzzp5XX6GJbBii47tBLgijbtYSHXODu5knWzEfV-wAxEsyYATbXtiJsaqmkWWRfBY361DrzZ9P4A60skGbENKcO2tcAe5YXhbs6b5h8ay6G1SssjFEB1yhP9yfk3aU2yfmM7fuXHtJhH27MhiEucq5TNB6_94hjgGz3i1azRfj6sBTbnJeOQv6F33DCJIESwwCwNENV47h9RViyKSg2M1OJlsb49G2JFH_Gz5WmUv4rGic9EFi-ihIuQjoL3isojIpd0HQcMMjHxFo5IPxpdzZNbs6DtNuIwwjoSqaWjwXjdcnU4S6GtLG9gUXRqxIFDygtndTWbpdi48JDzBluzcKFaEbQacdv6nVaHNPR87JtajxnGJxoW-FI1yYcOwQ-D8qh0vCGNORGRcTnCYfACDJUHu_NvH4ufmr-vrX6M8ZPTrCfJlirQ8MBP8CiTafoQNqzYrUpZV1V4wCiSwbiYhrhj3U2yePiFMQtyfHdUnmTkbyVL03cu9xZIVQbnRQcQ2uFgD7-430l0Un9KhdzRuIDW_r7'
+ENCRYPTED_INSTRUCTIONS = {
+    "FALLBACK": INSTRUCTION_ENCRYPTED,
+    "1": INSTRUCTION1_ENCRYPTED,
+    "2": INSTRUCTION2_ENCRYPTED,
+    "3": INSTRUCTION3_ENCRYPTED,
+    "4": INSTRUCTION4_ENCRYPTED,
+    "ORCH": INSTRUCTION_ORCH_ENCRYPTED,
+    "SYNTH": INSTRUCTION_SYNTH_ENCRYPTED,
+}
+
+# Decrypt all instructions once per server process and instruction key.
+@lru_cache(maxsize=4)
+def decrypt_instructions(instruction_key):
+    from cryptography.fernet import Fernet
+    f = Fernet(instruction_key.encode())
+    return {name: f.decrypt(token).decode() for name, token in ENCRYPTED_INSTRUCTIONS.items()}
+
+# Single OpenAI call answering the query from the library with the fallback
+# instructions, used when the advisory panel fails or, as a hedge, when it is
+# slow. Returns the answer text.
+async def fallback_summary_request(client, model, vs_id, query_text, instruction, meter=None):
+    response = await client.responses.create(
+        instructions = instruction,
+        input = query_text,
+        model = model,
+        temperature = 0.6,
+        tools = [{
+            "type": "file_search",
+            "vector_store_ids": [vs_id],
+        }]
+    )
+    if meter is not None:
+        meter.add_usage(response.usage)
+    return CITATION_PATTERN.sub('', response.output_text)
+
+# Seconds one specialist may take in the parallel panel before the panel
+# proceeds without it.
+SPECIALIST_TIMEOUT = 120
+# Latency limits of a consultation: the seconds it may take in all, the
+# seconds after which the fallback is started alongside a panel that hasn't
+# answered yet, and the turns each agent run may take.
+ADVISORY_DEADLINE = 180
+ADVISORY_HEDGE_AFTER = 60
+ADVISORY_MAX_TURNS = 10
+
+# Answer of a consultation and where it came from: "panel" or "fallback".
+@dataclass
+class AdvisoryAnswer:
+    text: str
+    source: str
+
+# Build the four specialist agents, the orchestrator that calls them as tools,
+# and the synthesizer from the decrypted instructions.
+def build_advisory_agents(model, vs_id, instructions):
+    from agents import Agent, FileSearchTool
+    INSTRUCTION1 = instructions["1"]
+    INSTRUCTION2 = instructions["2"]
+    INSTRUCTION3 = instructions["3"]
+    INSTRUCTION4 = instructions["4"]
+    INSTRUCTION_ORCH = instructions["ORCH"]
+    INSTRUCTION_SYNTH = instructions["SYNTH"]
+    
+    assist1_agent = Agent(
+        name="security_agent",
+        instructions=INSTRUCTION1,
+        handoff_description="The safety and security expert",
+        tools=[
+            FileSearchTool(
+                max_num_results=3,
+                vector_store_ids=[vs_id],
+            )
+        ],
+        model=model,
+    )
+    assist2_agent = Agent(
+        name="hr_agent",
+        instructions=INSTRUCTION2,
+        handoff_description="HR and labor relations representative",
+        tools=[
+            FileSearchTool(
+                max_num_results=3,
+                vector_store_ids=[vs_id],
+            )
+        ],
+        model=model,
+    )
+    assist3_agent = Agent(
+        name="legal_agent",
+        instructions=INSTRUCTION3,
+        handoff_description="The legal advisor",
+        tools=[
+            FileSearchTool(
+                max_num_results=3,
+                vector_store_ids=[vs_id],
+            )
+        ],
+        model=model,
+    )
+    assist4_agent = Agent(
+        name="mental_health_agent",
+        instructions=INSTRUCTION4,
+        handoff_description="The mental health and wellness expert",
+        tools=[
+            FileSearchTool(
+                max_num_results=3,
+                vector_store_ids=[vs_id],
+            )
+        ],
+        model=model,
+    )
+    orchestrator_agent = Agent(
+        name="orchestrator_agent",
+        instructions=(INSTRUCTION_ORCH),
+        tools=[
+            assist1_agent.as_tool(
+                tool_name="security_agent",
+                tool_description="The safety and security expert",
+            ),
+            assist2_agent.as_tool(
+                tool_name="hr_agent",
+                tool_description="HR and labor relations representative",
+            ),
+            assist3_agent.as_tool(
+                tool_name="legal_agent",
+                tool_description="The legal advisor",
+            ),
+            assist4_agent.as_tool(
+                tool_name="mental_health_agent",
+                tool_description="The mental health and wellness expert",
+            ),
+        ],
+        model=model,
+    )
+    synthesizer_agent = Agent(
+        name="synthesizer_agent",
+        instructions=(INSTRUCTION_SYNTH),
+        model=model,
+    )
+    specialists = [assist1_agent, assist2_agent, assist3_agent, assist4_agent]
+    return specialists, orchestrator_agent, synthesizer_agent
+
+# Run one specialist on the query. Returns None if it fails or does not answer
+# within the timeout, so one slow expert doesn't hold up the panel.
+async def run_specialist(agent, query_text, timeout, max_turns=ADVISORY_MAX_TURNS, meter=None):
+    from agents import Runner
+    try:
+        result = await asyncio.wait_for(Runner.run(agent, query_text, max_turns=max_turns), timeout)
+    except Exception:
+        return None
+    if meter is not None:
+        meter.add_usage(result.context_wrapper.usage)
+    return result.final_output
+
+# Run the specialists concurrently and pass their combined perspectives to the
+# synthesizer, so the panel takes about as long as its slowest specialist
+# rather than the sum of all four.
+async def run_panel_parallel(specialists, synthesizer_agent, query_text, timeout, max_turns=ADVISORY_MAX_TURNS, meter=None):
+    with metered_stage(meter, "specialists"):
+        outputs = await asyncio.gather(
+            *[run_specialist(agent, query_text, timeout, max_turns, meter) for agent in specialists]
+        )
+    perspectives = [
+        f"## {agent.handoff_description} ({agent.name})\n{output}"
+        for agent, output in zip(specialists, outputs)
+        if output
+    ]
+    if not perspectives:
+        raise RuntimeError("No advisor answered within the time limit.")
+    synthesizer_input = f"Question: {query_text}\n\n" + "\n\n".join(perspectives)
+    return await run_metered(synthesizer_agent, synthesizer_input, meter, "synthesis", max_turns)
+
+# Run an agent as a timed stage of a metered request and add its usage.
+async def run_metered(agent, agent_input, meter, stage, max_turns=ADVISORY_MAX_TURNS):
+    from agents import Runner
+    with metered_stage(meter, stage):
+        result = await Runner.run(agent, agent_input, max_turns=max_turns)
+    if meter is not None:
+        meter.add_usage(result.context_wrapper.usage)
+    return result
+
+# Consult the panel on the query: the specialists and synthesizer with
+# parallel set, otherwise the orchestrator calling the specialists one at a
+# time and the synthesizer. Returns the synthesized answer text.
+async def run_panel(agents, query_text, parallel, agent_timeout, max_turns, meter=None):
+    specialists, orchestrator_agent, synthesizer_agent = agents
+    if parallel:
+        result = await run_panel_parallel(specialists, synthesizer_agent, query_text, agent_timeout, max_turns, meter)
+    else:
+        orchestrator_result = await run_metered(orchestrator_agent, query_text, meter, "orchestrator", max_turns)
+        result = await run_metered(synthesizer_agent, orchestrator_result.to_input_list(), meter, "synthesis", max_turns)
+    return result.final_output
+
+async def run_fallback(client, model, vs_id, query_text, fallback_instruction, meter=None):
+    with metered_stage(meter, "fallback"):
+        return await fallback_summary_request(client, model, vs_id, query_text, fallback_instruction, meter)
+
+# Initiate AI assistant and create a run to have the assistant answer the user
+# query. agents is the graph from build_advisory_agents and client the pooled
+# async client the fallback is made with. If the panel fails, or hasn't
+# answered hedge_after seconds in, the single-call fallback is started with
+# fallback_instruction and whichever answers first is returned; the other is
+# cancelled. The whole consultation is cancelled with a TimeoutError after
+# deadline seconds. Without hedge_after the fallback only follows a failed
+# panel, and without deadline there is no overall limit. The stages and token
+# usage are added to meter when one is given. Returns an AdvisoryAnswer.
+async def generate_response_cmte(client, model, vs_id, query_text, agents, fallback_instruction, parallel=True,
+                                 agent_timeout=SPECIALIST_TIMEOUT, deadline=None, hedge_after=None,
+                                 max_turns=ADVISORY_MAX_TURNS, meter=None):
+    from agents import trace
+    # Group every agent run of the consultation in one Agents SDK trace; its
+    # agent turns are mirrored into the current tracing span.
+    with trace("Advisory panel"):
+        sources = {
+            asyncio.create_task(run_panel(agents, query_text, parallel, agent_timeout, max_turns, meter)): "panel",
+        }
+        error = None
+        try:
+            async with asyncio.timeout(deadline):
+                pending = set(sources)
+                while pending:
+                    hedging = "fallback" not in sources.values()
+                    done, pending = await asyncio.wait(
+                        pending, timeout=hedge_after if hedging else None,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    for task in done:
+                        if task.exception() is None:
+                            return AdvisoryAnswer(task.result(), sources[task])
+                        error = task.exception()
+                    # Start the fallback once the panel has failed or taken
+                    # longer than hedge_after.
+                    if hedging and (done or hedge_after is not None):
+                        fallback = asyncio.create_task(
+                            run_fallback(client, model, vs_id, query_text, fallback_instruction, meter)
+                        )
+                        sources[fallback] = "fallback"
+                        pending.add(fallback)
+                raise error
+        except TimeoutError as e:
+            if e is error:
+                raise
+            raise TimeoutError(f"The advisory panel did not answer within {deadline} seconds.") from None
+        finally:
+            for task in sources:
+                task.cancel()
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# Local store of library answers, how long an answer stays valid and how many
+# answers are kept before the least recently used ones are evicted.
+ANSWER_CACHE_PATH = Path(".aitam") / "answers.sqlite3"
+ANSWER_CACHE_TTL = 7 * 24 * 3600
+ANSWER_CACHE_MAX_ENTRIES = 5000
+
+
+# Normalize a query so trivially different phrasings of the same question
+# (case, spacing, trailing punctuation) share a cache entry.
+def normalize_query(query_text):
+    text = re.sub(r"\s+", " ", query_text).strip().lower()
+    return text.rstrip("?!. ")
+
+
+def answer_key(query_text, model, temperature, vector_store_id):
+    parts = [normalize_query(query_text), model, repr(float(temperature)), vector_store_id]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+# Persistent cache of library answers keyed on normalized query text, model,
+# temperature and vector store ID. Stores the cleaned answer, the source file
+# names and the token usage of the call that produced it.
+class AnswerCache:
+    def __init__(self, path=ANSWER_CACHE_PATH, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    vector_store_id TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    sources TEXT NOT NULL,
+                    usage TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS answers_store ON answers (vector_store_id)")
+
+    # Return the cached answer as a dict with answer, sources, usage and
+    # created_at, or None if there is no valid entry.
+    def get(self, query_text, model, temperature, vector_store_id):
+        key = answer_key(query_text, model, temperature, vector_store_id)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT answer, sources, usage, created_at FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row[3] > self.ttl:
+                self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+        return {
+            "answer": row[0],
+            "sources": json.loads(row[1]),
+            "usage": json.loads(row[2]),
+            "created_at": row[3],
+        }
+
+    # Store an answer, then evict expired entries and the least recently used
+    # entries beyond max_entries.
+    def put(self, query_text, model, temperature, vector_store_id, answer, sources, usage):
+        key = answer_key(query_text, model, temperature, vector_store_id)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, vector_store_id, model, query_text, answer,
+                 json.dumps(sorted(sources)), json.dumps(usage), now, now),
+            )
+            if self.ttl is not None:
+                self._conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                """
+                DELETE FROM answers WHERE key IN (
+                    SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    # Drop the cached answers for one vector store, or all answers, e.g. after
+    # the store's contents change. Returns the number of answers removed.
+    def invalidate(self, vector_store_id=None):
+        with self._lock, self._conn:
+            if vector_store_id is None:
+                cursor = self._conn.execute("DELETE FROM answers")
+            else:
+                cursor = self._conn.execute(
+                    "DELETE FROM answers WHERE vector_store_id = ?", (vector_store_id,)
+                )
+        return cursor.rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
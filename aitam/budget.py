@@ -0,0 +1,216 @@
+import contextvars
+import itertools
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from functools import lru_cache
+
+# Price in dollars per million input, output and cached input tokens.
+MODEL_PRICES = {
+    "gpt-4.1-nano": (0.10, 0.40, 0.025),
+    "gpt-4o-mini": (0.15, 0.60, 0.075),
+    "gpt-4.1": (2.00, 8.00, 0.50),
+    "gpt-4.1-mini": (0.40, 1.60, 0.10),
+    "o4-mini": (1.10, 4.40, 0.275),
+}
+# Documents over this many tokens are condensed by map-reduce summarization
+# before Standard Examination.
+DOC_TOKEN_BUDGET = 100_000
+# Tokens per map chunk, the number of chunks summarized at once, and the most
+# chunks condensed per document. Text past the last chunk is left out, so
+# condensing stays bounded on very large documents.
+CHUNK_TOKENS = 12_000
+MAP_WORKERS = 8
+MAX_MAP_CHUNKS = 40
+# Most document tokens file_search puts in front of the model per call, and
+# the answer length assumed for estimates.
+FILE_SEARCH_CONTEXT_TOKENS = 16_000
+EXPECTED_OUTPUT_TOKENS = 1_000
+# Lines tokenized together when counting a document.
+COUNT_BATCH_LINES = 2_000
+
+MAP_INSTRUCTIONS = (
+    "You are condensing one part of a larger document for a threat assessment "
+    "review. Extract every fact that could matter: people, roles, dates, places, "
+    "threats, weapons, grievances, behaviors, incidents and their outcomes. Keep "
+    "names, dates and quoted wording verbatim. Use short bullet points and do "
+    "not add commentary."
+)
+REDUCE_INSTRUCTIONS = (
+    "Merge these condensed notes from consecutive parts of one document into a "
+    "single set of notes for a threat assessment review. Remove duplicates, keep "
+    "names, dates and quoted wording verbatim, and keep events in order."
+)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text, model):
+    return len(get_encoding(model).encode_ordinary(text))
+
+
+# Dollar cost of a call, or None for a model without a known price.
+# cached_tokens is the part of input_tokens served from the prompt cache.
+def estimate_cost(model, input_tokens, output_tokens, cached_tokens=0):
+    if model not in MODEL_PRICES:
+        return None
+    input_price, output_price, cached_price = MODEL_PRICES[model]
+    return (
+        (input_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + output_tokens * output_price
+    ) / 1_000_000
+
+
+# Lines of a text document buffer, read from the file without loading it.
+def iter_lines(document):
+    for line in document.open():
+        yield line.decode("utf-8", errors="replace")
+
+
+# Count a document's tokens a batch of lines at a time, so memory stays
+# bounded for spooled documents that spilled to disk.
+def count_document_tokens(document, model):
+    encoding = get_encoding(model)
+    total = 0
+    batch = []
+    for line in iter_lines(document):
+        batch.append(line)
+        if len(batch) == COUNT_BATCH_LINES:
+            total += sum(len(tokens) for tokens in encoding.encode_ordinary_batch(batch))
+            batch = []
+    if batch:
+        total += sum(len(tokens) for tokens in encoding.encode_ordinary_batch(batch))
+    return total
+
+
+# Token counts and cost estimates for examining a document.
+@dataclass
+class Preflight:
+    model: str
+    document_tokens: int
+    query_tokens: int
+    input_tokens: int
+    estimated_cost: float
+    over_budget: bool
+    chunks: int
+    map_reduce_cost: float
+    skipped_chunks: int
+
+
+# Count tokens for the document and query and estimate the cost of the call.
+# file_search only shows the model part of a large document, so the estimate
+# caps the document's contribution at FILE_SEARCH_CONTEXT_TOKENS. Over the
+# budget, the estimate also covers condensing the document first, in at most
+# max_chunks chunks; skipped_chunks are the ones past that which are left out.
+def preflight(document, query_text, model, budget=DOC_TOKEN_BUDGET, chunk_tokens=CHUNK_TOKENS, max_chunks=MAX_MAP_CHUNKS):
+    document_tokens = count_document_tokens(document, model)
+    query_tokens = count_tokens(query_text, model)
+    input_tokens = query_tokens + min(document_tokens, FILE_SEARCH_CONTEXT_TOKENS)
+    over_budget = document_tokens > budget
+    total_chunks = -(-document_tokens // chunk_tokens) if over_budget else 0
+    chunks = min(total_chunks, max_chunks)
+    map_reduce_cost = 0.0
+    if over_budget:
+        map_reduce_cost = estimate_cost(
+            model, min(document_tokens, chunks * chunk_tokens), chunks * EXPECTED_OUTPUT_TOKENS
+        ) or 0.0
+    return Preflight(
+        model=model,
+        document_tokens=document_tokens,
+        query_tokens=query_tokens,
+        input_tokens=input_tokens,
+        estimated_cost=estimate_cost(model, input_tokens, EXPECTED_OUTPUT_TOKENS) or 0.0,
+        over_budget=over_budget,
+        chunks=chunks,
+        map_reduce_cost=map_reduce_cost,
+        skipped_chunks=total_chunks - chunks,
+    )
+
+
+# Split text lines into chunks of at most chunk_tokens tokens, keeping lines
+# (spreadsheet row records, OCR lines) whole unless a single line is too long.
+def split_chunks(lines, model, chunk_tokens=CHUNK_TOKENS):
+    encoding = get_encoding(model)
+    chunk, size = [], 0
+    for line in lines:
+        tokens = encoding.encode_ordinary(line)
+        if len(tokens) > chunk_tokens:
+            if chunk:
+                yield "".join(chunk)
+                chunk, size = [], 0
+            for start in range(0, len(tokens), chunk_tokens):
+                yield encoding.decode(tokens[start:start + chunk_tokens])
+            continue
+        if size + len(tokens) > chunk_tokens:
+            yield "".join(chunk)
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(tokens)
+    if chunk:
+        yield "".join(chunk)
+
+
+def summarize(client, model, instructions, text, meter=None):
+    response = client.responses.create(
+        model=model,
+        instructions=instructions,
+        input=text,
+        temperature=0.2,
+    )
+    if meter is not None:
+        meter.add_usage(response.usage)
+    return response.output_text
+
+
+# Condense a document that is over the token budget: summarize its first
+# max_chunks chunks in parallel (map), then merge the notes (reduce), repeating
+# the reduce step until the result fits the budget. Returns the condensed text.
+# With a timeout in seconds, raises TimeoutError once it has passed; on that or
+# a failed call the summaries not started yet are cancelled rather than billed.
+# The usage of every call is added to meter when one is given.
+def map_reduce_document(client, model, lines, budget=DOC_TOKEN_BUDGET, chunk_tokens=CHUNK_TOKENS,
+                        workers=MAP_WORKERS, max_chunks=MAX_MAP_CHUNKS, timeout=None, meter=None):
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    pool = ThreadPoolExecutor(max_workers=workers)
+
+    # Each call runs in a copy of the caller's context, so it is rate limited,
+    # metered and traced as part of the request condensing the document.
+    def summarize_all(instructions, texts):
+        futures = [
+            pool.submit(contextvars.copy_context().run, summarize, client, model, instructions, text, meter)
+            for text in texts
+        ]
+        remaining = max(deadline - time.monotonic(), 0) if deadline is not None else None
+        done, pending = wait(futures, timeout=remaining, return_when=FIRST_EXCEPTION)
+        if pending:
+            for future in pending:
+                future.cancel()
+            # A failed call stopped the wait early; otherwise time ran out.
+            for future in done:
+                future.result()
+            raise TimeoutError(f"Condensing the document did not finish within {timeout} seconds.")
+        return [future.result() for future in futures]
+
+    try:
+        notes = summarize_all(MAP_INSTRUCTIONS, itertools.islice(split_chunks(lines, model, chunk_tokens), max_chunks))
+        while len(notes) > 1:
+            digest = "\n\n".join(f"## Part {i}\n{note}" for i, note in enumerate(notes, start=1))
+            if count_tokens(digest, model) <= budget:
+                return digest
+            groups = list(split_chunks((note + "\n\n" for note in notes), model, chunk_tokens))
+            if len(groups) >= len(notes):
+                # The notes no longer shrink when grouped; stop rather than loop.
+                return digest
+            notes = summarize_all(REDUCE_INSTRUCTIONS, groups)
+    finally:
+        # Summaries already running finish in the background.
+        pool.shutdown(wait=False, cancel_futures=True)
+    return notes[0] if notes else ""
@@ -0,0 +1,101 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+from functools import lru_cache
+
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+from aitam.ratelimit import AsyncScheduledTransport, ScheduledTransport
+
+# Connection pool, timeout and retry policy shared by every OpenAI call made
+# from this server process. Idle connections are kept alive so reruns of the
+# page reuse them instead of paying a new TLS handshake.
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 60.0
+TIMEOUT = httpx.Timeout(300.0, connect=10.0)
+MAX_RETRIES = 3
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+# Pooled sync client, created once per process and api key. Model requests
+# go through the process-wide rate limit scheduler.
+@lru_cache(maxsize=None)
+def get_openai_client(api_key):
+    return OpenAI(
+        api_key=api_key,
+        timeout=TIMEOUT,
+        max_retries=MAX_RETRIES,
+        http_client=openai.DefaultHttpxClient(
+            transport=ScheduledTransport(httpx.HTTPTransport(limits=_limits())), timeout=TIMEOUT,
+        ),
+    )
+
+
+# Pooled async client, created once per process and api key, scheduled like
+# the sync client. Its connections belong to the shared event loop, so
+# coroutines using it must be run with run_async rather than asyncio.run.
+@lru_cache(maxsize=None)
+def get_async_openai_client(api_key):
+    return AsyncOpenAI(
+        api_key=api_key,
+        timeout=TIMEOUT,
+        max_retries=MAX_RETRIES,
+        http_client=openai.DefaultAsyncHttpxClient(
+            transport=AsyncScheduledTransport(httpx.AsyncHTTPTransport(limits=_limits())), timeout=TIMEOUT,
+        ),
+    )
+
+
+# Event loop running in a daemon thread for the life of the process. Streamlit
+# reruns the script on a new thread each time, and asyncio.run would close the
+# loop the async client's connections were opened on.
+def get_event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="openai-event-loop", daemon=True)
+            thread.start()
+    return _loop
+
+
+# Run the coroutine as a task in the given context.
+async def _run_in_context(coro, context):
+    return await asyncio.get_running_loop().create_task(coro, context=context)
+
+
+# Run a coroutine on the shared event loop and wait for its result. The
+# coroutine runs in a copy of the caller's context, so context variables such
+# as the current tracing span carry over to the loop thread. It is cancelled
+# if it does not finish within the timeout.
+def run_async(coro, timeout=None):
+    context = contextvars.copy_context()
+    future = asyncio.run_coroutine_threadsafe(_run_in_context(coro, context), get_event_loop())
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise TimeoutError(f"Operation did not complete within {timeout} seconds.")
+
+
+# Point the Agents SDK at the pooled async client, and mirror its spans into
+# our traces. The SDK is imported here, on first use of the advisory panel.
+def configure_agents(api_key):
+    from agents import set_default_openai_client
+    from aitam.tracing import register_agent_tracing
+    set_default_openai_client(get_async_openai_client(api_key))
+    register_agent_tracing()
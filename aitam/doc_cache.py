@@ -0,0 +1,160 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+# Default lifetime of a cached document and the number of documents kept
+# before the least recently used one is evicted.
+DEFAULT_TTL = 3600
+DEFAULT_MAX_ENTRIES = 32
+
+
+# A document already uploaded to openai storage and indexed in a vector store.
+# references counts the requests using it right now; such an entry is never
+# evicted.
+@dataclass
+class CachedDocument:
+    key: str
+    file_id: str
+    vector_store_id: str
+    created_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    references: int = 0
+
+
+# Content address of a document: the sha256 of the extracted bytes plus the
+# file purpose, since "assistants" and "user_data" uploads are separate openai
+# files.
+def document_key(content_sha256, purpose):
+    return hashlib.sha256(f"{purpose}\0{content_sha256}".encode()).hexdigest()
+
+
+# Process-wide cache mapping document keys to openai file and vector store ids.
+# Entries expire once unused for the ttl or, however often used, max_age after
+# they were created (before the uploaded file expires server side), and the
+# least recently used entry is evicted once max_entries is reached. Evicted entries are passed to on_evict
+# so the remote file and vector store can be deleted. Entries handed out with
+# pin set stay until released, even past the ttl or max_entries, and an entry
+# invalidated while pinned is cleaned up on its last release.
+class DocumentCache:
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, on_evict=None, max_age=None):
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per key being created, so two sessions submitting the same
+        # document upload it once.
+        self._pending = {}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _expired(self, entry, now):
+        return (
+            (self.ttl is not None and now - entry.last_used > self.ttl)
+            or (self.max_age is not None and now - entry.created_at > self.max_age)
+        )
+
+    # Remove expired entries and entries beyond max_entries, least recently
+    # used first, skipping pinned entries. Must be called with the lock held;
+    # returns the removed entries for cleanup.
+    def _collect_evictions(self, now):
+        evicted = [
+            entry for entry in self._entries.values()
+            if not entry.references and self._expired(entry, now)
+        ]
+        for entry in evicted:
+            del self._entries[entry.key]
+        excess = len(self._entries) - self.max_entries
+        for entry in list(self._entries.values()):
+            if excess <= 0:
+                break
+            if not entry.references:
+                del self._entries[entry.key]
+                evicted.append(entry)
+                excess -= 1
+        return evicted
+
+    # Remote cleanup is best effort and runs outside the lock.
+    def _evict(self, entries):
+        if self.on_evict is None:
+            return
+        for entry in entries:
+            try:
+                self.on_evict(entry)
+            except Exception:
+                pass
+
+    def get(self, key, pin=False):
+        now = time.time()
+        with self._lock:
+            evicted = self._collect_evictions(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.last_used = now
+                entry.references += pin
+                self._entries.move_to_end(key)
+        self._evict(evicted)
+        return entry
+
+    def put(self, key, file_id, vector_store_id, pin=False):
+        entry = CachedDocument(key=key, file_id=file_id, vector_store_id=vector_store_id, references=int(pin))
+        with self._lock:
+            replaced = self._entries.pop(key, None)
+            self._entries[key] = entry
+            evicted = self._collect_evictions(entry.created_at)
+            if replaced is not None and not replaced.references:
+                evicted.append(replaced)
+        self._evict(evicted)
+        return entry
+
+    # Return the cached entry for key, or call create() -> (file_id,
+    # vector_store_id) to upload and index the document and cache the result.
+    # With pin set the entry is held for the caller until release(entry).
+    def get_or_create(self, key, create, pin=False):
+        entry = self.get(key, pin)
+        if entry is not None:
+            return entry
+        with self._lock:
+            key_lock = self._pending.setdefault(key, threading.Lock())
+        with key_lock:
+            try:
+                entry = self.get(key, pin)
+                if entry is None:
+                    file_id, vector_store_id = create()
+                    entry = self.put(key, file_id, vector_store_id, pin)
+            finally:
+                with self._lock:
+                    self._pending.pop(key, None)
+        return entry
+
+    # Give back an entry pinned by get or get_or_create. Its ttl counts from
+    # now, and an entry dropped from the cache meanwhile is cleaned up once
+    # its last user releases it.
+    def release(self, entry):
+        now = time.time()
+        with self._lock:
+            entry.references -= 1
+            entry.last_used = now
+            dropped = not entry.references and self._entries.get(entry.key) is not entry
+            evicted = self._collect_evictions(now)
+            if dropped:
+                evicted.append(entry)
+        self._evict(evicted)
+
+    # Drop one entry (or all entries) and clean up their remote resources.
+    # Pinned entries are cleaned up when released instead.
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                evicted = list(self._entries.values())
+                self._entries.clear()
+            else:
+                entry = self._entries.pop(key, None)
+                evicted = [entry] if entry is not None else []
+            evicted = [entry for entry in evicted if not entry.references]
+        self._evict(evicted)
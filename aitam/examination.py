@@ -0,0 +1,337 @@
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import openai
+
+from aitam.budget import DOC_TOKEN_BUDGET, iter_lines, map_reduce_document
+from aitam.clients import get_openai_client
+from aitam.doc_cache import document_key
+from aitam.ingest import DocumentBuffer
+from aitam.metering import metered_stage
+from aitam.ratelimit import get_scheduler
+from aitam.retrieval import answer_from_chunks
+from aitam.tracing import span
+
+# Query sent with every Standard Examination.
+STANDARD_EXAMINATION_QUERY = "I need your help analyzing the uploaded document."
+# Default time a run may take before it is cancelled, in seconds.
+RUN_TIMEOUT = 300
+# Times a run failed by the rate limit is retried, and the pause before the
+# first retry in seconds, growing with each retry.
+RUN_RATE_LIMIT_RETRIES = 2
+RUN_RATE_LIMIT_PAUSE = 10.0
+# Interval between checks of a vector store file batch being indexed.
+VECTOR_STORE_POLL_MS = 500
+# Tools of examination runs. The document's vector store comes with the thread.
+FILE_SEARCH_TOOLS = [{"type": "file_search"}]
+# Run stream events after which the run will make no further progress.
+RUN_FINAL_EVENTS = (
+    "thread.run.completed",
+    "thread.run.failed",
+    "thread.run.cancelled",
+    "thread.run.expired",
+    "thread.run.incomplete",
+    "thread.run.requires_action",
+)
+
+# Cancel a run that overran its deadline and raise. Cancelling is best effort,
+# the run is abandoned either way.
+def cancel_run(client, run, thread, timeout):
+    try:
+        client.beta.threads.runs.cancel(thread_id=thread.id, run_id=run.id)
+    except openai.OpenAIError:
+        pass
+    raise TimeoutError(f"Run {run.id} did not complete within {timeout} seconds.")
+
+# Wait until run process completion. Polls with an adaptive backoff (short
+# first, up to 2 s between polls) and cancels the run once the deadline passes.
+def wait_on_run(client, run, thread, timeout=RUN_TIMEOUT, deadline=None):
+    if deadline is None:
+        deadline = time.monotonic() + timeout
+    delay = 0.2
+    while run.status == "queued" or run.status == "in_progress":
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            cancel_run(client, run, thread, timeout)
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 1.5, 2.0)
+        run = client.beta.threads.runs.retrieve(
+            thread_id=thread.id,
+            run_id=run.id,
+        )
+    return run
+
+# Retrieve messages from the thread. When a run is given, only the messages
+# added by the assistant during that run are returned.
+def get_response(client, thread, run=None):
+    if run is None:
+        return client.beta.threads.messages.list(thread_id=thread.id, order="asc")
+    return client.beta.threads.messages.list(thread_id=thread.id, order="asc", run_id=run.id)
+
+# A run that failed on the organization's rate limit, rather than on its own.
+def rate_limited_run(run):
+    return run.status == "failed" and run.last_error is not None and run.last_error.code == "rate_limit_exceeded"
+
+# Create a run and follow its event stream, returning the run and the messages
+# added by the assistant as soon as the run reaches a final state. tools
+# overrides the assistant's tools for this run. If the stream drops before
+# then, falls back to polling the run until the deadline. A run failed by the
+# rate limit is retried after holding back every request of the process for
+# a growing pause.
+def stream_run(client, thread, assistant_id, timeout=RUN_TIMEOUT, tools=openai.NOT_GIVEN):
+    deadline = time.monotonic() + timeout
+    for attempt in range(RUN_RATE_LIMIT_RETRIES + 1):
+        run = None
+        messages = []
+        try:
+            with client.beta.threads.runs.stream(
+                thread_id=thread.id,
+                assistant_id=assistant_id,
+                tools=tools,
+                timeout=max(deadline - time.monotonic(), 1),
+            ) as stream:
+                for event in stream:
+                    if event.event == "thread.run.created":
+                        run = event.data
+                    elif event.event == "thread.message.completed":
+                        messages.append(event.data)
+                    elif event.event in RUN_FINAL_EVENTS:
+                        run = event.data
+                        break
+                    if run is not None and time.monotonic() > deadline:
+                        cancel_run(client, run, thread, timeout)
+        except (openai.APIConnectionError, openai.APITimeoutError):
+            # The run continues server side, so poll for it if it was created.
+            if run is None:
+                raise
+            with span("wait_on_run", fallback=True):
+                run = wait_on_run(client, run, thread, timeout=timeout, deadline=deadline)
+            messages = list(get_response(client, thread, run))
+        pause = RUN_RATE_LIMIT_PAUSE * (attempt + 1)
+        if not rate_limited_run(run) or time.monotonic() + pause >= deadline:
+            break
+        get_scheduler().rate_limited(pause)
+    return run, messages
+
+# Detach the vector stores of a shared assistant. Examination runs get their
+# document's vector store on the thread, and file_search would search the
+# assistant's own stores as well, such as the store of whichever document it
+# was last pointed at.
+def detach_assistant_stores(client, assistant_id):
+    with span("assistants.update"):
+        client.beta.assistants.update(
+            assistant_id,
+            tool_resources={"file_search": {"vector_store_ids": []}},
+        )
+
+# Upload the document to openai storage and add it to a new vector store, or
+# reuse the file and vector store created for an earlier submit of the same
+# document. document is a DocumentBuffer from the extraction functions. With a
+# lifecycle manager the file and vector store get a server-side expiry and are
+# released if indexing fails. Returns the cache entry pinned for the caller,
+# who releases it with doc_cache.release(entry) once done searching the
+# vector store, so it isn't evicted and deleted in the middle of a run.
+def get_document_vector_store(client, document, purpose, doc_cache, lifecycle=None):
+    key = document_key(document.sha256, purpose)
+
+    def create():
+        file = vector_store = None
+        try:
+            # Create file at openai storage from the uploaded file.
+            with span("files.create", bytes=document.size, purpose=purpose):
+                if lifecycle is not None:
+                    file = lifecycle.create_file((document.name, document.open()), purpose)
+                else:
+                    file = client.files.create(
+                        file=(document.name, document.open()),
+                        purpose=purpose
+                    )
+            # Create vector store for processing by assistant.
+            with span("vector_stores.create"):
+                if lifecycle is not None:
+                    vector_store = lifecycle.create_vector_store()
+                else:
+                    vector_store = client.vector_stores.create(
+                        name="aitam"
+                    )
+            # Add the file to the vector store and wait for it to be indexed.
+            with span("vector_stores.index"):
+                batch_add = client.vector_stores.file_batches.create_and_poll(
+                    vector_store_id=str(vector_store.id),
+                    file_ids=[str(file.id)],
+                    poll_interval_ms=VECTOR_STORE_POLL_MS,
+                )
+            # A store whose file failed to index would be searched empty, so
+            # it is released instead of cached.
+            if batch_add.status != "completed" or batch_add.file_counts.completed < 1:
+                raise RuntimeError(f"Indexing {document.name} ended with status {batch_add.status}.")
+        except BaseException:
+            if lifecycle is not None:
+                lifecycle.release(file and file.id, vector_store and vector_store.id)
+            raise
+        return str(file.id), str(vector_store.id)
+
+    return doc_cache.get_or_create(key, create, pin=True)
+
+# Start client, create file and add it to the openai vector store, start a
+# thread searching that vector store, and create a run to have the assistant
+# process it. The vector store is attached to the thread rather than the shared
+# assistant, so concurrent runs each search their own document. The stages and
+# token usage are added to meter when one is given. Files and vector stores
+# are created through the lifecycle manager when one is given.
+def generate_response(document, openai_api_key, model, assistant_id, query_text, doc_cache, stream=True, timeout=RUN_TIMEOUT, meter=None, lifecycle=None):    
+    # Check file existence.
+    if document is not None:
+        # Get the pooled client.
+        client = get_openai_client(openai_api_key)
+        # Obtain file and vector store ids, uploading the file only if this
+        # document is not already cached.
+        with metered_stage(meter, "upload"):
+            entry = get_document_vector_store(client, document, "assistants", doc_cache, lifecycle)
+        TMP_FILE_ID, TMP_VECTOR_STORE_ID = entry.file_id, entry.vector_store_id
+        try:
+            # Start thread with the query, pointed to the vector store.
+            with span("threads.create"):
+                thread = client.beta.threads.create(
+                    messages=[{"role": "user", "content": query_text}],
+                    tool_resources={
+                        "file_search":{
+                            "vector_store_ids": [TMP_VECTOR_STORE_ID]
+                        }
+                    }
+                )
+            with metered_stage(meter, "run"):
+                if stream:
+                    # Create a run and take the assistant's messages from its
+                    # event stream as soon as it completes.
+                    run, messages = stream_run(client, thread, assistant_id, timeout=timeout, tools=FILE_SEARCH_TOOLS)
+                else:
+                    # Create a run to have assistant process the vector store file.
+                    run = client.beta.threads.runs.create(
+                        thread_id=thread.id,
+                        assistant_id=assistant_id,
+                        tools=FILE_SEARCH_TOOLS,
+                    )
+                    # Wait on the run to complete, then retrieve messages from the run.
+                    with span("wait_on_run"):
+                        run = wait_on_run(client, run, thread, timeout=timeout)
+                    messages = list(get_response(client, thread, run))
+        finally:
+            doc_cache.release(entry)
+        if meter is not None:
+            meter.add_usage(run.usage)
+    return messages, TMP_FILE_ID, TMP_VECTOR_STORE_ID, client, run, thread
+
+# Standard Examination of a document. With condense set (a document over the
+# token budget) the document is condensed by map-reduce summarization first, so
+# the examination stays bounded in time; condensing gets the same timeout as
+# the run. Returns the assistant's messages and the run.
+def standard_examination(document, openai_api_key, model, assistant_id, doc_cache, budget=DOC_TOKEN_BUDGET, condense=False, timeout=RUN_TIMEOUT, meter=None, lifecycle=None):
+    exam_document = document
+    if condense:
+        with metered_stage(meter, "condense"):
+            digest = map_reduce_document(get_openai_client(openai_api_key), model, iter_lines(document), budget=budget, timeout=timeout, meter=meter)
+        exam_document = DocumentBuffer(Path(document.name).stem + ".condensed.txt")
+        exam_document.write(digest)
+    try:
+        (messages, TMP_FILE_ID, TMP_VECTOR_STORE_ID, client, run, thread) = generate_response(exam_document, openai_api_key, model, assistant_id, STANDARD_EXAMINATION_QUERY, doc_cache, timeout=timeout, meter=meter, lifecycle=lifecycle)
+    finally:
+        if exam_document is not document:
+            exam_document.close()
+    return messages, run
+
+# Custom queries about one document in a session, chained so each question
+# follows up on the earlier ones: the last response of the conversation, the
+# local chunks already sent in it, or the Standard Examination thread it
+# continues, and the questions and answers so far.
+@dataclass
+class Conversation:
+    document_sha256: str
+    response_id: str = None
+    sent_chunks: set = field(default_factory=set)
+    thread_id: str = None
+    turns: list = field(default_factory=list)
+
+# Constructed similar to above, exempt no use of the assistant. This calls the 
+# llm with a user's query about the vector store. The file and vector store are
+# reused from the document cache when the same document was already submitted.
+# With a local ChunkIndex of the document, its best matching chunks are sent
+# with the query instead and nothing is uploaded; the file and vector store
+# ids are then None. With a conversation, the query follows up on its last
+# response through previous_response_id, so earlier excerpts and answers stay
+# in context server side and only chunks not sent before are added.
+def generate_response_noassist(document, openai_api_key, model, query_text, doc_cache, meter=None, lifecycle=None, index=None, conversation=None):    
+    previous_response_id = conversation.response_id if conversation is not None else None
+    TMP_FILE_ID = TMP_VECTOR_STORE_ID = None
+    # Check file existence.
+    if document is not None:
+        # Get the pooled client.
+        client = get_openai_client(openai_api_key)
+        if index is not None:
+            with metered_stage(meter, "retrieve", chunks=len(index.chunks)):
+                numbers = index.search(query_text)
+                if conversation is not None:
+                    numbers = [number for number in numbers if number not in conversation.sent_chunks]
+            with metered_stage(meter, "response"):
+                messages = answer_from_chunks(
+                    client, model, query_text, [index.chunks[number] for number in numbers],
+                    meter, previous_response_id,
+                )
+            if conversation is not None:
+                conversation.sent_chunks.update(numbers)
+        else:
+            # Obtain file and vector store ids, uploading the file only if this
+            # document is not already cached.
+            with metered_stage(meter, "upload"):
+                entry = get_document_vector_store(client, document, "user_data", doc_cache, lifecycle)
+            TMP_FILE_ID, TMP_VECTOR_STORE_ID = entry.file_id, entry.vector_store_id
+            # Get messages from client based on user query of the vector store.
+            try:
+                with metered_stage(meter, "response"):
+                    messages = client.responses.create(
+                        input = query_text,
+                        model = model,
+                        temperature = 1,
+                        tools = [{
+                            "type": "file_search",
+                            "vector_store_ids": [TMP_VECTOR_STORE_ID],
+                        }],
+                        previous_response_id = previous_response_id,
+                    )
+            finally:
+                doc_cache.release(entry)
+            if meter is not None:
+                meter.add_usage(messages.usage)
+        if conversation is not None:
+            conversation.response_id = messages.id
+            conversation.turns.append((query_text, messages.output_text))
+    return messages, TMP_FILE_ID, TMP_VECTOR_STORE_ID, client
+
+# Ask a follow-up question on the thread of a finished Standard Examination,
+# so the examination and earlier follow-ups stay in the assistant's context and
+# the document's existing vector store is searched again without a new upload.
+# The vector store is attached to the thread again, since the cache may have
+# uploaded the document anew since the examination. Returns the assistant's
+# messages and the run.
+def follow_up_examination(document, openai_api_key, assistant_id, query_text, doc_cache, conversation, timeout=RUN_TIMEOUT, meter=None, lifecycle=None):
+    client = get_openai_client(openai_api_key)
+    with metered_stage(meter, "upload"):
+        entry = get_document_vector_store(client, document, "assistants", doc_cache, lifecycle)
+    try:
+        with span("threads.update"):
+            thread = client.beta.threads.update(
+                conversation.thread_id,
+                tool_resources={"file_search": {"vector_store_ids": [entry.vector_store_id]}},
+            )
+        client.beta.threads.messages.create(
+            thread_id=thread.id, role="user", content=query_text
+        )
+        with metered_stage(meter, "run"):
+            run, messages = stream_run(client, thread, assistant_id, timeout=timeout, tools=FILE_SEARCH_TOOLS)
+    finally:
+        doc_cache.release(entry)
+    if meter is not None:
+        meter.add_usage(run.usage)
+    conversation.turns.append((query_text, "\n\n".join(m.content[0].text.value for m in messages)))
+    return messages, run
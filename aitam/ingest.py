@@ -0,0 +1,236 @@
+import hashlib
+import tempfile
+from pathlib import Path
+
+# pandas, openpyxl, PyPDF2 and the OCR stack are imported by the extractors
+# that need them, so importing this module stays cheap.
+
+# Rows converted and written per batch. Bounds memory use no matter how large
+# the workbook is.
+EXCEL_BATCH_ROWS = 5000
+# Keys every row record has besides the sheet's own columns.
+EXCEL_RECORD_KEYS = ("sheet", "row", "combined_text")
+
+# Extracted documents up to this size stay in memory; larger ones spill to an
+# anonymous temporary file. Documents over the cap are refused.
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+MAX_DOCUMENT_BYTES = 256 * 1024 * 1024
+# Chunk size used when copying and hashing files.
+COPY_CHUNK_BYTES = 1024 * 1024
+
+# An extracted document held in a spooled buffer owned by one session, ready
+# to be passed to files.create. Tracks its size and sha256 as it is written.
+class DocumentBuffer:
+    def __init__(self, name, max_size=MAX_DOCUMENT_BYTES):
+        self.name = name
+        self.max_size = max_size
+        self.size = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode="w+b")
+        self._digest = hashlib.sha256()
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise ValueError(
+                f"{self.name} is larger than the {self.max_size // (1024 * 1024):,} MB document limit."
+            )
+        self._digest.update(data)
+        self.file.write(data)
+
+    # Copy a binary file object into the buffer in chunks.
+    def write_from(self, source):
+        while chunk := source.read(COPY_CHUNK_BYTES):
+            self.write(chunk)
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    # True once the buffer has spilled from memory to disk.
+    @property
+    def on_disk(self):
+        return self.file._rolled
+
+    # The buffer rewound for reading, e.g. as the file passed to files.create.
+    def open(self):
+        self.file.seek(0)
+        return self.file
+
+    def read_bytes(self):
+        return self.open().read()
+
+    def read_text(self):
+        return self.read_bytes().decode("utf-8", errors="replace")
+
+    def close(self):
+        self.file.close()
+
+# Name of the extracted document, from the upload's name and the output type.
+def document_name(uploaded_file, suffix):
+    name = uploaded_file if isinstance(uploaded_file, (str, Path)) else getattr(uploaded_file, "name", "document")
+    return Path(name).stem + suffix
+
+# Column names from a sheet's header row. Blank headers are named by position
+# and duplicates (including the record keys above) get a numeric suffix.
+def excel_column_names(header, width):
+    names = []
+    seen = set(EXCEL_RECORD_KEYS)
+    for i in range(width):
+        value = header[i] if i < len(header) else None
+        name = str(value).strip() if value is not None else ""
+        if not name:
+            name = f"column_{i + 1}"
+        base, n = name, 1
+        while name in seen:
+            name = f"{base}_{n}"
+            n += 1
+        seen.add(name)
+        names.append(name)
+    return names
+
+# Write one compact JSON record per non-empty row of a batch. The row text is
+# built column by column with vectorized string operations.
+def write_excel_batch(output, sheet_name, header, rows, first_row):
+    import pandas as pd
+    df = pd.DataFrame(rows, dtype=object)
+    df.columns = excel_column_names(header, len(df.columns))
+    df = df.fillna("").astype(str)
+    combined_text = df.iloc[:, 0]
+    for column in df.columns[1:]:
+        combined_text = combined_text.str.cat(df[column], sep=" ")
+    combined_text = combined_text.str.strip()
+    df.insert(0, "sheet", sheet_name)
+    df.insert(1, "row", range(first_row, first_row + len(df)))
+    df["combined_text"] = combined_text
+    df = df[combined_text != ""]
+    if len(df):
+        records = df.to_json(orient="records", lines=True, force_ascii=False)
+        output.write(records if records.endswith("\n") else records + "\n")
+
+# Stream every sheet of the workbook through openpyxl read-only mode and write
+# one JSON record per row to a document buffer, in batches of EXCEL_BATCH_ROWS
+# rows.
+def extract_text_from_excel(uploaded_file):
+    import openpyxl
+    output = DocumentBuffer(document_name(uploaded_file, ".txt"))
+    workbook = openpyxl.load_workbook(uploaded_file, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            batch = []
+            # Spreadsheet row numbers, the header being row 1.
+            first_row = 2
+            for row in rows:
+                batch.append(row)
+                if len(batch) == EXCEL_BATCH_ROWS:
+                    write_excel_batch(output, sheet.title, header, batch, first_row)
+                    first_row += len(batch)
+                    batch = []
+            if batch:
+                write_excel_batch(output, sheet.title, header, batch, first_row)
+    except BaseException:
+        output.close()
+        raise
+    finally:
+        workbook.close()
+    return output
+
+# Pass the uploaded PDF through unchanged. Parsing and re-serializing every
+# page produced an identical document at a cost proportional to its size.
+def copy_pdf(uploaded_file):
+    output = DocumentBuffer(document_name(uploaded_file, ".pdf"))
+    try:
+        if isinstance(uploaded_file, (str, Path)):
+            with open(uploaded_file, "rb") as source:
+                output.write_from(source)
+        else:
+            uploaded_file.seek(0)
+            output.write_from(uploaded_file)
+    except BaseException:
+        output.close()
+        raise
+    return output
+
+# Pages with less extracted text than this are treated as scanned images.
+PDF_MIN_PAGE_TEXT = 20
+
+# OCR the images embedded in a page that has no usable text layer. Images
+# in formats PIL cannot decode are skipped.
+def ocr_pdf_page(page):
+    from aitam.ocr import ocr_image, ocr_images
+    try:
+        images = [image_file.data for image_file in page.images]
+    except Exception:
+        return ""
+    try:
+        texts = ocr_images(images)
+    except Exception:
+        # One undecodable image fails the batch; OCR the rest one by one.
+        texts = []
+        for data in images:
+            try:
+                texts.append(ocr_image(data))
+            except Exception:
+                continue
+    return "\n".join(text for text in texts if text)
+
+# Extract the text of the PDF one page at a time and write it to a document
+# buffer. With ocr set, pages without a text layer (scanned letters) are OCRed
+# so the vector store gets their text; other pages are not touched.
+def extract_pdf_text(uploaded_file, ocr=True):
+    from PyPDF2 import PdfReader
+    output = DocumentBuffer(document_name(uploaded_file, ".txt"))
+    try:
+        reader = PdfReader(uploaded_file)
+        for number, page in enumerate(reader.pages, start=1):
+            text = (page.extract_text() or "").strip()
+            if ocr and len(text) < PDF_MIN_PAGE_TEXT:
+                text = ocr_pdf_page(page) or text
+            output.write(f"--- Page {number} ---\n{text}\n\n")
+    except BaseException:
+        output.close()
+        raise
+    return output
+
+# OCR every frame of an uploaded image (HEIF/HEIC, multi-page TIFF, JPEG,
+# PNG) and write the text to a document buffer.
+def convert_image_to_pdf(uploaded_file):
+    from aitam.ocr import ocr_image
+    if isinstance(uploaded_file, (str, Path)):
+        data = Path(uploaded_file).read_bytes()
+    else:
+        uploaded_file.seek(0)
+        data = uploaded_file.read()
+    output = DocumentBuffer(document_name(uploaded_file, ".txt"))
+    try:
+        output.write(ocr_image(data))
+    except BaseException:
+        output.close()
+        raise
+    return output
+
+# Image types OCRed for examination, and every type that can be examined.
+IMAGE_SUFFIXES = (".heif", ".heic", ".jpg", ".jpeg", ".png", ".tif", ".tiff")
+DOCUMENT_SUFFIXES = (".xlsx", ".pdf") + IMAGE_SUFFIXES
+
+# Extract an uploaded file or a path into a document buffer, by file type:
+# workbooks to row records, PDFs as is or (with extract_pdf) to page text with
+# scanned pages OCRed, and images to OCR text. Raises ValueError for other
+# types and for documents over the size limit.
+def extract_document(uploaded_file, extract_pdf=False):
+    name = uploaded_file if isinstance(uploaded_file, (str, Path)) else uploaded_file.name
+    suffix = Path(name).suffix.lower()
+    if suffix == ".xlsx":
+        return extract_text_from_excel(uploaded_file)
+    if suffix == ".pdf" and extract_pdf:
+        return extract_pdf_text(uploaded_file)
+    if suffix == ".pdf":
+        return copy_pdf(uploaded_file)
+    if suffix in IMAGE_SUFFIXES:
+        return convert_image_to_pdf(uploaded_file)
+    raise ValueError(f"{Path(name).name} is not an Excel, PDF or image file.")
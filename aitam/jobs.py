@@ -0,0 +1,157 @@
+import itertools
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from aitam.ratelimit import caller
+from aitam.tracing import span
+
+# Jobs run at once per server process, how long a finished job is kept for
+# its owner to view, and how often the page checks on unfinished jobs.
+JOB_WORKERS = 4
+JOB_RETENTION = 24 * 3600
+JOB_POLL_SECONDS = 2.0
+
+# Job states. A job is queued until a worker picks it up, then running, and
+# ends done, failed or cancelled.
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+# A long request (a Standard Examination or an advisory consultation) run off
+# the page's script thread. mode is the metered mode, owner the account the
+# job belongs to, user the name it is metered and traced under, and label what
+# the owner sees in the job list. A failed job keeps its exception in error, and trace
+# is the root span of the finished job. details holds whatever the page wants
+# to show with the result.
+@dataclass
+class Job:
+    id: str
+    mode: str
+    owner: str
+    user: str
+    model: str
+    label: str
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: float = None
+    finished_at: float = None
+    result: object = None
+    error: Exception = None
+    trace: object = None
+    details: dict = field(default_factory=dict)
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    # Seconds spent waiting for a worker, and running.
+    @property
+    def waited(self):
+        return (self.started_at or time.time()) - self.created_at
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+
+# Process-wide pool of workers running jobs, with the jobs of every user kept
+# in memory so the page can pick up their results after a rerun or a
+# reconnect. Each job is traced and metered to the ledger under its mode like
+# a request run on the page.
+class JobQueue:
+    def __init__(self, ledger, max_workers=JOB_WORKERS, retention=JOB_RETENTION):
+        self.ledger = ledger
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aitam-job")
+        self._jobs = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count(1)
+
+    # Queue fn(*args, meter=meter, **kwargs) and return its job. user defaults
+    # to the owner. cleanup is called once the job finishes or is cancelled,
+    # e.g. to close a document buffer the job owns.
+    def submit(self, mode, owner, model, label, fn, *args, user=None, cleanup=None, **kwargs):
+        owner = owner or "unknown"
+        job = Job(f"{next(self._sequence)}-{secrets.token_hex(4)}", mode, owner, user or owner, model, label)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+            future = self._executor.submit(self._run, job, fn, args, kwargs)
+            self._futures[job.id] = future
+        if cleanup is not None:
+            future.add_done_callback(lambda _: cleanup())
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        with self._lock:
+            if job.status != QUEUED:
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+        try:
+            with span(job.mode, user=job.user, model=job.model, job=job.id) as root, \
+                    self.ledger.meter(job.mode, job.user, job.model) as meter, \
+                    caller(job.owner, job.mode, meter, job.details):
+                job.trace = root
+                result = fn(*args, meter=meter, **kwargs)
+        except Exception as e:
+            with self._lock:
+                job.error = e
+                job.finished_at = time.time()
+                job.status = FAILED
+                self._futures.pop(job.id, None)
+        else:
+            with self._lock:
+                job.result = result
+                job.finished_at = time.time()
+                job.status = DONE
+                self._futures.pop(job.id, None)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    # The owner's jobs, newest first.
+    def jobs_for(self, owner):
+        with self._lock:
+            self._prune()
+            jobs = [job for job in self._jobs.values() if job.owner == owner]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    # Cancel a job that has not started. Running jobs are left to finish.
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            future = self._futures.get(job_id)
+            if job is None or job.status != QUEUED or future is None or not future.cancel():
+                return False
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            self._futures.pop(job_id, None)
+        return True
+
+    # Forget a finished job and its result.
+    def discard(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.finished:
+                del self._jobs[job_id]
+
+    # Drop finished jobs older than the retention. Must be called with the
+    # lock held.
+    def _prune(self):
+        if self.retention is None:
+            return
+        cutoff = time.time() - self.retention
+        for job_id in [job.id for job in self._jobs.values() if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
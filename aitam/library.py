@@ -0,0 +1,143 @@
+import contextvars
+import queue
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from aitam.tracing import span
+
+# Pattern of the 【…†…】 file citation markers in model output.
+CITATION_PATTERN = re.compile(r'【.*?†.*?】')
+# Longest text held back waiting for a citation marker to close.
+CITATION_MAX_LENGTH = 200
+
+# Removes citation markers from streamed text. A marker can be split across
+# deltas, so text from an unclosed 【 is held back until its 】 arrives.
+class CitationStripper:
+    def __init__(self):
+        self.pending = ""
+
+    def feed(self, delta):
+        text = self.pending + delta
+        start = text.rfind("【")
+        if start != -1 and "】" not in text[start:] and len(text) - start < CITATION_MAX_LENGTH:
+            self.pending = text[start:]
+            text = text[:start]
+        else:
+            self.pending = ""
+        return CITATION_PATTERN.sub('', text)
+
+    def flush(self):
+        text, self.pending = self.pending, ""
+        return CITATION_PATTERN.sub('', text)
+
+# Find the assistant message in a response's output. It follows the
+# file_search_call item when the library was searched.
+def get_answer_content(response):
+    for item in response.output:
+        if item.type == "message":
+            return item.content[0]
+    raise ValueError("The response contains no answer message.")
+
+# Temperature of library searches, also part of the answer cache key.
+LIBRARY_TEMPERATURE = 0.3
+
+# Query a library vector store. When a placeholder is given the answer is
+# streamed into it as it arrives; the final response is returned either way.
+# The time to the first streamed token is added to meter when one is given.
+def search_library(client, model, vector_store_id, query_text, placeholder=None, meter=None):
+    request = dict(
+        input = query_text,
+        model = model,
+        temperature = LIBRARY_TEMPERATURE,
+        tools = [{
+                    "type": "file_search",
+                    "vector_store_ids": [vector_store_id],
+        }],
+        include=["output[*].file_search_call.search_results"]
+    )
+    if placeholder is None:
+        return client.responses.create(**request)
+    stripper = CitationStripper()
+    text = ""
+    response = None
+    started = time.monotonic()
+    for event in client.responses.create(stream=True, **request):
+        if event.type == "response.output_text.delta":
+            if not text and meter is not None:
+                meter.mark("first_token", time.monotonic() - started)
+            text += stripper.feed(event.delta)
+            placeholder.markdown(text + "▌")
+        elif event.type in ("response.completed", "response.incomplete", "response.failed"):
+            response = event.response
+    placeholder.markdown(text + stripper.flush())
+    if response is None:
+        raise RuntimeError("The library search ended without a response.")
+    return response
+
+
+# Seconds search_libraries waits for streamed text before checking whether the
+# searches have finished. Text arriving meanwhile is written in one go.
+STREAM_POLL_INTERVAL = 0.05
+
+# Stands in for a placeholder on a search's worker thread: the streamed text
+# is queued with the search's index and written by the thread that owns the
+# page.
+class QueuedPlaceholder:
+    def __init__(self, updates, index):
+        self.updates = updates
+        self.index = index
+
+    def markdown(self, text):
+        self.updates.put((self.index, text))
+
+# Search several library vector stores with the same query at once, so the
+# whole search takes about as long as the slowest library. Each search runs on
+# its own thread in a copy of the caller's context, so its span nests under
+# the caller's. When placeholders are given (one per store) the answers are
+# streamed into them, written from the calling thread since Streamlit elements
+# belong to the script thread. The time to the first streamed token of any
+# library is added to meter when one is given. Returns one response per
+# store, in order, or the exception its search raised, so one failed library
+# doesn't lose the others' answers.
+def search_libraries(client, model, vector_store_ids, query_text, placeholders=None, meter=None):
+    updates = queue.Queue()
+
+    def search(index, vector_store_id):
+        placeholder = QueuedPlaceholder(updates, index) if placeholders is not None else None
+        with span("search_library", vector_store_id=vector_store_id):
+            return search_library(client, model, vector_store_id, query_text, placeholder)
+
+    # Write the latest text queued for each placeholder, waiting up to
+    # timeout for some to arrive. Returns whether anything was written.
+    def drain(timeout=None):
+        latest = {}
+        try:
+            index, text = updates.get(timeout=timeout) if timeout else updates.get_nowait()
+            latest[index] = text
+            while True:
+                index, text = updates.get_nowait()
+                latest[index] = text
+        except queue.Empty:
+            pass
+        for index, text in latest.items():
+            placeholders[index].markdown(text)
+        return bool(latest)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(vector_store_ids), thread_name_prefix="aitam-library") as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, search, index, vector_store_id)
+            for index, vector_store_id in enumerate(vector_store_ids)
+        ]
+        if placeholders is None:
+            wait(futures)
+        else:
+            streamed = False
+            while not all(future.done() for future in futures):
+                if drain(STREAM_POLL_INTERVAL) and not streamed:
+                    streamed = True
+                    if meter is not None:
+                        meter.mark("first_token", time.monotonic() - started)
+            drain()
+    return [future.exception() or future.result() for future in futures]
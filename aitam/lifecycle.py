@@ -0,0 +1,171 @@
+import math
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from aitam.tracing import span
+
+# Name of every vector store the app creates; the reaper only touches stores
+# with this name.
+VECTOR_STORE_NAME = "aitam"
+# Deletions sent per batch, how long a deletion waits for its batch to fill,
+# how many run at once and how often a failed deletion is retried.
+DELETE_BATCH_SIZE = 50
+DELETE_FLUSH_INTERVAL = 2.0
+DELETE_CONCURRENCY = 8
+DELETE_ATTEMPTS = 3
+# How often the reaper sweeps for orphaned vector stores, and how long a store
+# must have been inactive to be an orphan.
+REAPER_INTERVAL = 3600
+ORPHAN_AGE = 24 * 3600
+# Shortest server-side expiry openai accepts for files.
+MIN_FILE_EXPIRY = 3600
+# How long before its file expires a document stops being reused, leaving
+# room for the examination that last picked it up to finish.
+EXPIRY_MARGIN = 900
+
+
+# Owns the temporary files and vector stores made for examined documents.
+# Everything it creates gets a server-side expiry at least min_lifetime away
+# (the document cache ttl), so nothing outlives it by much even if this
+# process dies. Released resources are deleted in batches by a background
+# thread, off the request path. A periodic reaper deletes "aitam" vector
+# stores (and their files) inactive for longer than orphan_age that this
+# process does not hold, e.g. ones left behind by a crashed server.
+class VectorStoreLifecycle:
+    def __init__(self, client, min_lifetime=ORPHAN_AGE, orphan_age=ORPHAN_AGE, reaper_interval=REAPER_INTERVAL):
+        self.client = client
+        self.store_expiry_days = max(1, math.ceil(min_lifetime / 86400))
+        self.file_expiry = max(MIN_FILE_EXPIRY, self.store_expiry_days * 86400)
+        # Files expire a fixed time after upload, however often they are used,
+        # so cached documents must not be kept longer than this.
+        self.max_cached_age = self.file_expiry - EXPIRY_MARGIN
+        self.orphan_age = max(orphan_age, min_lifetime)
+        self.reaper_interval = reaper_interval
+        self._live = set()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY, thread_name_prefix="aitam-delete")
+        threading.Thread(target=self._delete_loop, name="aitam-lifecycle", daemon=True).start()
+        if reaper_interval:
+            threading.Thread(target=self._reap_loop, name="aitam-reaper", daemon=True).start()
+
+    # Upload a file that expires server side and register it.
+    def create_file(self, file, purpose):
+        created = self.client.files.create(
+            file=file,
+            purpose=purpose,
+            extra_body={"expires_after": {"anchor": "created_at", "seconds": self.file_expiry}},
+        )
+        self._register(created.id)
+        return created
+
+    # Create an "aitam" vector store that expires once inactive and register it.
+    def create_vector_store(self):
+        created = self.client.vector_stores.create(
+            name=VECTOR_STORE_NAME,
+            expires_after={"anchor": "last_active_at", "days": self.store_expiry_days},
+        )
+        self._register(created.id)
+        return created
+
+    def _register(self, resource_id):
+        with self._lock:
+            self._live.add(resource_id)
+
+    # Queue a file and/or vector store for deletion. Returns at once.
+    def release(self, file_id=None, vector_store_id=None):
+        for resource_id, kind in ((vector_store_id, "vector_store"), (file_id, "file")):
+            if resource_id is None:
+                continue
+            with self._lock:
+                self._live.discard(resource_id)
+            self._queue.put((kind, resource_id, 1))
+
+    # on_evict callback of the document cache.
+    def release_entry(self, entry):
+        self.release(entry.file_id, entry.vector_store_id)
+
+    def is_live(self, resource_id):
+        with self._lock:
+            return resource_id in self._live
+
+    # Deletions waiting to be sent.
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def _delete(self, kind, resource_id):
+        try:
+            if kind == "vector_store":
+                self.client.vector_stores.delete(vector_store_id=resource_id)
+            else:
+                self.client.files.delete(resource_id)
+        except openai.NotFoundError:
+            pass
+
+    def _delete_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + DELETE_FLUSH_INTERVAL
+            while len(batch) < DELETE_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            with span("lifecycle.delete", resources=len(batch)):
+                futures = [(item, self._pool.submit(self._delete, *item[:2])) for item in batch]
+                for (kind, resource_id, attempt), future in futures:
+                    try:
+                        future.result()
+                    except openai.OpenAIError:
+                        # Left for the next batch; the server-side expiry
+                        # removes it if every attempt fails.
+                        if attempt < DELETE_ATTEMPTS:
+                            self._queue.put((kind, resource_id, attempt + 1))
+                    finally:
+                        self._queue.task_done()
+
+    # Wait until every released resource has been deleted (or given up on),
+    # e.g. before a script exits. Returns False on timeout.
+    def flush(self, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    # Release "aitam" vector stores inactive for longer than orphan_age that
+    # this process does not hold, with their files. Returns the number of
+    # stores released.
+    def reap(self):
+        cutoff = time.time() - self.orphan_age
+        reaped = 0
+        with span("lifecycle.reap") as reap_span:
+            for store in self.client.vector_stores.list(limit=100):
+                if store.name != VECTOR_STORE_NAME or self.is_live(store.id):
+                    continue
+                if (store.last_active_at or store.created_at) > cutoff:
+                    continue
+                for store_file in self.client.vector_stores.files.list(vector_store_id=store.id, limit=100):
+                    if not self.is_live(store_file.id):
+                        self.release(file_id=store_file.id)
+                self.release(vector_store_id=store.id)
+                reaped += 1
+            reap_span.set(reaped=reaped)
+        return reaped
+
+    def _reap_loop(self):
+        while True:
+            try:
+                self.reap()
+            except openai.OpenAIError:
+                pass
+            time.sleep(self.reaper_interval)
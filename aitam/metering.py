@@ -0,0 +1,215 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from aitam.budget import estimate_cost
+from aitam.tracing import span
+
+# Local store of metered requests and how long they are kept.
+METERING_PATH = Path(".aitam") / "usage.sqlite3"
+METERING_RETENTION = 90 * 24 * 3600
+
+
+# Input, output and cached input tokens of a usage object. Handles Responses
+# API usage, Assistants run usage (prompt/completion tokens) and the Agents
+# SDK's accumulated usage.
+def usage_tokens(usage):
+    if usage is None:
+        return 0, 0, 0
+    input_tokens = getattr(usage, "input_tokens", None)
+    if input_tokens is None:
+        input_tokens = getattr(usage, "prompt_tokens", 0)
+    output_tokens = getattr(usage, "output_tokens", None)
+    if output_tokens is None:
+        output_tokens = getattr(usage, "completion_tokens", 0)
+    details = getattr(usage, "input_tokens_details", None) or getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) if details is not None else 0
+    return input_tokens or 0, output_tokens or 0, cached_tokens or 0
+
+
+# Nearest-rank percentile of a list of numbers, or None for an empty list.
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+# Measures one user request (a library search, an advisory consultation, a
+# document examination): the model calls it made, their tokens and the time
+# spent in each stage. status is "ok", "cached" (answered without calling the
+# model) or "error". Usage may be added from several threads, e.g. the parallel
+# advisory panel or the map-reduce workers.
+class Meter:
+    def __init__(self, mode, user, model):
+        self.mode = mode
+        self.user = user
+        self.model = model
+        self.api_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.stages = {}
+        self.status = "ok"
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Add the usage of a response, run or agent run. Agents SDK usage carries
+    # its own request count.
+    def add_usage(self, usage, api_calls=None):
+        input_tokens, output_tokens, cached_tokens = usage_tokens(usage)
+        if api_calls is None:
+            api_calls = getattr(usage, "requests", None) or 1
+        with self._lock:
+            self.api_calls += api_calls
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.cached_tokens += cached_tokens
+
+    # Time a stage of the request. Repeated stages add up.
+    @contextmanager
+    def stage(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.mark(name, time.monotonic() - start)
+
+    def mark(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @property
+    def cost(self):
+        return estimate_cost(self.model, self.input_tokens, self.output_tokens, self.cached_tokens) or 0.0
+
+    @property
+    def latency(self):
+        return time.monotonic() - self.started
+
+
+# Persistent ledger of metered requests, with summaries of latency and spend
+# per mode and user for the admin dashboard.
+class UsageLedger:
+    def __init__(self, path=METERING_PATH, retention=METERING_RETENTION):
+        self.path = Path(path)
+        self.retention = retention
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS requests (
+                    id INTEGER PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    mode TEXT NOT NULL,
+                    user TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    api_calls INTEGER NOT NULL,
+                    input_tokens INTEGER NOT NULL,
+                    output_tokens INTEGER NOT NULL,
+                    cached_tokens INTEGER NOT NULL,
+                    cost REAL NOT NULL,
+                    latency REAL NOT NULL,
+                    stages TEXT NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS requests_created_at ON requests (created_at)")
+
+    # Meter a request and record it when the block exits. An exception marks
+    # the request as failed and is re-raised.
+    @contextmanager
+    def meter(self, mode, user, model):
+        meter = Meter(mode, user or "unknown", model)
+        try:
+            yield meter
+        except BaseException:
+            meter.status = "error"
+            raise
+        finally:
+            self.record(meter)
+
+    # Write a finished meter to the ledger. Metering never fails a request.
+    def record(self, meter):
+        now = time.time()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    """
+                    INSERT INTO requests (created_at, mode, user, model, status, api_calls,
+                        input_tokens, output_tokens, cached_tokens, cost, latency, stages)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (now, meter.mode, meter.user, meter.model, meter.status, meter.api_calls,
+                     meter.input_tokens, meter.output_tokens, meter.cached_tokens,
+                     meter.cost, meter.latency, json.dumps(meter.stages)),
+                )
+                if self.retention is not None:
+                    self._conn.execute("DELETE FROM requests WHERE created_at < ?", (now - self.retention,))
+        except sqlite3.Error:
+            pass
+
+    # Requests, cached answers, failures, spend, tokens and p50/p95 latency of
+    # the requests made since the given time, grouped by the given columns
+    # ("mode", "user" or "model"). Stage latencies are summarized the same way.
+    def summary(self, since=0, group_by=("mode", "user")):
+        columns = [column for column in group_by if column in ("mode", "user", "model")]
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT {", ".join(columns + ["status", "api_calls", "input_tokens",
+                    "output_tokens", "cached_tokens", "cost", "latency", "stages"])}
+                FROM requests WHERE created_at >= ? ORDER BY created_at
+                """,
+                (since,),
+            ).fetchall()
+        groups = {}
+        for row in rows:
+            key = row[:len(columns)]
+            status, api_calls, input_tokens, output_tokens, cached_tokens, cost, latency, stages = row[len(columns):]
+            group = groups.setdefault(key, {
+                "requests": 0, "cached": 0, "errors": 0, "api_calls": 0, "input_tokens": 0,
+                "output_tokens": 0, "cached_tokens": 0, "cost": 0.0,
+                "latencies": [], "stages": {},
+            })
+            group["requests"] += 1
+            group["cached"] += status == "cached"
+            group["errors"] += status == "error"
+            group["api_calls"] += api_calls
+            group["input_tokens"] += input_tokens
+            group["output_tokens"] += output_tokens
+            group["cached_tokens"] += cached_tokens
+            group["cost"] += cost
+            group["latencies"].append(latency)
+            for name, seconds in json.loads(stages).items():
+                group["stages"].setdefault(name, []).append(seconds)
+        summary = []
+        for key, group in groups.items():
+            latencies = group.pop("latencies")
+            stages = group.pop("stages")
+            entry = dict(zip(columns, key))
+            entry.update(group)
+            entry["p50_latency"] = percentile(latencies, 50)
+            entry["p95_latency"] = percentile(latencies, 95)
+            for name, values in sorted(stages.items()):
+                entry[f"{name}_p50"] = percentile(values, 50)
+                entry[f"{name}_p95"] = percentile(values, 95)
+            summary.append(entry)
+        summary.sort(key=lambda entry: entry["cost"], reverse=True)
+        return summary
+
+
+# Time a stage of a request as a tracing span, and on the request's meter
+# when one is given.
+@contextmanager
+def metered_stage(meter, name, **attributes):
+    with span(name, **attributes), (meter.stage(name) if meter is not None else nullcontext()):
+        yield
@@ -0,0 +1,153 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytesseract
+from PIL import Image, ImageOps, ImageSequence
+from pillow_heif import register_heif_opener
+
+# Let PIL open the HEIF/HEIC photos phones produce.
+register_heif_opener()
+
+# Longest image side passed to tesseract. Phone photos are downscaled to about
+# 300 dpi for a letter page, which is all tesseract needs.
+OCR_MAX_SIDE = 3300
+# Images taller than this are split into bands at blank rows and the bands
+# are OCRed in parallel.
+OCR_TILE_HEIGHT = 2000
+# Skew angles tried by deskew, in degrees either side of level.
+OCR_MAX_SKEW = 5.0
+OCR_SKEW_STEP = 0.5
+# Worker processes and the number of OCR results kept in memory.
+OCR_WORKERS = max(1, min(4, (os.cpu_count() or 1)))
+OCR_CACHE_SIZE = 256
+
+_pool = None
+_pool_lock = threading.Lock()
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+# Process pool shared by all sessions, started on first use. Workers are
+# spawned rather than forked since the server process runs many threads.
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=OCR_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return _pool
+
+
+# Every frame of the image, upright. Multi-page TIFFs and HEIF image
+# collections have several frames; other formats have one.
+def load_frames(data):
+    image = Image.open(io.BytesIO(data))
+    return [ImageOps.exif_transpose(frame.copy()) for frame in ImageSequence.Iterator(image)]
+
+
+# Angle that best levels the text lines: the rotation whose horizontal
+# projection profile has the sharpest peaks. Measured on a small copy.
+def find_skew(image):
+    small = image.copy()
+    small.thumbnail((800, 800))
+    pixels = np.asarray(small, dtype=np.uint8)
+    ink = Image.fromarray(((pixels < pixels.mean() - 30) * 255).astype(np.uint8))
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-OCR_MAX_SKEW, OCR_MAX_SKEW + OCR_SKEW_STEP, OCR_SKEW_STEP):
+        rows = np.asarray(ink.rotate(float(angle)), dtype=np.float32).sum(axis=1)
+        score = float(np.square(np.diff(rows)).sum())
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+# Grayscale, downscale and deskew an image for OCR.
+def preprocess(image):
+    image = ImageOps.grayscale(image)
+    if max(image.size) > OCR_MAX_SIDE:
+        image.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE), Image.LANCZOS)
+    angle = find_skew(image)
+    if angle:
+        image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    return image
+
+
+# Split a tall image into bands of about OCR_TILE_HEIGHT rows, cutting at the
+# emptiest row near each boundary so no line of text is cut in half.
+def split_bands(image):
+    if image.height <= OCR_TILE_HEIGHT * 1.5:
+        return [image]
+    pixels = np.asarray(image, dtype=np.uint8)
+    row_ink = (pixels < 128).sum(axis=1)
+    window = OCR_TILE_HEIGHT // 10
+    cuts = [0]
+    while image.height - cuts[-1] > OCR_TILE_HEIGHT * 1.5:
+        target = cuts[-1] + OCR_TILE_HEIGHT
+        low, high = target - window, target + window
+        cuts.append(low + int(np.argmin(row_ink[low:high])))
+    cuts.append(image.height)
+    return [image.crop((0, top, image.width, bottom)) for top, bottom in zip(cuts, cuts[1:])]
+
+
+# Worker: OCR one grayscale tile sent as raw pixels. pytesseract's exceptions
+# cannot be unpickled in the parent process, so failures come back as
+# RuntimeError instead of breaking the pool.
+def ocr_tile(size, pixels):
+    try:
+        return pytesseract.image_to_string(Image.frombytes("L", size, pixels)).strip()
+    except Exception as e:
+        raise RuntimeError(f"OCR failed: {e}") from None
+
+
+def _cache_get(key):
+    with _cache_lock:
+        text = _cache.get(key)
+        if text is not None:
+            _cache.move_to_end(key)
+        return text
+
+
+def _cache_put(key, text):
+    with _cache_lock:
+        _cache[key] = text
+        _cache.move_to_end(key)
+        while len(_cache) > OCR_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+# OCR a batch of images given as encoded bytes (JPEG, PNG, HEIF, TIFF...).
+# Frames and bands of all the images are OCRed concurrently in the process
+# pool; results are cached by image hash so repeated uploads are instant.
+def ocr_images(images):
+    keys = [hashlib.sha256(data).hexdigest() for data in images]
+    texts = [_cache_get(key) for key in keys]
+    pool = get_pool() if OCR_WORKERS > 1 else None
+    jobs = []
+    for i, data in enumerate(images):
+        if texts[i] is not None:
+            continue
+        tiles = []
+        for frame in load_frames(data):
+            for band in split_bands(preprocess(frame)):
+                if pool is None:
+                    tiles.append(ocr_tile(band.size, band.tobytes()))
+                else:
+                    tiles.append(pool.submit(ocr_tile, band.size, band.tobytes()))
+        jobs.append((i, tiles))
+    for i, tiles in jobs:
+        parts = [tile if isinstance(tile, str) else tile.result() for tile in tiles]
+        texts[i] = "\n\n".join(part for part in parts if part)
+        _cache_put(keys[i], texts[i])
+    return texts
+
+
+def ocr_image(data):
+    return ocr_images([data])[0]
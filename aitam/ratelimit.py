@@ -0,0 +1,433 @@
+import asyncio
+import contextvars
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import httpx
+
+from aitam.budget import EXPECTED_OUTPUT_TOKENS
+
+# Default limits of the whole server process on model requests and their
+# estimated tokens per minute, matching the lowest paid tier of gpt-4o-mini.
+# None lifts a limit.
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200_000
+# Priority of a request by the mode it belongs to, lower served first:
+# interactive searches ahead of background jobs, batch runs last.
+INTERACTIVE, BACKGROUND, BATCH = 0, 1, 2
+MODE_PRIORITY = {
+    "library": INTERACTIVE,
+    "library_pro": INTERACTIVE,
+    "library_both": INTERACTIVE,
+    "custom_query": INTERACTIVE,
+    "advisory": BACKGROUND,
+    "examination": BACKGROUND,
+    "batch_examination": BATCH,
+}
+# Seconds of refill a bucket holds: OpenAI enforces per-minute limits over
+# shorter windows, so a full minute's worth at once would be rejected.
+BURST_SECONDS = 10
+# Pause after a 429 without a usable Retry-After, and the longest honored.
+DEFAULT_RETRY_AFTER = 1.0
+MAX_RETRY_AFTER = 60.0
+# Longest an async waiter sleeps before checking its place in the queue.
+ASYNC_POLL_SECONDS = 0.1
+# Rough characters per token of a request body, and the tokens charged up
+# front for the context retrieved by a file search or assistant run. Each
+# charge is settled against the response's actual usage once it has been
+# read, so these only need to hold back bursts.
+CHARS_PER_TOKEN = 4
+CONTEXT_TOKENS = 2_000
+# Bytes kept from the end of a response body to read its usage from, and the
+# pattern of its total tokens: the last match is the whole request's usage
+# (the completed response or run comes after any run step's usage).
+USAGE_TAIL_BYTES = 64 * 1024
+TOTAL_TOKENS_PATTERN = re.compile(rb'"total_tokens":\s*(\d+)')
+# POST endpoints that call a model and are scheduled. Uploads, vector stores
+# and polls pass straight through.
+MODEL_PATHS = ("/responses", "/chat/completions", "/runs")
+
+
+# Who a request is made for: the user, the priority of its mode, the meter its
+# queueing time is added to, and a dict its queue position is written to while
+# it waits (e.g. a job's details, which the page shows).
+@dataclass
+class Caller:
+    user: str
+    priority: int
+    meter: object = None
+    status: dict = None
+
+
+_current_caller = contextvars.ContextVar("aitam_rate_limit_caller", default=None)
+_default_caller = Caller("unknown", BACKGROUND)
+
+
+# Attribute the model requests made in the enclosed block, including those of
+# asyncio tasks and copied contexts started from it, to a user and mode.
+@contextmanager
+def caller(user, mode, meter=None, status=None):
+    token = _current_caller.set(Caller(user or "unknown", MODE_PRIORITY.get(mode, BACKGROUND), meter, status))
+    try:
+        yield
+    finally:
+        _current_caller.reset(token)
+
+
+# Refills continuously at a per-minute rate, holding up to BURST_SECONDS of
+# refill so a burst is spread out rather than sent at once.
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.configure(per_minute)
+
+    def configure(self, per_minute):
+        self.rate = per_minute / 60 if per_minute else None
+        self.capacity = self.rate * BURST_SECONDS if self.rate else None
+        self.level = self.capacity or 0
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until amount is available, 0 if it is now.
+    def delay(self, amount):
+        if not self.capacity:
+            return 0.0
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+    # Refund what was charged for a request and take what it actually used.
+    # The level may go down to minus the capacity, holding back requests until
+    # the overrun has refilled.
+    def settle(self, charged, used):
+        if self.capacity:
+            self.level -= min(used, self.capacity) - min(charged, self.capacity)
+            self.level = min(self.capacity, max(-self.capacity, self.level))
+
+
+@dataclass
+class Ticket:
+    caller: Caller
+    tokens: int
+    queued_at: float = field(default_factory=time.monotonic)
+    granted: bool = False
+
+
+# Process-wide scheduler of model requests shared by every session, job and
+# thread. Requests wait for token buckets on requests and estimated tokens per
+# minute, in priority order and round-robin across users within a priority, so
+# one user's burst doesn't starve the rest. A 429 pauses every request for its
+# Retry-After. Sync callers block on a condition, async callers sleep on the
+# event loop.
+class RequestScheduler:
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE, context_tokens=CONTEXT_TOKENS):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.context_tokens = context_tokens
+        self.paused_until = 0.0
+        self.rate_limited_count = 0
+        # Priority -> user -> waiting tickets. Users take turns in order.
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._granted = threading.Condition(self._lock)
+
+    def configure(self, requests_per_minute, tokens_per_minute, context_tokens=CONTEXT_TOKENS):
+        with self._lock:
+            self.requests.configure(requests_per_minute)
+            self.tokens.configure(tokens_per_minute)
+            self.context_tokens = context_tokens
+            self._granted.notify_all()
+
+    def _enqueue(self, ticket):
+        users = self._queues.setdefault(ticket.caller.priority, OrderedDict())
+        users.setdefault(ticket.caller.user, deque()).append(ticket)
+
+    def _remove(self, ticket):
+        users = self._queues.get(ticket.caller.priority, {})
+        tickets = users.get(ticket.caller.user)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del users[ticket.caller.user]
+
+    # Grant waiting tickets in order while the buckets allow. Returns the
+    # seconds until the next ticket can go, or None when none is waiting.
+    def _dispatch(self):
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        granted = False
+        delay = None
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            while users:
+                user, tickets = next(iter(users.items()))
+                ticket = tickets[0]
+                delay = max(self.paused_until - now, self.requests.delay(1), self.tokens.delay(ticket.tokens))
+                if delay > 0:
+                    break
+                delay = None
+                self.requests.take(1)
+                self.tokens.take(ticket.tokens)
+                tickets.popleft()
+                # The user goes to the back of the line for their next ticket.
+                del users[user]
+                if tickets:
+                    users[user] = tickets
+                ticket.granted = granted = True
+            if delay is not None:
+                break
+        if granted:
+            self._granted.notify_all()
+        return delay
+
+    # Waiting tickets ahead of this one: all of higher priority and those of
+    # its own priority queued before it.
+    def _position(self, ticket):
+        ahead = 0
+        for priority, users in self._queues.items():
+            for tickets in users.values():
+                for other in tickets:
+                    if priority < ticket.caller.priority or (
+                        priority == ticket.caller.priority and other.queued_at < ticket.queued_at
+                    ):
+                        ahead += 1
+        return ahead + 1
+
+    def _waiting(self, ticket):
+        if ticket.caller.status is not None:
+            ticket.caller.status["queue_position"] = self._position(ticket)
+            ticket.caller.status["queued_seconds"] = time.monotonic() - ticket.queued_at
+
+    def _finish(self, ticket):
+        waited = time.monotonic() - ticket.queued_at
+        if ticket.caller.status is not None:
+            ticket.caller.status.pop("queue_position", None)
+            ticket.caller.status.pop("queued_seconds", None)
+        if ticket.caller.meter is not None and waited > 0.001:
+            ticket.caller.meter.mark("queue", waited)
+
+    # Wait until a request of the estimated tokens may be sent.
+    def acquire(self, tokens):
+        ticket = Ticket(_current_caller.get() or _default_caller, tokens)
+        with self._lock:
+            self._enqueue(ticket)
+            try:
+                while True:
+                    delay = self._dispatch()
+                    if ticket.granted:
+                        break
+                    self._waiting(ticket)
+                    self._granted.wait(delay)
+            finally:
+                if not ticket.granted:
+                    self._remove(ticket)
+        self._finish(ticket)
+
+    async def acquire_async(self, tokens):
+        ticket = Ticket(_current_caller.get() or _default_caller, tokens)
+        with self._lock:
+            self._enqueue(ticket)
+        try:
+            while True:
+                with self._lock:
+                    delay = self._dispatch()
+                    if ticket.granted:
+                        break
+                    self._waiting(ticket)
+                await asyncio.sleep(min(delay or ASYNC_POLL_SECONDS, ASYNC_POLL_SECONDS))
+        finally:
+            if not ticket.granted:
+                # Cancelled while waiting, e.g. the losing side of a hedge.
+                with self._lock:
+                    self._remove(ticket)
+        self._finish(ticket)
+
+    # Correct the tokens charged for a request by the tokens it used.
+    def settle(self, charged, used):
+        with self._lock:
+            self.tokens.refill(time.monotonic())
+            self.tokens.settle(charged, used)
+            self._granted.notify_all()
+
+    # Hold every request back for the Retry-After of a 429.
+    def rate_limited(self, retry_after):
+        with self._lock:
+            self.rate_limited_count += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + min(retry_after, MAX_RETRY_AFTER))
+
+    # Requests waiting per priority, the longest wait so far, the seconds left
+    # of a 429 pause and the 429s seen, for the page.
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            waiting = {
+                priority: sum(len(tickets) for tickets in users.values())
+                for priority, users in self._queues.items()
+            }
+            oldest = min(
+                (ticket.queued_at for users in self._queues.values() for tickets in users.values() for ticket in tickets),
+                default=now,
+            )
+            return {
+                "waiting": sum(waiting.values()),
+                "waiting_by_priority": waiting,
+                "longest_wait": now - oldest,
+                "paused_for": max(0.0, self.paused_until - now),
+                "rate_limited": self.rate_limited_count,
+            }
+
+
+_scheduler = RequestScheduler()
+
+
+def get_scheduler():
+    return _scheduler
+
+
+def configure_rate_limits(requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE, context_tokens=CONTEXT_TOKENS):
+    _scheduler.configure(requests_per_minute, tokens_per_minute, context_tokens)
+    return _scheduler
+
+
+def is_model_request(request):
+    return request.method == "POST" and request.url.path.endswith(MODEL_PATHS)
+
+
+# Estimated tokens of a model request: its body, the expected answer and, for
+# file search and assistant runs, context_tokens of retrieved context.
+def request_tokens(request, context_tokens=CONTEXT_TOKENS):
+    body = request.content
+    tokens = len(body) // CHARS_PER_TOKEN + EXPECTED_OUTPUT_TOKENS
+    if b"file_search" in body or request.url.path.endswith("/runs"):
+        tokens += context_tokens
+    return tokens
+
+
+# Total tokens of the usage at the end of a response body, or None when it
+# has none (e.g. a run created without streaming, whose usage comes later).
+def response_usage(tail):
+    matches = TOTAL_TOKENS_PATTERN.findall(tail)
+    return int(matches[-1]) if matches else None
+
+
+# Passes a response body through while keeping its tail, and settles the
+# request's charge with the usage found there once the body has been read or
+# closed. Plain JSON responses and event streams are read alike.
+class UsageTail:
+    def __init__(self, scheduler, charged):
+        self.scheduler = scheduler
+        self.charged = charged
+        self.tail = bytearray()
+        self.settled = False
+
+    def add(self, chunk):
+        self.tail += chunk
+        if len(self.tail) > 2 * USAGE_TAIL_BYTES:
+            del self.tail[:-USAGE_TAIL_BYTES]
+
+    def settle(self):
+        if self.settled:
+            return
+        self.settled = True
+        used = response_usage(bytes(self.tail[-USAGE_TAIL_BYTES:]))
+        if used is not None:
+            self.scheduler.settle(self.charged, used)
+
+
+class UsageStream(httpx.SyncByteStream):
+    def __init__(self, stream, usage):
+        self.stream = stream
+        self.usage = usage
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.usage.add(chunk)
+            yield chunk
+        self.usage.settle()
+
+    def close(self):
+        self.usage.settle()
+        self.stream.close()
+
+
+class AsyncUsageStream(httpx.AsyncByteStream):
+    def __init__(self, stream, usage):
+        self.stream = stream
+        self.usage = usage
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self.usage.add(chunk)
+            yield chunk
+        self.usage.settle()
+
+    async def aclose(self):
+        self.usage.settle()
+        await self.stream.aclose()
+
+
+# Seconds to wait after a 429, from retry-after-ms or retry-after.
+def retry_after(response):
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(response.headers[header]) * scale
+        except (KeyError, ValueError):
+            pass
+    return DEFAULT_RETRY_AFTER
+
+
+# httpx transports passing model requests through the scheduler before they
+# are sent, and settling their token charge once the response is read. The
+# OpenAI client's own retries of a 429 come back through here and wait out the
+# pause with everyone else.
+class ScheduledTransport(httpx.BaseTransport):
+    def __init__(self, transport, scheduler=None):
+        self.transport = transport
+        self.scheduler = scheduler or _scheduler
+
+    def handle_request(self, request):
+        if not is_model_request(request):
+            return self.transport.handle_request(request)
+        tokens = request_tokens(request, self.scheduler.context_tokens)
+        self.scheduler.acquire(tokens)
+        response = self.transport.handle_request(request)
+        if response.status_code == 429:
+            self.scheduler.rate_limited(retry_after(response))
+        elif response.is_success:
+            response.stream = UsageStream(response.stream, UsageTail(self.scheduler, tokens))
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncScheduledTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport, scheduler=None):
+        self.transport = transport
+        self.scheduler = scheduler or _scheduler
+
+    async def handle_async_request(self, request):
+        if not is_model_request(request):
+            return await self.transport.handle_async_request(request)
+        tokens = request_tokens(request, self.scheduler.context_tokens)
+        await self.scheduler.acquire_async(tokens)
+        response = await self.transport.handle_async_request(request)
+        if response.status_code == 429:
+            self.scheduler.rate_limited(retry_after(response))
+        elif response.is_success:
+            response.stream = AsyncUsageStream(response.stream, UsageTail(self.scheduler, tokens))
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,118 @@
+import heapq
+import math
+import re
+from collections import Counter
+from pathlib import Path
+
+from aitam.budget import iter_lines
+
+# Text documents up to this size are searched in process instead of being
+# uploaded and indexed in a vector store.
+LOCAL_INDEX_MAX_BYTES = 4 * 1024 * 1024
+# Characters per chunk, about 500 tokens, and the chunks sent with a query.
+CHUNK_CHARS = 2_000
+TOP_K = 8
+# BM25 term frequency saturation and document length normalization.
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+CONTEXT_INSTRUCTIONS = (
+    "You are assisting a threat assessment review. Answer the question using "
+    "only the document excerpts provided. Each excerpt is a separate passage "
+    "of one uploaded document. If the excerpts do not contain the answer, say "
+    "so rather than guessing."
+)
+
+TERM_PATTERN = re.compile(r"\w+")
+
+
+def terms(text):
+    return TERM_PATTERN.findall(text.lower())
+
+
+# Split text lines into chunks of about chunk_chars characters, keeping lines
+# (spreadsheet row records, OCR lines) whole unless a single line is too long.
+def split_text_chunks(lines, chunk_chars=CHUNK_CHARS):
+    chunk = []
+    size = 0
+    for line in lines:
+        while len(line) > chunk_chars:
+            if chunk:
+                yield "".join(chunk)
+                chunk, size = [], 0
+            yield line[:chunk_chars]
+            line = line[chunk_chars:]
+        if size + len(line) > chunk_chars and chunk:
+            yield "".join(chunk)
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line)
+    if chunk:
+        yield "".join(chunk)
+
+
+# Whether a document can be searched with a local index: extracted text (not
+# a PDF or image uploaded as is) no larger than max_bytes.
+def can_index_locally(document, max_bytes=LOCAL_INDEX_MAX_BYTES):
+    return Path(document.name).suffix == ".txt" and document.size <= max_bytes
+
+
+# In-memory BM25 index over the chunks of one document. Built once per
+# document, then searched by each custom query without calling the API.
+class ChunkIndex:
+    def __init__(self, chunks, k1=BM25_K1, b=BM25_B):
+        self.chunks = list(chunks)
+        self.k1 = k1
+        self.b = b
+        # Postings: term -> list of (chunk number, term count in the chunk).
+        self.postings = {}
+        self.lengths = []
+        for number, chunk in enumerate(self.chunks):
+            counts = Counter(terms(chunk))
+            self.lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                self.postings.setdefault(term, []).append((number, count))
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    @classmethod
+    def from_document(cls, document, chunk_chars=CHUNK_CHARS):
+        return cls(split_text_chunks(iter_lines(document), chunk_chars))
+
+    # Numbers of the top_k chunks best matching the query, in document order.
+    # When no chunk shares a term with the query the first chunks are
+    # returned, so the model still sees how the document starts.
+    def search(self, query_text, top_k=TOP_K):
+        count = len(self.chunks)
+        scores = {}
+        for term in set(terms(query_text)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for number, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[number] / self.average_length)
+                scores[number] = scores.get(number, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        if scores:
+            best = heapq.nlargest(top_k, scores, key=scores.get)
+        else:
+            best = range(min(top_k, count))
+        return sorted(best)
+
+
+# Answer a query about a document from its best matching chunks in a single
+# responses.create call, with no file upload or vector store. With
+# previous_response_id the call continues that conversation, whose earlier
+# excerpts and answers the model still sees, so only new chunks need sending.
+# The usage is added to meter when one is given.
+def answer_from_chunks(client, model, query_text, chunks, meter=None, previous_response_id=None):
+    excerpts = "".join(f"### Excerpt\n{chunk.strip()}\n\n" for chunk in chunks)
+    response = client.responses.create(
+        instructions = CONTEXT_INSTRUCTIONS,
+        input = f"{excerpts}### Question\n{query_text}",
+        model = model,
+        temperature = 1,
+        previous_response_id = previous_response_id,
+    )
+    if meter is not None:
+        meter.add_usage(response.usage)
+    return response
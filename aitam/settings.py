@@ -0,0 +1,26 @@
+import os
+import tomllib
+from pathlib import Path
+
+# Secrets file shared with the Streamlit page, and the settings the
+# environment can override.
+SECRETS_PATH = Path(".streamlit") / "secrets.toml"
+ENVIRONMENT_KEYS = (
+    "OPENAI_API_KEY", "VECTOR_STORE_ID", "VECTOR_STORE2_ID", "MATH_ASSISTANT_ID",
+    "MATH_ASSISTANT2_ID", "INSTRUCTION_KEY", "DOC_TOKEN_BUDGET", "RUN_TIMEOUT",
+    "RATE_LIMIT_RPM", "RATE_LIMIT_TPM", "RATE_LIMIT_CONTEXT_TOKENS",
+)
+
+
+# Settings for scripts and services outside Streamlit: the page's secrets
+# file, overridden by the environment. The page itself reads st.secrets.
+def load_settings(path=SECRETS_PATH):
+    settings = {}
+    path = Path(path)
+    if path.exists():
+        with open(path, "rb") as file:
+            settings.update(tomllib.load(file))
+    for key in ENVIRONMENT_KEYS:
+        if os.environ.get(key):
+            settings[key] = os.environ[key]
+    return settings
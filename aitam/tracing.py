@@ -0,0 +1,291 @@
+import contextvars
+import json
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+
+# Local file spans are appended to, and the service name reported to an OTLP
+# collector.
+TRACE_PATH = Path(".aitam") / "traces.jsonl"
+SERVICE_NAME = "aitam"
+# Spans sent to the collector per request, and the longest a span waits
+# before being sent.
+OTLP_BATCH_SIZE = 256
+OTLP_FLUSH_INTERVAL = 5.0
+OTLP_TIMEOUT = 10.0
+# Keys of Agents SDK span data copied onto spans. Inputs and outputs are left
+# out so no case details end up in the trace files.
+AGENT_SPAN_KEYS = ("type", "name", "from_agent", "to_agent", "response_id", "model")
+
+_current_span = contextvars.ContextVar("aitam_current_span", default=None)
+_exporters = []
+_exporters_lock = threading.Lock()
+_agent_processor = None
+_agent_processor_lock = threading.Lock()
+
+
+# A timed stage of a request. Spans of one trace share the list of finished
+# spans, so the whole trace can be shown once the root span ends.
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str = None
+    start: float = field(default_factory=time.time)
+    end: float = None
+    attributes: dict = field(default_factory=dict)
+    status: str = "ok"
+    error: str = None
+    finished: list = field(default_factory=list, repr=False)
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "end": self.end,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+def current_span():
+    return _current_span.get()
+
+
+# Start a span under the given parent, or under the current span. Without
+# either it starts a new trace.
+def start_span(name, /, parent=None, **attributes):
+    if parent is None:
+        parent = _current_span.get()
+    if parent is None:
+        return Span(name, secrets.token_hex(16), secrets.token_hex(8), attributes=attributes)
+    return Span(
+        name, parent.trace_id, secrets.token_hex(8), parent.span_id,
+        attributes=attributes, finished=parent.finished,
+    )
+
+
+def end_span(span, error=None):
+    span.end = time.time()
+    if error is not None:
+        span.status = "error"
+        span.error = error
+    span.finished.append(span)
+    with _exporters_lock:
+        exporters = list(_exporters)
+    for exporter in exporters:
+        try:
+            exporter.export(span)
+        except Exception:
+            pass
+
+
+# Time the enclosed block as a span nested in the current one. Spans follow
+# the context, so stages run in asyncio tasks nest under the span that
+# started them.
+@contextmanager
+def span(name, /, **attributes):
+    current = start_span(name, **attributes)
+    token = _current_span.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        end_span(current, error)
+
+
+# Finished spans of a trace as rows for a timing breakdown: the stage indented
+# by depth, its start offset from the root and its duration, in start order.
+def breakdown(root):
+    spans = sorted(root.finished, key=lambda span: span.start)
+    depths = {root.span_id: 0}
+    rows = []
+    for span in spans:
+        depth = depths.get(span.parent_id, -1) + 1 if span is not root else 0
+        depths[span.span_id] = depth
+        rows.append({
+            "stage": "\u2003" * depth + span.name,
+            "start (s)": round(span.start - root.start, 3),
+            "duration (s)": round(span.duration, 3),
+            "status": span.status,
+        })
+    return rows
+
+
+# Appends one JSON object per finished span to a local file.
+class JsonlExporter:
+    def __init__(self, path=TRACE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+# Sends finished spans to an OTLP/HTTP collector as JSON, in batches from a
+# background thread so requests never wait on the collector. Spans are
+# dropped if the collector is unreachable.
+class OtlpExporter:
+    def __init__(self, endpoint, headers=None):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.headers = dict(headers or {})
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span):
+        self._queue.put(span)
+
+    def _run(self):
+        with httpx.Client(timeout=OTLP_TIMEOUT) as client:
+            while True:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + OTLP_FLUSH_INTERVAL
+                while len(batch) < OTLP_BATCH_SIZE:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                try:
+                    client.post(self.url, json=self._payload(batch), headers=self.headers)
+                except httpx.HTTPError:
+                    pass
+
+    def _payload(self, spans):
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": SERVICE_NAME}},
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": SERVICE_NAME},
+                    "spans": [{
+                        "traceId": span.trace_id,
+                        "spanId": span.span_id,
+                        "parentSpanId": span.parent_id or "",
+                        "name": span.name,
+                        "kind": 1,
+                        "startTimeUnixNano": str(int(span.start * 1e9)),
+                        "endTimeUnixNano": str(int(span.end * 1e9)),
+                        "attributes": [
+                            {"key": key, "value": _otlp_value(value)}
+                            for key, value in span.attributes.items()
+                            if value is not None
+                        ],
+                        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                    } for span in spans],
+                }],
+            }],
+        }
+
+
+# Mirrors Agents SDK spans (agent turns, model responses, tool calls and
+# handoffs) into the current trace, so each advisory agent turn shows up
+# nested under the stage that ran it. SDK spans outside a trace of ours are
+# ignored. Implements the SDK's TracingProcessor interface without importing
+# the SDK, which is only loaded once the advisory panel is used.
+class AgentSpanProcessor:
+    def __init__(self):
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def on_trace_start(self, trace):
+        pass
+
+    def on_trace_end(self, trace):
+        pass
+
+    def on_span_start(self, sdk_span):
+        with self._lock:
+            parent = self._spans.get(sdk_span.parent_id)
+        if parent is None:
+            parent = _current_span.get()
+        if parent is None:
+            return
+        data = sdk_span.span_data.export()
+        name = data.get("type", "agent")
+        if data.get("name"):
+            name = f"{name} {data['name']}"
+        attributes = {key: data[key] for key in AGENT_SPAN_KEYS if data.get(key) is not None}
+        with self._lock:
+            self._spans[sdk_span.span_id] = start_span(name, parent=parent, **attributes)
+
+    def on_span_end(self, sdk_span):
+        with self._lock:
+            span = self._spans.pop(sdk_span.span_id, None)
+        if span is None:
+            return
+        response = getattr(sdk_span.span_data, "response", None)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            span.set(input_tokens=usage.input_tokens, output_tokens=usage.output_tokens)
+        error = sdk_span.error
+        end_span(span, error["message"] if error else None)
+
+    def shutdown(self):
+        pass
+
+    def force_flush(self):
+        pass
+
+
+# Send finished spans to a local JSONL file and/or an OTLP collector, replacing
+# any earlier configuration.
+def configure_tracing(path=TRACE_PATH, otlp_endpoint=None, otlp_headers=None):
+    exporters = []
+    if path:
+        exporters.append(JsonlExporter(path))
+    if otlp_endpoint:
+        exporters.append(OtlpExporter(otlp_endpoint, otlp_headers))
+    with _exporters_lock:
+        _exporters[:] = exporters
+
+
+# Mirror Agents SDK spans into our traces. Registered once per process, when
+# the SDK is first configured.
+def register_agent_tracing():
+    global _agent_processor
+    from agents.tracing import add_trace_processor
+    with _agent_processor_lock:
+        if _agent_processor is None:
+            _agent_processor = AgentSpanProcessor()
+            add_trace_processor(_agent_processor)
@@ -0,0 +1,198 @@
+# Benchmarks of the document extraction functions on synthetic inputs.
+#
+# Run from the repository root:
+#   python -m benchmarks.bench_extraction                        # quick suite
+#   python -m benchmarks.bench_extraction --suite full           # up to 500k rows
+#   python -m benchmarks.bench_extraction --save-baseline benchmarks/baseline.json
+#   python -m benchmarks.bench_extraction --compare benchmarks/baseline.json
+#
+# Each case runs in a fresh process, so peak RSS is that of the extraction
+# alone. Inputs are generated once and kept in benchmarks/.data. Everything
+# runs offline; OCR cases are skipped when tesseract is not installed.
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from benchmarks import generators
+
+DATA_DIR = Path(__file__).parent / ".data"
+# A case regresses when its median wall time or peak RSS grows by more than
+# the tolerance, and by more than these absolute amounts (to ignore noise on
+# fast cases).
+TOLERANCE = 0.20
+MIN_WALL_REGRESSION = 0.05
+MIN_RSS_REGRESSION = 8 * 1024 * 1024
+
+# name: (extractor, keyword arguments, input file, generator, generator arguments)
+CASES = {
+    "excel-1k": ("extract_text_from_excel", {}, "cases-1k.xlsx", "make_workbook", {"rows": 1_000, "columns": 20}),
+    "excel-20k": ("extract_text_from_excel", {}, "cases-20k.xlsx", "make_workbook", {"rows": 20_000, "columns": 20}),
+    "excel-50k": ("extract_text_from_excel", {}, "cases-50k.xlsx", "make_workbook", {"rows": 50_000, "columns": 40}),
+    "excel-500k": ("extract_text_from_excel", {}, "cases-500k.xlsx", "make_workbook", {"rows": 500_000, "columns": 30}),
+    "pdf-copy-300p": ("copy_pdf", {}, "text-300p.pdf", "make_text_pdf", {"pages": 300}),
+    "pdf-text-300p": ("extract_pdf_text", {"ocr": False}, "text-300p.pdf", "make_text_pdf", {"pages": 300}),
+    "pdf-copy-800p": ("copy_pdf", {}, "text-800p.pdf", "make_text_pdf", {"pages": 800}),
+    "pdf-text-800p": ("extract_pdf_text", {"ocr": False}, "text-800p.pdf", "make_text_pdf", {"pages": 800}),
+    "pdf-ocr-5p": ("extract_pdf_text", {"ocr": True}, "scanned-5p.pdf", "make_scanned_pdf", {"pages": 5}),
+    "pdf-ocr-20p": ("extract_pdf_text", {"ocr": True}, "scanned-20p.pdf", "make_scanned_pdf", {"pages": 20}),
+    "image-jpeg-12mp": ("convert_image_to_pdf", {}, "photo-12mp.jpg", "make_photo", {}),
+    "image-heic-12mp": ("convert_image_to_pdf", {}, "photo-12mp.heic", "make_photo", {}),
+}
+SUITES = {
+    "quick": ["excel-1k", "excel-20k", "pdf-copy-300p", "pdf-text-300p", "pdf-ocr-5p", "image-jpeg-12mp"],
+    "full": list(CASES),
+}
+OCR_EXTRACTORS = ("convert_image_to_pdf",)
+
+
+def needs_ocr(name):
+    extractor, kwargs = CASES[name][:2]
+    return extractor in OCR_EXTRACTORS or kwargs.get("ocr", False)
+
+
+# Generate the input file of a case unless it already exists.
+def prepare_input(name):
+    filename, generator, generator_kwargs = CASES[name][2:]
+    path = DATA_DIR / filename
+    if not path.exists():
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        print(f"generating {filename}...", file=sys.stderr, flush=True)
+        partial = path.with_name(path.stem + ".partial" + path.suffix)
+        getattr(generators, generator)(partial, **generator_kwargs)
+        partial.rename(path)
+    return path
+
+
+def current_rss():
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * resource.getpagesize()
+
+
+# Run one case in this (fresh) process: the extractor is called repeat times
+# and the OCR cache is cleared between calls so every call does the work.
+def run_case(name, path, repeat):
+    from aitam import ingest, ocr
+    extractor, kwargs = CASES[name][:2]
+    function = getattr(ingest, extractor)
+    rss_before = current_rss()
+    walls = []
+    for _ in range(repeat):
+        ocr._cache.clear()
+        start = time.perf_counter()
+        document = function(str(path), **kwargs)
+        walls.append(time.perf_counter() - start)
+        output_bytes, spilled = document.size, document.on_disk
+        document.close()
+    if ocr._pool is not None:
+        ocr._pool.shutdown()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return {
+        "extractor": extractor,
+        "input_bytes": path.stat().st_size,
+        "output_bytes": output_bytes,
+        "spilled_to_disk": spilled,
+        "wall_median": statistics.median(walls),
+        "wall_min": min(walls),
+        "peak_rss": peak_rss,
+        "rss_growth": peak_rss - rss_before,
+        "ocr_worker_peak_rss": children_rss,
+    }
+
+
+def run_isolated(name, path, repeat):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_case, name, path, repeat).result()
+
+
+def mb(value):
+    return f"{value / (1024 * 1024):,.1f}"
+
+
+def print_results(results):
+    header = f"{'case':<18} {'median s':>9} {'min s':>8} {'peak MB':>8} {'growth MB':>10} {'input MB':>9} {'output MB':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        if "skipped" in result:
+            print(f"{name:<18} skipped: {result['skipped']}")
+            continue
+        print(
+            f"{name:<18} {result['wall_median']:>9.3f} {result['wall_min']:>8.3f} "
+            f"{mb(result['peak_rss']):>8} {mb(result['rss_growth']):>10} "
+            f"{mb(result['input_bytes']):>9} {mb(result['output_bytes']):>10}"
+        )
+
+
+# Cases whose wall time or peak RSS regressed against the baseline.
+def compare(results, baseline, tolerance=TOLERANCE):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None or "skipped" in result or "skipped" in base:
+            continue
+        checks = (
+            ("wall_median", MIN_WALL_REGRESSION, lambda v: f"{v:.3f} s"),
+            ("peak_rss", MIN_RSS_REGRESSION, lambda v: f"{mb(v)} MB"),
+        )
+        for key, floor, fmt in checks:
+            old, new = base[key], result[key]
+            if new > old * (1 + tolerance) and new - old > floor:
+                regressions.append(f"{name}: {key} {fmt(old)} -> {fmt(new)} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the document extraction functions.")
+    parser.add_argument("--suite", choices=SUITES, default="quick")
+    parser.add_argument("--case", action="append", choices=CASES, help="run only these cases")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    parser.add_argument("--save-baseline", type=Path, help="save the results as a baseline")
+    parser.add_argument("--compare", type=Path, help="compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    has_tesseract = shutil.which("tesseract") is not None
+    results = {}
+    for name in args.case or SUITES[args.suite]:
+        if needs_ocr(name) and not has_tesseract:
+            results[name] = {"skipped": "tesseract is not installed"}
+            continue
+        path = prepare_input(name)
+        print(f"running {name}...", file=sys.stderr, flush=True)
+        results[name] = run_isolated(name, path, args.repeat)
+    print_results(results)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    for path in (args.json, args.save_baseline):
+        if path is not None:
+            path.write_text(json.dumps(report, indent=2) + "\n")
+    if args.compare is not None:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.tolerance)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
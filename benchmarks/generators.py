@@ -0,0 +1,134 @@
+import datetime
+import random
+from pathlib import Path
+
+import numpy as np
+import openpyxl
+from PIL import Image, ImageDraw, ImageFont
+
+# Vocabulary of the synthetic case notes, reports and letters.
+WORDS = (
+    "student staff parent officer counselor principal threat assessment team "
+    "reported statement concern behavior weapon social media post message "
+    "grievance incident meeting interview follow-up safety plan referral "
+    "classroom hallway parking lot bus schedule friday monday evening week "
+    "angry upset withdrawn isolated warned said wrote posted threatened "
+    "discipline suspension review notes contact history prior none unknown"
+).split()
+NAMES = ("Avery Brooks", "Jordan Lee", "Sam Ortiz", "Riley Chen", "Casey Morgan", "Taylor Reed")
+
+
+def sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+# Workbook of case records: a header row and rows mixing text, numbers, dates
+# and blank cells, written in openpyxl write-only mode so large workbooks
+# don't need to fit in memory.
+def make_workbook(path, rows, columns, seed=0):
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Cases")
+    sheet.append([f"Field {i + 1}" for i in range(columns)])
+    start = datetime.date(2020, 1, 1)
+    for row in range(rows):
+        values = []
+        for column in range(columns):
+            kind = column % 5
+            if rng.random() < 0.1:
+                values.append(None)
+            elif kind == 0:
+                values.append(rng.choice(NAMES))
+            elif kind == 1:
+                values.append(start + datetime.timedelta(days=rng.randrange(2000)))
+            elif kind == 2:
+                values.append(rng.randrange(100_000))
+            elif kind == 3:
+                values.append(round(rng.random() * 100, 2))
+            else:
+                values.append(sentence(rng, rng.randrange(4, 30)))
+        sheet.append(values)
+    workbook.save(path)
+    return Path(path)
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+# PDF of text pages, like a case file exported from a records system. Written
+# directly (one Helvetica font, one content stream per page) since no PDF
+# writing library is a dependency.
+def make_text_pdf(path, pages, lines_per_page=55, seed=0):
+    rng = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for _ in range(pages):
+        lines = [sentence(rng, rng.randrange(8, 14)) for _ in range(lines_per_page)]
+        text = "".join(f"({_pdf_escape(line)}) Tj T* " for line in lines)
+        stream = f"BT /F1 10 Tf 13 TL 50 760 Td {text}ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), pages
+    )
+    with open(path, "wb") as file:
+        file.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(file.tell())
+            file.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref = file.tell()
+        file.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            file.write(b"%010d 00000 n \n" % offset)
+        file.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return Path(path)
+
+
+# A photographed letter: dark text on a slightly uneven background, tilted a
+# little and with sensor noise, at phone camera resolution.
+def make_letter_image(width, height, seed=0, angle=2.0):
+    rng = random.Random(seed)
+    image = Image.new("L", (width, height), 235)
+    draw = ImageDraw.Draw(image)
+    font_size = max(12, height // 60)
+    font = ImageFont.load_default(size=font_size)
+    margin = width // 12
+    y = margin
+    while y < height - margin:
+        draw.text((margin, y), sentence(rng, rng.randrange(6, 12)), fill=30, font=font)
+        y += int(font_size * 1.6)
+    image = image.rotate(angle, resample=Image.BICUBIC, fillcolor=235)
+    noise = np.random.default_rng(seed).normal(0, 8, (height, width))
+    pixels = np.clip(np.asarray(image, dtype=np.float32) + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels).convert("RGB")
+
+
+# Phone camera photo of a letter, as JPEG or HEIC depending on the suffix.
+def make_photo(path, width=4032, height=3024, seed=0):
+    path = Path(path)
+    image = make_letter_image(width, height, seed)
+    if path.suffix.lower() in (".heic", ".heif"):
+        from pillow_heif import register_heif_opener
+        register_heif_opener()
+        image.save(path, quality=85)
+    else:
+        image.save(path, quality=90)
+    return path
+
+
+# PDF of scanned pages: one letter-size image per page and no text layer.
+def make_scanned_pdf(path, pages, seed=0):
+    images = [make_letter_image(2550, 3300, seed + page) for page in range(pages)]
+    images[0].save(path, save_all=True, append_images=images[1:], resolution=300)
+    return Path(path)
@@ -0,0 +1,255 @@
+# Standard Examination of every document in a directory, without the page.
+#
+#   python examine_batch.py casework/ --out results.jsonl
+#   python examine_batch.py casework/ --out results.jsonl --extract-pdf --runs 8
+#
+# Excel, PDF and image files under the directory are extracted, uploaded and
+# examined with the MATH_ASSISTANT_ID assistant, like the page's Standard
+# Examination, with separate limits on how many extractions, uploads and runs
+# happen at once. One JSON line per document is appended to the output with
+# the summary, usage, cost and stage timings. Running again with the same
+# output skips documents already examined successfully, so an interrupted or
+# partly failed batch resumes where it stopped.
+#
+# The api key, assistant ID and other settings are read from the environment
+# (OPENAI_API_KEY, MATH_ASSISTANT_ID) or .streamlit/secrets.toml. Model
+# requests keep to the RATE_LIMIT_RPM and RATE_LIMIT_TPM limits.
+import argparse
+import hashlib
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from aitam.budget import DOC_TOKEN_BUDGET, preflight
+from aitam.clients import get_openai_client
+from aitam.doc_cache import DocumentCache
+from aitam.examination import RUN_TIMEOUT, STANDARD_EXAMINATION_QUERY, detach_assistant_stores, get_document_vector_store, standard_examination
+from aitam.ingest import COPY_CHUNK_BYTES, DOCUMENT_SUFFIXES, extract_document
+from aitam.lifecycle import VectorStoreLifecycle
+from aitam.metering import METERING_PATH, UsageLedger, metered_stage
+from aitam.ratelimit import CONTEXT_TOKENS, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, caller, configure_rate_limits
+from aitam.settings import SECRETS_PATH, load_settings
+
+DEFAULT_MODEL = "gpt-4o-mini"
+# Default number of documents extracted, uploaded and examined at once.
+EXTRACT_WORKERS = 2
+UPLOAD_WORKERS = 4
+RUN_WORKERS = 4
+# Mode and user batch examinations are recorded under in the usage ledger.
+BATCH_MODE = "batch_examination"
+BATCH_USER = "batch"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(COPY_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Documents under the directory, in a stable order.
+def find_documents(directory):
+    return sorted(
+        path for path in Path(directory).rglob("*")
+        if path.is_file() and path.suffix.lower() in DOCUMENT_SUFFIXES
+    )
+
+
+# Source hashes of the documents already examined successfully in an earlier
+# run with this output.
+def completed_documents(out_path):
+    completed = set()
+    if not out_path.exists():
+        return completed
+    with open(out_path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run.
+                continue
+            if record.get("status") == "ok":
+                completed.add(record["source_sha256"])
+    return completed
+
+
+# Appends result records to the output, one line each, flushed as they are
+# written so an interrupted run loses nothing already finished.
+class ResultWriter:
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+# Runs the examinations of a batch. Each stage is bounded by its own
+# semaphore, so slow OCR doesn't hold up uploads and a long run queue doesn't
+# stop extraction from getting ahead.
+class BatchExaminer:
+    def __init__(self, settings, args, ledger):
+        self.api_key = settings["OPENAI_API_KEY"]
+        self.assistant_id = args.assistant_id or settings["MATH_ASSISTANT_ID"]
+        self.model = args.model
+        self.extract_pdf = args.extract_pdf
+        self.budget = int(settings.get("DOC_TOKEN_BUDGET", DOC_TOKEN_BUDGET))
+        self.timeout = args.run_timeout or float(settings.get("RUN_TIMEOUT", RUN_TIMEOUT))
+        self.ledger = ledger
+        configure_rate_limits(
+            int(settings.get("RATE_LIMIT_RPM", REQUESTS_PER_MINUTE)),
+            int(settings.get("RATE_LIMIT_TPM", TOKENS_PER_MINUTE)),
+            int(settings.get("RATE_LIMIT_CONTEXT_TOKENS", CONTEXT_TOKENS)),
+        )
+        self.client = get_openai_client(self.api_key)
+        # Each run searches only its own document's vector store.
+        detach_assistant_stores(self.client, self.assistant_id)
+        self.lifecycle = VectorStoreLifecycle(self.client, reaper_interval=None)
+        # Nothing follows up on a batch document, so the cache keeps no
+        # unused entries: a file and vector store are released as soon as the
+        # last examination using them, e.g. of two copies of one file, lets go
+        # of them. Condensed documents are released the same way.
+        self.doc_cache = DocumentCache(ttl=None, max_entries=0, on_evict=self.lifecycle.release_entry)
+        self._extract = threading.BoundedSemaphore(args.extractions)
+        self._upload = threading.BoundedSemaphore(args.uploads)
+        self._run = threading.BoundedSemaphore(args.runs)
+
+    def examine(self, path, root, source_sha256):
+        record = {
+            "path": str(path.relative_to(root)),
+            "source_sha256": source_sha256,
+            "model": self.model,
+            "started_at": time.time(),
+        }
+        document = None
+        with self.ledger.meter(BATCH_MODE, BATCH_USER, self.model) as meter, caller(BATCH_USER, BATCH_MODE, meter):
+            try:
+                with self._extract, metered_stage(meter, "extract", suffix=path.suffix.lower()):
+                    document = extract_document(path, self.extract_pdf)
+                record.update(document=document.name, document_bytes=document.size)
+                entry = None
+                condense = False
+                if Path(document.name).suffix == ".txt":
+                    estimate = preflight(document, STANDARD_EXAMINATION_QUERY, self.model, budget=self.budget)
+                    record["document_tokens"] = estimate.document_tokens
+                    record["skipped_chunks"] = estimate.skipped_chunks
+                    condense = estimate.over_budget
+                # Upload and index under the upload limit; the examination
+                # then finds the vector store in the document cache, pinned
+                # until the run is done.
+                if not condense:
+                    with self._upload, metered_stage(meter, "upload"):
+                        entry = get_document_vector_store(self.client, document, "assistants", self.doc_cache, self.lifecycle)
+                try:
+                    with self._run:
+                        messages, run = standard_examination(
+                            document, self.api_key, self.model, self.assistant_id, self.doc_cache,
+                            budget=self.budget, condense=condense, timeout=self.timeout,
+                            meter=meter, lifecycle=self.lifecycle,
+                        )
+                finally:
+                    if entry is not None:
+                        self.doc_cache.release(entry)
+                record["run_status"] = run.status
+                record["summary"] = "\n\n".join(m.content[0].text.value for m in messages)
+                record["status"] = "ok" if run.status == "completed" else "incomplete"
+            except Exception as e:
+                meter.status = "error"
+                record["status"] = "timeout" if isinstance(e, TimeoutError) else "error"
+                record["error"] = f"{type(e).__name__}: {e}"
+            finally:
+                if document is not None:
+                    document.close()
+        record.update(
+            finished_at=time.time(),
+            usage={
+                "api_calls": meter.api_calls,
+                "input_tokens": meter.input_tokens,
+                "output_tokens": meter.output_tokens,
+                "cached_tokens": meter.cached_tokens,
+                "cost": round(meter.cost, 6),
+            },
+            timings={name: round(seconds, 3) for name, seconds in meter.stages.items()},
+            latency=round(meter.latency, 3),
+        )
+        return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Standard Examination on every document in a directory.")
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--out", type=Path, required=True, help="JSONL file results are appended to")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--assistant-id", help="defaults to MATH_ASSISTANT_ID")
+    parser.add_argument("--extract-pdf", action="store_true", help="extract PDF text and OCR scanned pages")
+    parser.add_argument("--extractions", type=int, default=EXTRACT_WORKERS, help="documents extracted at once")
+    parser.add_argument("--uploads", type=int, default=UPLOAD_WORKERS, help="documents uploaded and indexed at once")
+    parser.add_argument("--runs", type=int, default=RUN_WORKERS, help="assistant runs at once")
+    parser.add_argument("--run-timeout", type=float, help="seconds a run may take (default RUN_TIMEOUT)")
+    parser.add_argument("--no-resume", action="store_true", help="examine documents already in the output again")
+    parser.add_argument("--ledger", type=Path, default=METERING_PATH, help="usage ledger the requests are recorded in")
+    args = parser.parse_args(argv)
+
+    settings = load_settings()
+    if not settings.get("OPENAI_API_KEY") or not (args.assistant_id or settings.get("MATH_ASSISTANT_ID")):
+        parser.error(f"OPENAI_API_KEY and MATH_ASSISTANT_ID must be set in the environment or {SECRETS_PATH}")
+    if not args.directory.is_dir():
+        parser.error(f"{args.directory} is not a directory")
+
+    paths = find_documents(args.directory)
+    completed = set() if args.no_resume else completed_documents(args.out)
+    pending = []
+    for path in paths:
+        source_sha256 = file_sha256(path)
+        if source_sha256 not in completed:
+            pending.append((path, source_sha256))
+    print(
+        f"{len(paths)} documents, {len(paths) - len(pending)} already examined, {len(pending)} to examine",
+        file=sys.stderr, flush=True,
+    )
+
+    examiner = BatchExaminer(settings, args, UsageLedger(args.ledger))
+    writer = ResultWriter(args.out)
+    counts = {}
+    pool = ThreadPoolExecutor(max_workers=args.extractions + args.uploads + args.runs, thread_name_prefix="examine")
+    try:
+        futures = [
+            pool.submit(examiner.examine, path, args.directory, source_sha256)
+            for path, source_sha256 in pending
+        ]
+        for done, future in enumerate(as_completed(futures), start=1):
+            record = future.result()
+            writer.write(record)
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+            print(
+                f"[{done}/{len(pending)}] {record['path']}: {record['status']} "
+                f"in {record['latency']:.1f} s (${record['usage']['cost']:.4f})",
+                file=sys.stderr, flush=True,
+            )
+    except KeyboardInterrupt:
+        # Documents not started yet are dropped; running ones finish so
+        # their files and vector stores are released.
+        print("Interrupted, finishing running documents; run again with the same --out to resume.", file=sys.stderr)
+        pool.shutdown(cancel_futures=True)
+        return 130
+    finally:
+        pool.shutdown()
+        writer.close()
+        examiner.doc_cache.invalidate()
+        examiner.lifecycle.flush()
+    print(", ".join(f"{count} {status}" for status, count in sorted(counts.items())) or "Nothing to do.", file=sys.stderr)
+    return 0 if counts.get("ok", 0) == len(pending) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+# Load driver: simulated analysts running Library, Library Pro, both libraries
+# at once, Advisory, document examinations and custom queries against an
+# OpenAI-compatible server, with throughput and latency percentiles per mode.
+#
+# Run from the repository root against the fake server:
+#   python -m loadtest.driver --serve --users 20 --duration 60
+#   python -m loadtest.driver --serve --users 50 --mix library=1 --latency 1.5 --error-rate 0.02
+#   python -m loadtest.driver --base-url http://127.0.0.1:8765/v1 --json results.json
+#
+# The users call the same functions as the page (library.search_library,
+# library.search_libraries, advisory.generate_response_cmte,
+# examination.generate_response) through the pooled clients, so connection
+# pooling, retries, the shared event loop and the document cache are all
+# under load. --serve starts the fake server in a separate process so it
+# doesn't compete with the users for the GIL; the fake server options below
+# only apply then.
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+from loadtest import fake_openai
+
+DEFAULT_MIX = "library=4,library_pro=2,advisory=1,examination=1"
+DEFAULT_MODEL = "gpt-4.1-nano"
+LOAD_API_KEY = "sk-load-test"
+LOAD_ASSISTANT_ID = "asst_load_examiner"
+# Placeholder instructions for the advisory agents; the real ones are
+# encrypted and not needed to exercise the request path.
+LOAD_INSTRUCTIONS = {
+    name: f"You are the {name} advisor of a threat assessment team."
+    for name in ("1", "2", "3", "4", "ORCH", "SYNTH", "FALLBACK")
+}
+LIBRARY_QUERIES = (
+    "What are the warning behaviors of targeted violence?",
+    "How should a team document a threat assessment interview?",
+    "When should law enforcement be involved in a school threat case?",
+    "What belongs in a safety plan for a reported threat?",
+)
+# Size of the synthetic case notes submitted for examination.
+EXAMINATION_DOCUMENT_BYTES = 64 * 1024
+
+
+# Stands in for the Streamlit placeholder a streamed answer is written to.
+class NullPlaceholder:
+    def markdown(self, text):
+        pass
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        mode, _, weight = part.partition("=")
+        mode = mode.strip()
+        if mode not in MODES:
+            raise argparse.ArgumentTypeError(f"unknown mode {mode!r}, expected one of {', '.join(MODES)}")
+        mix[mode] = float(weight or 1)
+    return mix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Start the fake server in a child process and wait until it accepts
+# connections.
+def serve(args):
+    port = free_port()
+    command = [
+        sys.executable, "-m", "loadtest.fake_openai", "--port", str(port),
+        "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--run-seconds", str(args.run_seconds), "--index-seconds", str(args.index_seconds),
+        "--stream-deltas", str(args.stream_deltas), "--delta-delay", str(args.delta_delay),
+        "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate),
+        "--retry-after", str(args.retry_after),
+    ]
+    for value in args.latency_for or []:
+        command += ["--latency-for", value]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, f"http://127.0.0.1:{port}/v1"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The fake OpenAI server did not start.")
+
+
+# Shared state of a load run: the clients, agent graph and document cache the
+# users share, and the meters of finished requests.
+class LoadRun:
+    def __init__(self, model, advisory_deadline=None, advisory_hedge_after=None):
+        # Imported here so OPENAI_BASE_URL is set before any client exists.
+        from aitam.advisory import build_advisory_agents
+        from aitam.clients import configure_agents, get_openai_client
+        from aitam.doc_cache import DocumentCache
+        from aitam.examination import detach_assistant_stores
+        from aitam.lifecycle import VectorStoreLifecycle
+
+        self.model = model
+        self.advisory_deadline = advisory_deadline
+        self.advisory_hedge_after = advisory_hedge_after
+        self.client = get_openai_client(LOAD_API_KEY)
+        configure_agents(LOAD_API_KEY)
+        self.agents = build_advisory_agents(model, "vs_load_library", LOAD_INSTRUCTIONS)
+        self.lifecycle = VectorStoreLifecycle(self.client, reaper_interval=None)
+        detach_assistant_stores(self.client, LOAD_ASSISTANT_ID)
+        self.doc_cache = DocumentCache(on_evict=self.lifecycle.release_entry, max_age=self.lifecycle.max_cached_age)
+        self.meters = []
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, meter, error=None):
+        with self._lock:
+            self.meters.append(meter)
+            if error is not None:
+                self.errors[(meter.mode, type(error).__name__)] += 1
+
+
+def run_library(run, meter, vector_store_id):
+    from aitam.library import get_answer_content, search_library
+    with meter.stage("search"):
+        response = search_library(
+            run.client, run.model, vector_store_id, random.choice(LIBRARY_QUERIES),
+            NullPlaceholder(), meter,
+        )
+    meter.add_usage(response.usage)
+    get_answer_content(response)
+
+
+def run_library_both(run, meter):
+    from aitam.library import get_answer_content, search_libraries
+    placeholders = [NullPlaceholder(), NullPlaceholder()]
+    with meter.stage("search"):
+        responses = search_libraries(
+            run.client, run.model, ["vs_load_library2", "vs_load_library"], random.choice(LIBRARY_QUERIES),
+            placeholders, meter,
+        )
+    for response in responses:
+        if isinstance(response, Exception):
+            raise response
+        meter.add_usage(response.usage)
+        get_answer_content(response)
+
+
+def run_advisory(run, meter):
+    from aitam.advisory import generate_response_cmte
+    from aitam.clients import get_async_openai_client, run_async
+    answer = run_async(generate_response_cmte(
+        get_async_openai_client(LOAD_API_KEY), run.model, "vs_load_library", random.choice(LIBRARY_QUERIES),
+        run.agents, LOAD_INSTRUCTIONS["FALLBACK"], deadline=run.advisory_deadline,
+        hedge_after=run.advisory_hedge_after, meter=meter,
+    ))
+    if not answer.text:
+        raise RuntimeError("The advisory panel returned no answer.")
+
+
+# Examine a new document each time, so every examination uploads and indexes
+# a file like a fresh submission would.
+def run_examination(run, meter):
+    from aitam.examination import STANDARD_EXAMINATION_QUERY, generate_response
+    from aitam.ingest import DocumentBuffer
+    document = DocumentBuffer(f"case-{random.getrandbits(64):016x}.txt")
+    try:
+        document.write(os.urandom(EXAMINATION_DOCUMENT_BYTES // 2).hex())
+        messages = generate_response(
+            document, LOAD_API_KEY, run.model, LOAD_ASSISTANT_ID,
+            STANDARD_EXAMINATION_QUERY, run.doc_cache, meter=meter, lifecycle=run.lifecycle,
+        )[0]
+    finally:
+        document.close()
+    if not messages:
+        raise RuntimeError("The examination returned no messages.")
+
+
+# Ask about a new document each time, searched with a local chunk index like
+# the page's custom queries on extracted text.
+def run_custom_query(run, meter):
+    from aitam.examination import generate_response_noassist
+    from aitam.ingest import DocumentBuffer
+    from aitam.retrieval import ChunkIndex
+    document = DocumentBuffer(f"case-{random.getrandbits(64):016x}.txt")
+    try:
+        for row in range(EXAMINATION_DOCUMENT_BYTES // 64):
+            document.write(f"Sheet1 row {row}: report {os.urandom(16).hex()} noted a threat\n")
+        with meter.stage("index"):
+            index = ChunkIndex.from_document(document)
+        response = generate_response_noassist(
+            document, LOAD_API_KEY, run.model, random.choice(LIBRARY_QUERIES),
+            run.doc_cache, meter=meter, index=index,
+        )[0]
+    finally:
+        document.close()
+    if not response.output_text:
+        raise RuntimeError("The custom query returned no answer.")
+
+
+MODES = {
+    "library": lambda run, meter: run_library(run, meter, "vs_load_library2"),
+    "library_pro": lambda run, meter: run_library(run, meter, "vs_load_library"),
+    "library_both": run_library_both,
+    "advisory": run_advisory,
+    "examination": run_examination,
+    "custom_query": run_custom_query,
+}
+
+
+# One simulated analyst: picks a mode by weight, runs it, pauses for a think
+# time around the mean, and repeats until the deadline.
+def user_loop(run, mix, deadline, think_time, start_delay):
+    from aitam.metering import Meter
+    from aitam.ratelimit import caller
+    time.sleep(start_delay)
+    modes, weights = list(mix), list(mix.values())
+    user = threading.current_thread().name
+    while time.monotonic() < deadline:
+        mode = random.choices(modes, weights)[0]
+        meter = Meter(mode, user, run.model)
+        try:
+            with caller(user, mode, meter):
+                MODES[mode](run, meter)
+        except Exception as e:
+            meter.status = "error"
+            meter.finished = time.monotonic()
+            run.record(meter, e)
+        else:
+            meter.finished = time.monotonic()
+            run.record(meter)
+        if think_time > 0:
+            time.sleep(random.uniform(0, 2 * think_time))
+
+
+# Requests, errors, throughput and latency percentiles per mode, with the p50
+# and p95 of each stage.
+def report(run, elapsed):
+    from aitam.metering import percentile
+    results = {}
+    for mode in sorted({meter.mode for meter in run.meters}):
+        meters = [meter for meter in run.meters if meter.mode == mode]
+        ok = [meter for meter in meters if meter.status != "error"]
+        latencies = [meter.finished - meter.started for meter in ok]
+        stages = {}
+        for meter in ok:
+            for name, seconds in meter.stages.items():
+                stages.setdefault(name, []).append(seconds)
+        results[mode] = {
+            "requests": len(meters),
+            "errors": len(meters) - len(ok),
+            "throughput": len(ok) / elapsed,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else None,
+            "api_calls": sum(meter.api_calls for meter in meters),
+            "stages": {
+                name: {"p50": percentile(values, 50), "p95": percentile(values, 95)}
+                for name, values in sorted(stages.items())
+            },
+            "error_types": {
+                error: count for (error_mode, error), count in run.errors.items() if error_mode == mode
+            },
+        }
+    return results
+
+
+def seconds(value):
+    return f"{value:.2f}" if value is not None else "-"
+
+
+def print_report(results, elapsed, users):
+    total = sum(result["requests"] for result in results.values())
+    print(f"\n{users} users, {elapsed:.1f} s, {total} requests\n")
+    header = f"{'mode':<12} {'requests':>8} {'errors':>7} {'req/s':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'max s':>7}"
+    print(header)
+    print("-" * len(header))
+    for mode, result in results.items():
+        print(
+            f"{mode:<12} {result['requests']:>8} {result['errors']:>7} {result['throughput']:>7.2f} "
+            f"{seconds(result['p50']):>7} {seconds(result['p95']):>7} "
+            f"{seconds(result['p99']):>7} {seconds(result['max']):>7}"
+        )
+    for mode, result in results.items():
+        if result["stages"]:
+            print(f"\n{mode} stages (p50 / p95 s)")
+            for name, stage in result["stages"].items():
+                print(f"  {name:<14} {seconds(stage['p50']):>7} / {seconds(stage['p95'])}")
+        for error, count in result["error_types"].items():
+            print(f"  {mode} error {error}: {count}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent analysts against an OpenAI-compatible server.")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to keep starting requests")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="seconds over which users start")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean pause between a user's requests")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help=f"mode weights (default {DEFAULT_MIX})")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--advisory-deadline", type=float, help="seconds an advisory consultation may take")
+    parser.add_argument("--rpm", type=int, help="requests per minute the scheduler allows (default unlimited)")
+    parser.add_argument("--tpm", type=int, help="estimated tokens per minute the scheduler allows (default unlimited)")
+    parser.add_argument("--advisory-hedge-after", type=float, help="seconds before the advisory fallback is hedged")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--base-url", help="OpenAI-compatible API to load, e.g. a running fake server")
+    target.add_argument("--serve", action="store_true", help="start a fake server for the run")
+    parser.add_argument("--json", help="write the results to this file")
+    fake_openai.add_config_arguments(parser.add_argument_group("fake server (with --serve)"))
+    args = parser.parse_args(argv)
+    if isinstance(args.mix, str):
+        args.mix = parse_mix(args.mix)
+
+    server = None
+    base_url = args.base_url
+    if args.serve:
+        server, base_url = serve(args)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = LOAD_API_KEY
+    # Agents SDK traces would otherwise be exported to the real platform.
+    from agents import set_tracing_disabled
+    set_tracing_disabled(True)
+
+    from aitam.ratelimit import configure_rate_limits, get_scheduler
+    configure_rate_limits(args.rpm, args.tpm)
+
+    try:
+        run = LoadRun(args.model, args.advisory_deadline, args.advisory_hedge_after)
+        started = time.monotonic()
+        deadline = started + args.duration
+        threads = [
+            threading.Thread(
+                target=user_loop, name=f"user-{i + 1}",
+                args=(run, args.mix, deadline, args.think_time, args.ramp_up * i / max(1, args.users)),
+                daemon=True,
+            )
+            for i in range(args.users)
+        ]
+        print(f"Running {args.users} users for {args.duration:g} s against {base_url}", file=sys.stderr, flush=True)
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        run.doc_cache.invalidate()
+        run.lifecycle.flush()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    results = report(run, elapsed)
+    print_report(results, elapsed, args.users)
+    print(f"\n{get_scheduler().snapshot()['rate_limited']:,} rate limited responses")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"users": args.users, "duration": elapsed, "mix": args.mix, "results": results}, file, indent=2)
+    return 1 if not run.meters else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,537 @@
+# Local stand-in for the OpenAI endpoints the app uses, for load tests.
+#
+#   python -m loadtest.fake_openai --port 8765 --latency 0.3 --error-rate 0.01
+#
+# Implements files, vector stores and file batches, assistants, threads,
+# messages and runs (polled and streamed), and the Responses API (plain and
+# streamed) as used by the library search and the Agents SDK. Latency, run
+# and indexing times, token streaming speed and injected errors are
+# configurable. State is kept in memory and nothing is validated beyond what
+# the app needs.
+import argparse
+import json
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER_WORDS = (
+    "The team should document the reported behavior, interview the people "
+    "involved, review prior incidents and agree on a safety plan with clear "
+    "follow-up dates before the next review meeting."
+).split()
+
+
+@dataclass
+class FakeConfig:
+    # Mean latency of every request before it is answered, and its spread as
+    # a fraction of the mean.
+    latency: float = 0.2
+    jitter: float = 0.5
+    # Per-endpoint latency overrides, keyed by endpoint name (see ROUTES).
+    latency_for: dict = field(default_factory=dict)
+    # Time a run stays in progress and a file batch stays indexing.
+    run_seconds: float = 2.0
+    index_seconds: float = 1.0
+    # Streamed text deltas, and the pause between them.
+    stream_deltas: int = 40
+    delta_delay: float = 0.02
+    # Fraction of requests answered with a 500, and with a 429 that carries
+    # a Retry-After header.
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    # Tokens reported in usage.
+    input_tokens: int = 3000
+    output_tokens: int = 400
+
+
+def new_id(prefix):
+    return f"{prefix}_{secrets.token_hex(12)}"
+
+
+def usage(config):
+    return {
+        "input_tokens": config.input_tokens,
+        "input_tokens_details": {"cached_tokens": 0},
+        "output_tokens": config.output_tokens,
+        "output_tokens_details": {"reasoning_tokens": 0},
+        "total_tokens": config.input_tokens + config.output_tokens,
+    }
+
+
+def answer_text(words=60):
+    return " ".join(random.choice(ANSWER_WORDS) for _ in range(words))
+
+
+# In-memory state shared by all request handlers.
+class FakeState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+        self.vector_stores = {}
+        self.batches = {}
+        self.threads = {}
+        self.runs = {}
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOpenAI/1.0"
+
+    # (method, path pattern, endpoint name, handler method)
+    ROUTES = [
+        ("POST", r"/v1/files", "files.create", "create_file"),
+        ("DELETE", r"/v1/files/(?P<id>[^/]+)", "files.delete", "delete_object"),
+        ("POST", r"/v1/vector_stores", "vector_stores.create", "create_vector_store"),
+        ("GET", r"/v1/vector_stores", "vector_stores.list", "list_vector_stores"),
+        ("DELETE", r"/v1/vector_stores/(?P<id>[^/]+)", "vector_stores.delete", "delete_object"),
+        ("GET", r"/v1/vector_stores/(?P<vs>[^/]+)/files", "vector_stores.files.list", "list_vector_store_files"),
+        ("DELETE", r"/v1/vector_stores/(?P<vs>[^/]+)/files/(?P<id>[^/]+)", "vector_stores.files.delete", "delete_object"),
+        ("POST", r"/v1/vector_stores/(?P<vs>[^/]+)/file_batches", "file_batches.create", "create_batch"),
+        ("GET", r"/v1/vector_stores/(?P<vs>[^/]+)/file_batches/(?P<id>[^/]+)", "file_batches.retrieve", "retrieve_batch"),
+        ("POST", r"/v1/assistants/(?P<id>[^/]+)", "assistants.update", "update_assistant"),
+        ("POST", r"/v1/threads", "threads.create", "create_thread"),
+        ("POST", r"/v1/threads/(?P<thread>[^/]+)", "threads.update", "update_thread"),
+        ("POST", r"/v1/threads/(?P<thread>[^/]+)/messages", "messages.create", "create_message"),
+        ("GET", r"/v1/threads/(?P<thread>[^/]+)/messages", "messages.list", "list_messages"),
+        ("POST", r"/v1/threads/(?P<thread>[^/]+)/runs", "runs.create", "create_run"),
+        ("GET", r"/v1/threads/(?P<thread>[^/]+)/runs/(?P<id>[^/]+)", "runs.retrieve", "retrieve_run"),
+        ("POST", r"/v1/threads/(?P<thread>[^/]+)/runs/(?P<id>[^/]+)/cancel", "runs.cancel", "cancel_run"),
+        ("POST", r"/v1/responses", "responses.create", "create_response"),
+        ("POST", r"/v1/traces/ingest", "traces.ingest", "ingest_traces"),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def dispatch(self, method):
+        path, _, query = self.path.partition("?")
+        self.query = dict(part.split("=", 1) for part in query.split("&") if "=" in part)
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        self.body = {}
+        if raw and self.headers.get("Content-Type", "").startswith("application/json"):
+            self.body = json.loads(raw)
+        self.raw_size = len(raw)
+        for route_method, pattern, endpoint, handler in self.ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                self.server.count(endpoint)
+                if self.inject_error():
+                    return
+                self.delay(endpoint)
+                getattr(self, handler)(**match.groupdict())
+                return
+        self.send_json({"error": {"message": f"No fake for {method} {path}", "type": "invalid_request_error"}}, 404)
+
+    def delay(self, endpoint):
+        mean = self.config.latency_for.get(endpoint, self.config.latency)
+        if mean > 0:
+            spread = mean * self.config.jitter
+            time.sleep(max(0.0, random.uniform(mean - spread, mean + spread)))
+
+    def inject_error(self):
+        roll = random.random()
+        if roll < self.config.rate_limit_rate:
+            self.send_json(
+                {"error": {"message": "Rate limit reached (injected).", "type": "rate_limit_error"}},
+                429, {"Retry-After": f"{self.config.retry_after:g}"},
+            )
+            return True
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            self.send_json({"error": {"message": "Server error (injected).", "type": "server_error"}}, 500)
+            return True
+        return False
+
+    def send_json(self, payload, status=200, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Server-sent events over a chunked response, so the connection stays
+    # open for reuse afterwards.
+    def start_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def send_event(self, data, event=None):
+        text = (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
+        chunk = text.encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.flush()
+
+    def end_events(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    # Files and vector stores.
+
+    def create_file(self):
+        content_type = self.headers.get("Content-Type", "")
+        purpose = "assistants" if "assistants" in content_type or self.raw_size else "user_data"
+        file = {
+            "id": new_id("file"), "object": "file", "bytes": self.raw_size,
+            "created_at": int(time.time()), "filename": "document.txt",
+            "purpose": purpose, "status": "processed",
+        }
+        with self.state.lock:
+            self.state.files[file["id"]] = file
+        self.send_json(file)
+
+    def create_vector_store(self):
+        store = {
+            "id": new_id("vs"), "object": "vector_store", "created_at": int(time.time()),
+            "name": self.body.get("name", ""), "usage_bytes": 0, "status": "completed",
+            "file_counts": {"in_progress": 0, "completed": 0, "failed": 0, "cancelled": 0, "total": 0},
+            "metadata": self.body.get("metadata") or {}, "last_active_at": int(time.time()),
+            "expires_after": self.body.get("expires_after"),
+        }
+        with self.state.lock:
+            self.state.vector_stores[store["id"]] = store
+        self.send_json(store)
+
+    def create_batch(self, vs):
+        batch = {
+            "id": new_id("vsfb"), "object": "vector_store.files_batch", "created_at": int(time.time()),
+            "vector_store_id": vs, "status": "in_progress",
+            "file_counts": {"in_progress": len(self.body.get("file_ids", [])), "completed": 0, "failed": 0, "cancelled": 0, "total": len(self.body.get("file_ids", []))},
+        }
+        with self.state.lock:
+            self.state.batches[batch["id"]] = (batch, time.monotonic() + self.config.index_seconds)
+            if vs in self.state.vector_stores:
+                self.state.vector_stores[vs]["file_ids"] = list(self.body.get("file_ids", []))
+        self.send_json(batch)
+
+    def retrieve_batch(self, vs, id):
+        with self.state.lock:
+            batch, ready_at = self.state.batches[id]
+            if time.monotonic() >= ready_at and batch["status"] == "in_progress":
+                counts = batch["file_counts"]
+                batch["status"] = "completed"
+                counts["completed"], counts["in_progress"] = counts["in_progress"], 0
+        self.send_json(batch)
+
+    def delete_object(self, id, vs=None):
+        with self.state.lock:
+            if vs is not None:
+                store = self.state.vector_stores.get(vs, {})
+                store["file_ids"] = [file_id for file_id in store.get("file_ids", []) if file_id != id]
+            else:
+                self.state.files.pop(id, None)
+                self.state.vector_stores.pop(id, None)
+        self.send_json({"id": id, "object": "deleted", "deleted": True})
+
+    def send_list(self, data):
+        self.send_json({
+            "object": "list", "data": data, "has_more": False,
+            "first_id": data[0]["id"] if data else None,
+            "last_id": data[-1]["id"] if data else None,
+        })
+
+    def list_vector_stores(self):
+        with self.state.lock:
+            stores = [
+                {key: value for key, value in store.items() if key != "file_ids"}
+                for store in self.state.vector_stores.values()
+            ]
+        self.send_list(stores)
+
+    def list_vector_store_files(self, vs):
+        with self.state.lock:
+            file_ids = list(self.state.vector_stores.get(vs, {}).get("file_ids", []))
+        self.send_list([{
+            "id": file_id, "object": "vector_store.file", "created_at": int(time.time()),
+            "vector_store_id": vs, "status": "completed", "usage_bytes": 0, "last_error": None,
+        } for file_id in file_ids])
+
+    # Assistants, threads and runs.
+
+    def update_assistant(self, id):
+        self.send_json({
+            "id": id, "object": "assistant", "created_at": int(time.time()), "model": "gpt-4o-mini",
+            "name": "aitam", "instructions": "", "tools": self.body.get("tools", []),
+            "tool_resources": self.body.get("tool_resources"), "metadata": {},
+        })
+
+    def create_thread(self):
+        thread = {"id": new_id("thread"), "object": "thread", "created_at": int(time.time()), "metadata": {}}
+        with self.state.lock:
+            self.state.threads[thread["id"]] = []
+        self.send_json(thread)
+
+    def update_thread(self, thread):
+        self.send_json({
+            "id": thread, "object": "thread", "created_at": int(time.time()),
+            "tool_resources": self.body.get("tool_resources"), "metadata": {},
+        })
+
+    def message(self, thread, role, text, run_id=None, assistant_id=None):
+        return {
+            "id": new_id("msg"), "object": "thread.message", "created_at": int(time.time()),
+            "thread_id": thread, "role": role, "status": "completed",
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+            "run_id": run_id, "assistant_id": assistant_id, "attachments": [], "metadata": {},
+        }
+
+    def create_message(self, thread):
+        message = self.message(thread, self.body.get("role", "user"), str(self.body.get("content", "")))
+        with self.state.lock:
+            self.state.threads.setdefault(thread, []).append(message)
+        self.send_json(message)
+
+    def list_messages(self, thread):
+        with self.state.lock:
+            self.complete_due_runs()
+            messages = list(self.state.threads.get(thread, []))
+        if "run_id" in self.query:
+            messages = [message for message in messages if message["run_id"] == self.query["run_id"]]
+        if self.query.get("order") != "asc":
+            messages.reverse()
+        self.send_list(messages)
+
+    def run(self, thread, status):
+        return {
+            "id": new_id("run"), "object": "thread.run", "created_at": int(time.time()),
+            "thread_id": thread, "assistant_id": self.body.get("assistant_id"), "status": status,
+            "model": "gpt-4o-mini", "instructions": "", "tools": [], "metadata": {},
+            "parallel_tool_calls": True, "usage": None,
+        }
+
+    def finish_run(self, run):
+        run["status"] = "completed"
+        run["completed_at"] = int(time.time())
+        run["usage"] = {
+            "prompt_tokens": self.config.input_tokens,
+            "completion_tokens": self.config.output_tokens,
+            "total_tokens": self.config.input_tokens + self.config.output_tokens,
+        }
+        message = self.message(run["thread_id"], "assistant", answer_text(), run["id"], run["assistant_id"])
+        self.state.threads.setdefault(run["thread_id"], []).append(message)
+        return message
+
+    # Complete polled runs whose time is up. Called with the state lock held.
+    def complete_due_runs(self):
+        now = time.monotonic()
+        for run, ready_at in self.state.runs.values():
+            if run["status"] == "in_progress" and now >= ready_at:
+                self.finish_run(run)
+
+    def create_run(self, thread):
+        run = self.run(thread, "queued")
+        if not self.body.get("stream"):
+            run["status"] = "in_progress"
+            with self.state.lock:
+                self.state.runs[run["id"]] = (run, time.monotonic() + self.config.run_seconds)
+            self.send_json(dict(run, status="queued"))
+            return
+        self.start_events()
+        self.send_event(run, "thread.run.created")
+        run["status"] = "in_progress"
+        self.send_event(run, "thread.run.in_progress")
+        time.sleep(self.config.run_seconds)
+        with self.state.lock:
+            self.state.runs[run["id"]] = (run, 0)
+            message = self.finish_run(run)
+        self.send_event(message, "thread.message.created")
+        self.send_event(message, "thread.message.completed")
+        self.send_event(run, "thread.run.completed")
+        self.send_event("[DONE]", "done")
+        self.end_events()
+
+    def retrieve_run(self, thread, id):
+        with self.state.lock:
+            self.complete_due_runs()
+            run = dict(self.state.runs[id][0])
+        self.send_json(run)
+
+    def cancel_run(self, thread, id):
+        with self.state.lock:
+            run = self.state.runs[id][0]
+            if run["status"] in ("queued", "in_progress"):
+                run["status"] = "cancelled"
+            run = dict(run)
+        self.send_json(run)
+
+    # Responses API.
+
+    def response_output(self, text):
+        output = []
+        tools = self.body.get("tools") or []
+        vector_stores = [store for tool in tools if tool.get("type") == "file_search" for store in tool.get("vector_store_ids") or []]
+        annotations = []
+        if vector_stores:
+            output.append({
+                "id": new_id("fs"), "type": "file_search_call", "status": "completed",
+                "queries": [str(self.body.get("input"))[:200]], "results": [],
+            })
+            annotations = [{"type": "file_citation", "file_id": "file_library", "filename": "library.pdf", "index": len(text)}]
+        output.append({
+            "id": new_id("msg"), "type": "message", "role": "assistant", "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": annotations}],
+        })
+        return output
+
+    # Agents SDK turns: on the first turn of an agent with function tools
+    # (the orchestrator), call every tool; once their outputs are in the
+    # input, answer.
+    def function_calls(self):
+        functions = [tool for tool in self.body.get("tools") or [] if tool.get("type") == "function"]
+        items = self.body.get("input")
+        if not functions or not isinstance(items, list):
+            return []
+        if any(isinstance(item, dict) and item.get("type") == "function_call_output" for item in items):
+            return []
+        return [{
+            "id": new_id("fc"), "type": "function_call", "status": "completed",
+            "call_id": new_id("call"), "name": tool["name"],
+            "arguments": json.dumps({"input": "Please advise on the question."}),
+        } for tool in functions]
+
+    def response(self, output, status="completed"):
+        return {
+            "id": new_id("resp"), "object": "response", "created_at": int(time.time()),
+            "status": status, "model": self.body.get("model", "gpt-4o-mini"),
+            "output": output, "parallel_tool_calls": True, "tool_choice": "auto",
+            "tools": self.body.get("tools") or [], "temperature": self.body.get("temperature"),
+            "top_p": None, "instructions": self.body.get("instructions"), "metadata": {},
+            "error": None, "incomplete_details": None,
+            "previous_response_id": self.body.get("previous_response_id"),
+            "usage": usage(self.config) if status == "completed" else None,
+        }
+
+    def create_response(self):
+        calls = self.function_calls()
+        text = answer_text()
+        if not self.body.get("stream"):
+            self.send_json(self.response(calls or self.response_output(text)))
+            return
+        sequence = iter(range(1_000_000))
+        self.start_events()
+        self.send_event({"type": "response.created", "sequence_number": next(sequence), "response": self.response([], "in_progress")})
+        words = text.split(" ")
+        step = max(1, len(words) // self.config.stream_deltas)
+        item_id = new_id("msg")
+        for start in range(0, len(words), step):
+            time.sleep(self.config.delta_delay)
+            self.send_event({
+                "type": "response.output_text.delta", "sequence_number": next(sequence),
+                "item_id": item_id, "output_index": 0, "content_index": 0,
+                "delta": " ".join(words[start:start + step]) + " ", "logprobs": [],
+            })
+        self.send_event({"type": "response.completed", "sequence_number": next(sequence), "response": self.response(calls or self.response_output(text))})
+        self.end_events()
+
+    def ingest_traces(self):
+        self.send_json({}, 200)
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, config=None):
+        super().__init__(address, FakeOpenAIHandler)
+        self.config = config or FakeConfig()
+        self.state = FakeState()
+        self.counts = {}
+        self._counts_lock = threading.Lock()
+
+    # Clients may hang up mid-stream, e.g. once a run reaches a final event.
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def count(self, endpoint):
+        with self._counts_lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+# Start a fake server on a background thread, e.g. from a test or the load
+# driver. Port 0 picks a free port; see server.base_url.
+def start_server(config=None, host="127.0.0.1", port=0):
+    server = FakeOpenAIServer((host, port), config)
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+
+def parse_latency_for(values):
+    overrides = {}
+    for value in values or []:
+        endpoint, _, seconds = value.partition("=")
+        overrides[endpoint] = float(seconds)
+    return overrides
+
+
+def add_config_arguments(parser):
+    defaults = FakeConfig()
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="mean seconds before each reply")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter, help="latency spread as a fraction of the mean")
+    parser.add_argument("--latency-for", action="append", metavar="ENDPOINT=SECONDS", help="per-endpoint latency, e.g. responses.create=1.5")
+    parser.add_argument("--run-seconds", type=float, default=defaults.run_seconds)
+    parser.add_argument("--index-seconds", type=float, default=defaults.index_seconds)
+    parser.add_argument("--stream-deltas", type=int, default=defaults.stream_deltas)
+    parser.add_argument("--delta-delay", type=float, default=defaults.delta_delay)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="fraction of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate, help="fraction of requests failing with 429")
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+
+
+def config_from_arguments(args):
+    return FakeConfig(
+        latency=args.latency, jitter=args.jitter, latency_for=parse_latency_for(args.latency_for),
+        run_seconds=args.run_seconds, index_seconds=args.index_seconds,
+        stream_deltas=args.stream_deltas, delta_delay=args.delta_delay,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake OpenAI API server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    server = FakeOpenAIServer((args.host, args.port), config_from_arguments(args))
+    print(f"Fake OpenAI API listening on {server.base_url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,339 +1,433 @@
 import streamlit as st
 import streamlit_authenticator as stauth
-import openai
-from openai import OpenAI
-from openai import AsyncOpenAI
-from agents import Agent, ItemHelpers, MessageOutputItem, Runner, FileSearchTool, function_tool, trace
-import asyncio
-import os
-import pandas as pd
-import openpyxl
-import tiktoken
-import json
 import time
 import yaml
 from yaml.loader import SafeLoader
 from pathlib import Path
-from PyPDF2 import PdfReader, PdfWriter
-from PIL import Image
-import pytesseract
-from cryptography.fernet import Fernet
-import re
-
-# Wait until run process completion.
-def wait_on_run(client, run, thread):
-    while run.status == "queued" or run.status == "in_progress":
-        run = client.beta.threads.runs.retrieve(
-            thread_id=thread.id,
-            run_id=run.id,
-        )
-        time.sleep(0.5)
-    return run
-
-# Retrieve messages from the thread, including message added by the assistant.
-def get_response(client, thread):
-    return client.beta.threads.messages.list(thread_id=thread.id, order="asc")
-
-# Start client, thread, create file and add it to the openai vector store, update an
-# existing openai assistant with the new vector store, create a run to have the 
-# assistant process the vector store.
-def generate_response(filename, openai_api_key, model, assistant_id, query_text):    
-    # Check file existence.
-    if filename is not None:
-        # Start client, thread.
-        client = OpenAI(api_key=openai_api_key)
-        thread = client.beta.threads.create()
-        # Start thread.
-        client.beta.threads.messages.create(
-            thread_id=thread.id, role="user", content=query_text
-        )
-        
-        # Create file at openai storage from the uploaded file.
-        file = client.files.create(
-            file=open(filename, "rb"),
-            purpose="assistants"
-        )
-        
-        # Create vector store for processing by assistant.
-        vector_store = client.vector_stores.create(
-            name="aitam"
-        )
-        # Obtain vector store and file ids.
-        TMP_VECTOR_STORE_ID = str(vector_store.id)
-        TMP_FILE_ID = str(file.id)
-        # Add the file to the vector store.
-        batch_add = client.vector_stores.file_batches.create(
-            vector_store_id=TMP_VECTOR_STORE_ID,
-            file_ids=[TMP_FILE_ID]
-        )        
-        # Update Assistant, pointed to the vector store.
-        assistant = client.beta.assistants.update(
-            assistant_id,
-            tools=[{"type": "file_search"}],
-            tool_resources={
-                "file_search":{
-                    "vector_store_ids": [TMP_VECTOR_STORE_ID]
-                }
-            }
-        )
-        # Create a run to have assistant process the vector store file.
-        run = client.beta.threads.runs.create(
-            thread_id=thread.id,
-            assistant_id=assistant_id,
-        )
-        # Wait on the run to complete, then retrieve messages from the thread.
-        run = wait_on_run(client, run, thread)
-        messages = get_response(client, thread)
-    return messages, TMP_FILE_ID, TMP_VECTOR_STORE_ID, client, run, thread
-
-# Constructed similar to above, exempt no use of the assistant. This calls the 
-# llm with a user's query about the vector store. The vector store is re-
-# constructed since every action on streamlit runs through the entire code.
-# Parts of this function can likely be broken down into other functions. 
-# The code might also be restructured to avoid re-building the vector store.
-def generate_response_noassist(filename, openai_api_key, model, query_text):    
-    # Check file existence.
-    if filename is not None:
-        # Start client, thread.        
-        client = OpenAI(api_key=openai_api_key)
-        thread = client.beta.threads.create()
-        # Create file at openai storage from the uploaded file.
-        file = client.files.create(
-            file=open(filename, "rb"),
-            purpose="user_data"
-        )
-        # Create vector store for processing by assistant.
-        vector_store = client.vector_stores.create(
-            name="aitam"
-        )
-        # Obtain vector store and file ids.        
-        TMP_VECTOR_STORE_ID = str(vector_store.id)
-        TMP_FILE_ID = str(file.id)
-        # Add the file to the vector store.                        
-        batch_add = client.vector_stores.file_batches.create(
-            vector_store_id=TMP_VECTOR_STORE_ID,
-            file_ids=[TMP_FILE_ID]
-        )
-        # Get messages from client based on user query of the vector store.
-        messages = client.responses.create(
-            input = query_text,
-            model = model,
-            temperature = 1,
-            tools = [{
-                "type": "file_search",
-                "vector_store_ids": [TMP_VECTOR_STORE_ID],
-            }]
-        )        
-    return messages, TMP_FILE_ID, TMP_VECTOR_STORE_ID, client
-
-# Called when the advisory agent system exceeds the max turn limit.
-# Uses a single OpenAI API call to generate a synthesized response
-# based on the perspectives of the advisory group.
-def fallback_summary_request(model, vs_id, query_text):
-    INSTRUCTION_ENCRYPTED = b'gAAAAABohtGfHcmOGHFRTsdWg0GtzwWFPathTsqYs87K2kr2siCM-sZ7WhLDNj1Nn39tYpktrByZSbCf8JakwTLupxkfJNDoET3aLhhp8kZIMQPNSsAtDN5vp48I6TeJjBYI7qMwtEI3Sa3RIF2W-_uZFtR2ee6PFEhvKtxa_84_CILAgsJ9Fy6KP1Fi6mwFTftYDnKydQRHQpBQX_YTgkjfZZ7eYNbdNLsHQApJ17yPkSGyP4CBk6ucbiIR8osMNTPis2vQZ2RrmsfLdMN7dDU7uhmW9YkVIl3tCmcKrMZnAnP-8p-BN2lIoKOn2iPxZjlZCwFYBYkFia3yopsh9_bR9mSdn3wiqkIjYjZwRRHWRkBnolzlSTVC5flMkp9YJY75n-wqdvvcrWSKjrSQRoE-dtaa2zl6msFeyLugD9TCk_XjDfMpBrCTUzUtA7raDQhOevlZtDbvWsbr_bQ-YNRVwlBm0oBhNXmBKmmN0wrIqA1iRd7cOM_XXZVf0LsirCTg_R-GpIqwE5Mfj8QVRxla2oXdpMGCMwfz1LF0gLxRupcRZI6u7zgBlG7dXHqrYLTgSXSlBC7knkWcVbI3FXVCb3B4jmTnZjbLbSZk7fv6lovglgoh-TU6fVue26SgxMWH8SHDRe3zaK7QWlp7xLvb0Ar7LWg01DsRuBU1sgn7aMX6et8et7BQSOPWrrD9TYNHUyWam_6PagGA0EYg0pt7Om4noWJx_EtYbh9SrVtJsqDFaOJvtgYEsjmu_8iCjB0aHiLRSpWji2aaeewXXVtMjtWJp9ZM0u_w9NJHh-LdvqTPWZLxvWpRJaeSkVl4ip_macM1oOBlvO81y7jWkNv_ivQLgRYXPNESBcrt71zc4XT_1alvvzShueycx8Je-k21bOlYZzZ3TCjUc93010h07Fr-JPiLYUEUE4Zui4FWh5Ogv0QwsTvhgr7pXFsLcpzyCaS8Jxp_Z_nmFyixpMcAri7XwBL0eh1js1pVNsfvqhw6UqCWOkbrnK1254z41nuEDChNOty9dydU_OYHw7a_Sm8no3c9IGoa-j5m-sP-8ES4NeXleNHD_gm8XsLYJv1o_3O4D5tGGq_Xtr94SWcE1klOGCva6f72TzyEfIs6UvcBde7rxTiY6s2OlOA1FypuP_A1pCEkh24xGd2MN6px-x2f-UiSOm5NJbCCJTG2gK69y6b_dYD-zflAd2pMn_F0YeKrMMU3qWh-ILjQ29yJaJf8Ri19XqgZyBgE62Z5GOlQiNXmIDwnvq03FWjTx5ySUAYflChe1wgikuNHNXBa-xFK7qV0ySP_szOQiYHRDrUKjiDKGT32JwiItVmeYkt_zE_Bf1A3HCcOFiQ3Hdvd_xVETOAxsxECn58kCPgwdPd1JlICXS03xseAlQyIx4OYs-2B50iBi6Mk83YHOPOKtQ1TGnpBpDeCrwZb1YFIsAuc5QmScreH_P8s847AW9WhoVH3DcVtuf4LEFsoDysZbL-zKkBM6NecuAyLxraoTy9Ayu6IZ0k='
-    key = st.secrets['INSTRUCTION_KEY'].encode()
-    f = Fernet(key)
-    INSTRUCTION = f.decrypt(INSTRUCTION_ENCRYPTED).decode()
-
-    # Get messages from client based on user query of the vector store.
-    client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-    response = client.responses.create(
-        input = INSTRUCTION,
-        model = model,
-        temperature = 0.6,
-        tools = [{
-            "type": "file_search",
-            "vector_store_ids": vs_id,
-        }]
-    )
+import contextlib
+from aitam.clients import get_openai_client, get_async_openai_client, configure_agents, run_async
+from aitam.answer_cache import AnswerCache, ANSWER_CACHE_PATH, ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_ENTRIES
+from aitam.budget import DOC_TOKEN_BUDGET, estimate_cost, preflight
+from aitam.ingest import DocumentBuffer, IMAGE_SUFFIXES, extract_document
+from aitam.doc_cache import DocumentCache, DEFAULT_TTL, DEFAULT_MAX_ENTRIES
+from aitam.metering import UsageLedger, METERING_PATH, METERING_RETENTION, metered_stage
+from aitam.tracing import TRACE_PATH, breakdown, configure_tracing, span
+from aitam.examination import STANDARD_EXAMINATION_QUERY, RUN_TIMEOUT, Conversation, detach_assistant_stores, follow_up_examination, generate_response_noassist, standard_examination
+from aitam.lifecycle import VectorStoreLifecycle, ORPHAN_AGE, REAPER_INTERVAL
+from aitam.advisory import ADVISORY_DEADLINE, ADVISORY_HEDGE_AFTER, ADVISORY_MAX_TURNS, SPECIALIST_TIMEOUT, build_advisory_agents, decrypt_instructions, generate_response_cmte
+from aitam.library import CITATION_PATTERN, LIBRARY_TEMPERATURE, get_answer_content, search_libraries, search_library
+from aitam.retrieval import ChunkIndex, LOCAL_INDEX_MAX_BYTES, can_index_locally
+from aitam.ratelimit import CONTEXT_TOKENS, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, caller, configure_rate_limits
+from aitam.jobs import JobQueue, JOB_WORKERS, JOB_POLL_SECONDS, QUEUED, RUNNING, DONE, FAILED
 
-    cleaned_response = re.sub(r'【.*?†.*?】', '', response.output[1].content[0].text)
-    return cleaned_response
-
-# Initiate AI assistant and create a run to have the assistant answer the user
-# query. 
-async def generate_response_cmte(model, vs_id, query_text):    
-    # client = OpenAI(api_key=openai_api_key)
-    # thread = client.beta.threads.create()
-    # # Start thread.
-    # client.beta.threads.messages.create(
-    #     thread_id=thread.id, role="user", content=query_text
-    # )
-
-    INSTRUCTION1_ENCRYPTED = b'gAAAAABohrfKeKyi7cJNlxQFjKlgnElw4zs3DyDqmUrMelL84BbaB7fABpc5SdaBgk8LtQpqYfBSext5KVJ3IEMipmiQo68TKiE3U-CCVbkSrBlQ2soPLroxZe90vgmFwPSVzGLmkAgVGYu_Hfkj6JJOJz4_ILG9gJNYJZgZBbqcmTnxZiLRUIYhOctURCuVGyx_QupFwCaLxrA5UplM0EkBs41NflecvtbnPf-bh5FYqJ8POxkIjzxViZa10bemGn9G52_e5FcydRj0a7Odz99cKWRsHP8bwmlqEA5IwQ0llDQEL1AbmmPgY5PlXOJQjRjx3eNCF9IP'
-    INSTRUCTION2_ENCRYPTED = b'gAAAAABohrikHHiMjsrUNWcfWOKRXxdS2GLyFvi89a1Dz0g4WbHnFesTWPYk-gjIicWWqFIK5ylBqVogkKRRatczEoV9koinYg8SCvshUMTy3N3VjDNs6uxJqHbbbP5yU-P0tWLT1oWmV5ij7THbedi1Ay_ksXLFXcf7RrcgS4PitvRcpTVqFzfbMQubAHlVQUq_QkV3hiFuicb7wMFKMNE3XlmXIPElUqt6msXIsooYQm7DsRZVDoQyw4DcPhwQyYY7ljYbISqnNNsCaVSLV7zmQ_srbrTdWmjnx2LnQaT29_QobRN2IG4='
-    INSTRUCTION3_ENCRYPTED = b'gAAAAABohrl4WetHeGSipX0T2BV7PprVCiO42Vq77Ln_bfV9mxBGBEgFXYdSGee28ZO6E5nPqKo3Vtq8rMi5W_ixAJEC1NmGuw-dY5uIJjDbRuFQCUqru-M_mh6z3oaYXPoIz58cHrs2JyWUIXtJllsb16jE83Z26bjt1ihJxEaI-OPrp3B2bmrKNdtH-t-345PRjV3ozYqtIOdywQiOEb-nGBtb8JHoyBNZj5nVKS_3SZhNNzjHPOTLAMFPdnZTQCX-DO85AUgy5ygGpS-7I-nnxe-PgGaBw4KumKuN0x_suBtvi6sTdr0='
-    INSTRUCTION4_ENCRYPTED = b'gAAAAABohroZYUOEDOJEk3uahy7f7YESV77xekvW1OT0HVgU0uhVj4xyvSvfsdw4EPfUGxuPHJAXEd9cAfHFPdCpw21oLr8H6rSsLt4lwJ8AjRa8Wr29V2trNH-1fV8bJs3j-NTfYLB_vomAT9SYtNa4wKQyxSDKi1Q7owZkJ4mM_qqkVa6dn9n0vfqYsHfMdMx9TFL9uUZeoTKyZx1VAzG_cvf9Hj1dDcMTQlKEku-BOIMdiPzFsRPMkV690KtFhoLChTAWNdOrVVjRrxLZxyQptVxp14egx3WUpf6dgWvl2-Sh5MpjDs8P6GaIcEjm5_OqZrd2kjXC1xGgoGvjzqAlna1umILRug=='
-    INSTRUCTION_ORCH_ENCRYPTED = b'gAAAAABohsoPvOB9VD4AXKY7wctD5iW69QZTIs5n7RGySuirQBPPy__4qcyRwyMIZq2gJZZG_B3cTRbEoPCb2XRe8TmemLx0nQMkwfp5LR2zOeqN6u2sgfEX4vJG5XP9rOJP4Pn5Lgav1ADFaFCzPRQofJ5on6zLhyvv8hrDHygto85PvhKwHeL9WMgEATfKmX-NX3IpOrSFup-v5thWB-Ns21Dq1zNMj7XXpmKE7PvWEY7f5jhH8JaDVvaB0KWEUAP6kfmrjbUhI4yuf2RJRRCRZLrr_IZ60A7V6PSSZln5aNdJdea-DQ-auWlaAztU3tdM4UT2edXhNvpuOtacOayLi3RMKC-oN9HJo02onybR6E4I8Par_Gk_0U5BKmUa-LT6GutY6MXDEonYHk4oJFwHni6agQeldUkvWWC7s7RQfVh-NwUwRr9HeFSBpQjPUQN8ad0cE9EYpFAMLGUwUZXexHqrmO2w31p0nhQ9fYEyXjiEk9JBRGmBQHG3W1dD0xKpPVdVj4v9nmBB6QxOlQW-bMzCaBNZrP0i_2HniO8x3BnBaCcK4TwZPjjQXNlbX1wVWx6TMSwXcFG0k1B4NcL4SuF5aLo5mFymYYgIbBRWFQCNs6vw8EhXscCKb_Wo04yCiqXnlfN0cbY65JcXwkqap920nWPhxiaQBE3D311a-N3hcJozTR-VDsZcSw3mhL0BcTRqg8KuKsZ57ftZUXJTdtnYncNT_sUeEmNcJ7cwNZswEV35qd3Q5XeEcmKfIEDWdD-Qu_lOsw3Ac-qyFh9eInWoKPzRUaFbcUu401YZC4eB6KHit_8rb_LbQP7C8IIglV7qdd0Hrb0c_ea7ZWJ_VFbTbH2os9oT6JZTK7sEN3MKLrjbJL2Z9LQ8NusFjPke0u9PcmV4JA_aKbnQBd3dtfNRMsdEXLOBt64t8LtHqT4Q9MBDe7rIQny1FBCgVFYlPceYeVZGHgZqsQZTkAix0AYN8B1pd49Z9k7h4f7q-1ScM9kck_NDBmdK0830uRSJVEap4vZwThRaHimgd4fsk-s3fO8_FkVIoKunncnunIPI5s39vmrl1kdyHW1A6vi29PUQcYonq0LLPrgj5o4dIYk3ztARhhM6nIZSajzkOj6P69Es6bW3j17W3hP7LF2eKHWwsQf6xQBlTvUmn92TIJkglsuOhOj3c48AS3Yd309M6xKYrRA8_esSXDUzJ2T7c4-zBoPnMtl8DrNSF6dDfAf2sR9EsdnbhMDyFrIjqULdQLh9ZRD8B4iuGYO3vSwnq7e-jaZnfImhdBEJFmjqYGOtch_fXcZ85CAfQ8RgP3zdtIJlq84mjrU9pY_qQvzMolOl6r3evrIDcnZmjRzHQ0_dspPIP8FVY2lHbK8--W0jHZ4-1j1WxDAgJd_qwmTXyY4IGNBOkeTqAkHGuKjRAfjeD-MMn9Al2rllqNi_vKQr4ILxwdiuYXLjapDeM-p3RCDNLABakzyTBL1trDOw1kFuEJCdx8LsEl3TKIanBuupRAKh5Ix0l4Bw57D3uoUXj4kz_FqeE9lY_vTJUyREmssvHfXIHA=='
-    INSTRUCTION_SYNTH_ENCRYPTED = b'gAAAAABoktL314amlDlkjpYnPtvC3U7Wey79pVnGnTq9TB16AIlSTXvhr_WMXN_nyb_qc8bnd_4QhiUeRq-Ss6x88ebwK7YdBC0kl69UDSLVCUG0KzPJTGDVarxva5ByVgD-Cqkxw0CKUtx4cX5efleDNXD7HAo_ep874sYdzzTx-vVejcrm2Vrt0bavYeNUwiHKqkwpHbVyPjrGfdoJS05BF2eUKB7f-I43kVjQeEviB0D4sUt5gTSABmSIyQOqxVFYhHiCipgOOQgMO7bd3aqgbddgTdrR1X2SJEfHer01CUhCnYYfARr-nTYLq0fzvLEe5YYX4GglhAnJuxsfskDla1VZk23pu6mSeNYuuLF-5bfHH7UDK90eVbLafy2Wj8WcxrERW5aaqh8PeLHDxgwa2j6gus7B-ytSWt7Yidrzde8E9Bs3VFwydqmxgZ63pdj4a1L7vPAiadvGhaFhXP6dvHCkKqVx7LufzTwaeDPQlEE2b2k-k34aSBcFlK2bgWMuLZoSe3RFUjs6j3iI8P1RZu4YlVOlNHWsMQwLNXh6lGGNnrNmyLHOwjRHA8BAB7MITpTUcQLohZBRGatAYgGYzticquVDn_VdWGjICADRiVvDgbBCX9DjTM6x7hds5V8hKZ4zXhNKzLyqoKlF4g82HVs_74_PBJXUunrvVMCwXkkPOUogRS-6zkgA0hQO_4xI0IaP7ooNXKEb6vc2e1yx_OWrP8d9IiAO6q-a2jZ8wqP7Lr55R1Vdzktd_CZVc-qfzzCjoNfRvcNCA1tW3poRIeVS0mxUtX7dretsjEANqya8rbjrr8Y0iENTMQ7eGtznylimFTcmWOba8TuoXaaLOU6zXlyzOyzv0zbLWcbuUuoAzVrYqjEd6e88EHldh4wquqzomjSWQV8_2L7YV7pEWKQ9vK7A0bEhejqW1H34WqjUhZcCfzoTsitbSEHlDpSEx1NXXIQTDMB14E-Zr8liTZ7SIHY0Rk-pT1mL7eBm3RlB2EYmX9-GW6L7bjQ3sChDXnq6BHjNrvNKTF9RgGZdTTms35PnUUjEfYEz8BlvpG8oBTZF9MaGw76-B_eg4J8ZtNy41Ig9y0N-QsQytZDSYERgyRLHL5kPWD-BNm4l3s-Wo8Gs9ztJxCgPk8NPnCvrJ3ETGyRGl8QjlgArZH6VQCAdztfCSpVBBHsTTVIY_14vLcHumCUu3b0fL7VdtFhjsGloLUcZWKtIQFaQLSsLgMRUK7xlxtJj8gCpr78txPcT1nzzp5XX6GJbBii47tBLgijbtYSHXODu5knWzEfV-wAxEsyYATbXtiJsaqmkWWRfBY361DrzZ9P4A60skGbENKcO2tcAe5YXhbs6b5h8ay6G1SssjFEB1yhP9yfk3aU2yfmM7fuXHtJhH27MhiEucq5TNB6_94hjgGz3i1azRfj6sBTbnJeOQv6F33DCJIESwwCwNENV47h9RViyKSg2M1OJlsb49G2JFH_Gz5WmUv4rGic9EFi-ihIuQjoL3isojIpd0HQcMMjHxFo5IPxpdzZNbs6DtNuIwwjoSqaWjwXjdcnU4S6GtLG9gUXRqxIFDygtndTWbpdi48JDzBluzcKFaEbQacdv6nVaHNPR87JtajxnGJxoW-FI1yYcOwQ-D8qh0vCGNORGRcTnCYfACDJUHu_NvH4ufmr-vrX6M8ZPTrCfJlirQ8MBP8CiTafoQNqzYrUpZV1V4wCiSwbiYhrhj3U2yePiFMQtyfHdUnmTkbyVL03cu9xZIVQbnRQcQ2uFgD7-430l0Un9KhdzRuIDW_r7'
-    key = st.secrets['INSTRUCTION_KEY'].encode()
-    f = Fernet(key)
-    INSTRUCTION1 = f.decrypt(INSTRUCTION1_ENCRYPTED).decode()
-    INSTRUCTION2 = f.decrypt(INSTRUCTION2_ENCRYPTED).decode()
-    INSTRUCTION3 = f.decrypt(INSTRUCTION3_ENCRYPTED).decode()
-    INSTRUCTION4 = f.decrypt(INSTRUCTION4_ENCRYPTED).decode()
-    INSTRUCTION_ORCH = f.decrypt(INSTRUCTION_ORCH_ENCRYPTED).decode()
-    INSTRUCTION_SYNTH = f.decrypt(INSTRUCTION_SYNTH_ENCRYPTED).decode()
-    
-    assist1_agent = Agent(
-        name="security_agent",
-        instructions=INSTRUCTION1,
-        handoff_description="The safety and security expert",
-        tools=[
-            FileSearchTool(
-                max_num_results=3,
-                vector_store_ids=[vs_id],
-            )
-        ],
-        model=model,
+# Registry of advisory agent graphs, built once per server process for each
+# model, vector store and instruction key. Agents hold no per-run state, so
+# concurrent sessions share them.
+@st.cache_resource(max_entries=8)
+def get_advisory_agents(model, vs_id, instruction_key):
+    return build_advisory_agents(model, vs_id, decrypt_instructions(instruction_key))
+
+# Registry of local chunk indexes of uploaded documents, built once per server
+# process for each document's content, so follow-up queries skip indexing.
+@st.cache_resource(max_entries=16)
+def get_chunk_index(sha256, _document):
+    return ChunkIndex.from_document(_document)
+
+# Process-wide owner of the files and vector stores created for documents.
+# They expire server side no sooner than the document cache ttl, are deleted
+# in the background once released, and a reaper sweeps orphaned stores.
+@st.cache_resource
+def get_vector_lifecycle(openai_api_key, min_lifetime, orphan_age, reaper_interval):
+    return VectorStoreLifecycle(
+        get_openai_client(openai_api_key), min_lifetime=min_lifetime,
+        orphan_age=orphan_age, reaper_interval=reaper_interval,
     )
-    assist2_agent = Agent(
-        name="hr_agent",
-        instructions=INSTRUCTION2,
-        handoff_description="HR and labor relations representative",
-        tools=[
-            FileSearchTool(
-                max_num_results=3,
-                vector_store_ids=[vs_id],
-            )
-        ],
-        model=model,
+
+# Process-wide cache of uploaded documents and their vector stores, each kept
+# no longer than its uploaded file lives server side. Evicted entries are
+# released to the lifecycle manager for deletion; entries a run or query is
+# still searching are pinned and never evicted.
+@st.cache_resource
+def get_doc_cache(openai_api_key, ttl, max_entries, _lifecycle):
+    return DocumentCache(
+        ttl=ttl, max_entries=max_entries, on_evict=_lifecycle.release_entry,
+        max_age=_lifecycle.max_cached_age,
     )
-    assist3_agent = Agent(
-        name="legal_agent",
-        instructions=INSTRUCTION3,
-        handoff_description="The legal advisor",
-        tools=[
-            FileSearchTool(
-                max_num_results=3,
-                vector_store_ids=[vs_id],
-            )
-        ],
-        model=model,
+
+# Write token counts and cost of a response.
+def render_token_usage(model, input_tokens, output_tokens):
+    st.markdown("#### Token Usage")
+    total_tokens = input_tokens + output_tokens
+    input_tokens_str = f"{input_tokens:,}"
+    output_tokens_str = f"{output_tokens:,}"
+    total_tokens_str = f"{total_tokens:,}"
+
+    st.markdown(
+        f"""
+        <p style="margin-bottom:0;">Input Tokens: {input_tokens_str}</p>
+        <p style="margin-bottom:0;">Output Tokens: {output_tokens_str}</p>
+        """,
+        unsafe_allow_html=True
     )
-    assist4_agent = Agent(
-        name="mental_health_agent",
-        instructions=INSTRUCTION4,
-        handoff_description="The mental health and wellness expert",
-        tools=[
-            FileSearchTool(
-                max_num_results=3,
-                vector_store_ids=[vs_id],
+    st.markdown(f"Total Tokens: {total_tokens_str}")
+
+    cost = estimate_cost(model, input_tokens, output_tokens) or 0.0
+    formatted_cost = "${:,.4f}".format(cost)
+
+    st.markdown(f"**Total Cost:** {formatted_cost}")
+
+# Write the library answer sources and token usage to the sources column.
+def render_library_sources(sources_col, model, retrieved_files, input_tokens, output_tokens):
+    with sources_col:
+        st.markdown("#### Sources")
+        file_list_str = ", ".join(retrieved_files)
+        st.markdown(f"**File(s):** {file_list_str}")
+        render_token_usage(model, input_tokens, output_tokens)
+
+# Search a library and write the answer, its source files and token usage in
+# two columns. With stream set, the answer is rendered as tokens arrive and the
+# sources and usage are filled in once the response completes. Answers found
+# in the answer cache are rendered at once and labelled as cached. The search
+# is recorded on meter when one is given.
+def render_library_search(client, model, vector_store_id, query_text, disclaimer, stream=True, answer_cache=None, meter=None):
+    # Setup output columns to display results.
+    answer_col, sources_col = st.columns(2)
+    with answer_col:
+        st.write(disclaimer)
+        st.markdown("#### Response")
+        placeholder = st.empty()
+    if answer_cache is not None:
+        cached = answer_cache.get(query_text, model, LIBRARY_TEMPERATURE, vector_store_id)
+        if cached is not None:
+            placeholder.markdown(cached["answer"])
+            with answer_col:
+                cached_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(cached["created_at"]))
+                st.caption(f"Cached answer from {cached_at}. Token usage is that of the original search.")
+            render_library_sources(
+                sources_col, model, cached["sources"],
+                cached["usage"]["input_tokens"], cached["usage"]["output_tokens"],
             )
-        ],
-        model=model,
-    )
-    orchestrator_agent = Agent(
-        name="orchestrator_agent",
-        instructions=(INSTRUCTION_ORCH),
-        tools=[
-            assist1_agent.as_tool(
-                tool_name="security_agent",
-                tool_description="The safety and security expert",
-            ),
-            assist2_agent.as_tool(
-                tool_name="hr_agent",
-                tool_description="HR and labor relations representative",
-            ),
-            assist3_agent.as_tool(
-                tool_name="legal_agent",
-                tool_description="The legal advisor",
-            ),
-            assist4_agent.as_tool(
-                tool_name="mental_health_agent",
-                tool_description="The mental health and wellness expert",
-            ),
-        ],
-        model=model,
-    )
-    synthesizer_agent = Agent(
-        name="synthesizer_agent",
-        instructions=(INSTRUCTION_SYNTH),
-        model=model,
+            if meter is not None:
+                meter.status = "cached"
+            return cached
+    with metered_stage(meter, "search"):
+        if stream:
+            placeholder.markdown("*Searching...*")
+            response = search_library(client, model, vector_store_id, query_text, placeholder, meter)
+        else:
+            with st.spinner('Calculating...'):
+                response = search_library(client, model, vector_store_id, query_text)
+    if meter is not None:
+        meter.add_usage(response.usage)
+    content = get_answer_content(response)
+    cleaned_response = CITATION_PATTERN.sub('', content.text)
+    # Write the complete answer to the answer column.
+    placeholder.markdown(cleaned_response)
+    # Extract annotations from the response, and write files used to generate
+    # the answer.
+    retrieved_files = set([annotation.filename for annotation in content.annotations])
+    render_library_sources(
+        sources_col, model, retrieved_files,
+        response.usage.input_tokens, response.usage.output_tokens,
     )
-    # # Run the entire orchestration in a single trace
-    # with trace("Orchestrator evaluator"):
-    #     orchestrator_result = await Runner.run(orchestrator_agent, query_text)
-    #     synthesizer_result = await Runner.run(synthesizer_agent, orchestrator_result.to_input_list())
-
-    # openai.api_key = openai_api_key
-    # client = AsyncOpenAI()
-    # client = OpenAI(api_key=openai_api_key)
-    
-    try:
-        orchestrator_result = await Runner.run(orchestrator_agent, query_text)
-        synthesizer_result = await Runner.run(synthesizer_agent, orchestrator_result.to_input_list())
-        return synthesizer_result        
-    except Exception as e:
-        response = fallback_summary_request(model, vs_id, query_text)
-        synthesizer_result = await Runner.run(synthesizer_agent, response.to_input_list())
-        return synthesizer_result            
-
-async def orchestrator_init(orchestrator_agent, synthesizer_agent, query_text):
-    synthesizer_result = []
-    # Run the entire orchestration in a single trace
-    with trace("Orchestrator evaluator"):
-        orchestrator_result = Runner.run(orchestrator_agent, query_text)
-        # for item in orchestrator_result.new_items:
-        #     if isinstance(item, MessageOutputItem):
-        #         text = ItemHelpers.text_message_output(item)
-                # if text:
-                #     print(f"  - Text: {text}")
-        synthesizer_result.append(await Runner.run(synthesizer_agent, orchestrator_result))
-    return synthesizer_result.final_output 
-
-# Delete file in openai storage and the vector store.
-def delete_vectors(client, TMP_FILE_ID, TMP_VECTOR_STORE_ID):
-    # Delete the file and vector store
-    deleted_vector_store_file = client.vector_stores.files.delete(
-        vector_store_id=TMP_VECTOR_STORE_ID,
-        file_id=TMP_FILE_ID
+    if answer_cache is not None:
+        answer_cache.put(
+            query_text, model, LIBRARY_TEMPERATURE, vector_store_id,
+            cleaned_response, retrieved_files,
+            {"input_tokens": response.usage.input_tokens, "output_tokens": response.usage.output_tokens},
+        )
+    return response
+
+# Disclaimers written above the answers of each library.
+LIBRARY_DISCLAIMER = "*Information is drawn from published public sources literature. For critical decisions, consult qualified legal, law enforcement, or threat professionals.*"
+LIBRARY_PRO_DISCLAIMER = "*Information is drawn from published sources and academic literature. For critical decisions, consult qualified legal, law enforcement, or threat professionals.*"
+
+# Search several libraries with the same question at once and write their
+# answers side by side, followed by the source files of all answers without
+# duplicates and their combined token usage. libraries is a list of (title,
+# vector store ID, disclaimer). Cached answers are written at once and only the
+# other libraries are searched. The search is recorded on meter when one is
+# given.
+def render_library_searches(client, model, libraries, query_text, stream=True, answer_cache=None, meter=None):
+    columns = st.columns(len(libraries))
+    placeholders = []
+    for col, (title, vector_store_id, disclaimer) in zip(columns, libraries):
+        with col:
+            st.markdown(f"#### {title}")
+            st.write(disclaimer)
+            placeholders.append(st.empty())
+    sources = set()
+    input_tokens = output_tokens = 0
+    pending = []
+    for i, (title, vector_store_id, disclaimer) in enumerate(libraries):
+        cached = answer_cache.get(query_text, model, LIBRARY_TEMPERATURE, vector_store_id) if answer_cache is not None else None
+        if cached is None:
+            pending.append(i)
+            continue
+        placeholders[i].markdown(cached["answer"])
+        with columns[i]:
+            cached_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(cached["created_at"]))
+            st.caption(f"Cached answer from {cached_at}. Token usage is that of the original search.")
+        sources.update(cached["sources"])
+        input_tokens += cached["usage"]["input_tokens"]
+        output_tokens += cached["usage"]["output_tokens"]
+    if not pending:
+        if meter is not None:
+            meter.status = "cached"
+    else:
+        with metered_stage(meter, "search", libraries=len(pending)):
+            if stream:
+                for i in pending:
+                    placeholders[i].markdown("*Searching...*")
+                responses = search_libraries(
+                    client, model, [libraries[i][1] for i in pending], query_text,
+                    [placeholders[i] for i in pending], meter,
+                )
+            else:
+                with st.spinner('Calculating...'):
+                    responses = search_libraries(client, model, [libraries[i][1] for i in pending], query_text)
+        for i, response in zip(pending, responses):
+            if isinstance(response, Exception):
+                placeholders[i].error(f"The {libraries[i][0]} search failed: {response}")
+                if meter is not None:
+                    meter.status = "error"
+                continue
+            if meter is not None:
+                meter.add_usage(response.usage)
+            content = get_answer_content(response)
+            cleaned_response = CITATION_PATTERN.sub('', content.text)
+            placeholders[i].markdown(cleaned_response)
+            retrieved_files = set([annotation.filename for annotation in content.annotations])
+            sources.update(retrieved_files)
+            input_tokens += response.usage.input_tokens
+            output_tokens += response.usage.output_tokens
+            if answer_cache is not None:
+                answer_cache.put(
+                    query_text, model, LIBRARY_TEMPERATURE, libraries[i][1],
+                    cleaned_response, retrieved_files,
+                    {"input_tokens": response.usage.input_tokens, "output_tokens": response.usage.output_tokens},
+                )
+    st.markdown("#### Sources")
+    st.markdown(f"**File(s):** {', '.join(sorted(sources))}")
+    render_token_usage(model, input_tokens, output_tokens)
+
+# Process-wide answer cache persisted in a local SQLite file.
+@st.cache_resource
+def get_answer_cache(path, ttl, max_entries):
+    return AnswerCache(path, ttl=ttl, max_entries=max_entries)
+
+# Process-wide ledger of metered requests persisted in a local SQLite file.
+@st.cache_resource
+def get_usage_ledger(path, retention):
+    return UsageLedger(path, retention=retention)
+
+# Periods the usage dashboard can summarize, in seconds.
+USAGE_PERIODS = {"Last 24 hours": 24 * 3600, "Last 7 days": 7 * 24 * 3600, "Last 30 days": 30 * 24 * 3600}
+
+# Write request counts, spend and p50/p95 latency per mode, and per mode and
+# user, from the usage ledger.
+def render_usage_dashboard(ledger):
+    st.markdown("#### Usage")
+    period = st.selectbox("Period", options=list(USAGE_PERIODS), key="usage_period")
+    since = time.time() - USAGE_PERIODS[period]
+    by_mode = ledger.summary(since, group_by=("mode",))
+    if not by_mode:
+        st.write("No requests were recorded in this period.")
+        return
+    requests_col, spend_col, errors_col = st.columns(3)
+    requests_col.metric("Requests", f"{sum(row['requests'] for row in by_mode):,}")
+    spend_col.metric("Spend", "${:,.4f}".format(sum(row["cost"] for row in by_mode)))
+    errors_col.metric("Errors", f"{sum(row['errors'] for row in by_mode):,}")
+    queue = get_rate_limits().snapshot()
+    st.caption(
+        f"Rate limit queue: {queue['waiting']:,} waiting, longest {queue['longest_wait']:.0f} s, "
+        f"{queue['rate_limited']:,} rate limit responses since the server started."
     )
-    deleted_vector_store = client.vector_stores.delete(
-        vector_store_id=TMP_VECTOR_STORE_ID
+    mode_tab, user_tab = st.tabs(["By mode", "By mode and user"])
+    with mode_tab:
+        st.dataframe(by_mode, use_container_width=True)
+    with user_tab:
+        st.dataframe(ledger.summary(since, group_by=("mode", "user")), use_container_width=True)
+
+# Trace, meter and schedule one request of a mode. When requests are already
+# waiting for the rate limit, the user is told before theirs joins them. The
+# finished trace is kept in the session so its timing breakdown can be shown
+# to admins.
+@contextlib.contextmanager
+def traced_request(ledger, mode, user, model):
+    queue = get_rate_limits().snapshot()
+    if queue["waiting"] or queue["paused_for"]:
+        st.caption(
+            f"{queue['waiting']:,} requests are waiting for the OpenAI rate limit "
+            f"(longest {max(queue['longest_wait'], queue['paused_for']):.0f} s); searches go first."
+        )
+    with span(mode, user=user, model=model) as root, ledger.meter(mode, user, model) as meter, caller(user, mode, meter):
+        try:
+            yield meter
+        finally:
+            st.session_state["last_trace"] = root
+
+# Write the timing breakdown of a finished trace, one row per span.
+def render_trace_breakdown(root, label="Timing breakdown"):
+    with st.expander(f"{label} ({root.duration:.1f} s)"):
+        st.dataframe(breakdown(root), use_container_width=True, hide_index=True)
+
+# Process-wide limits on OpenAI requests and tokens per minute, shared by
+# every session and job. RATE_LIMIT_CONTEXT_TOKENS is the up-front charge for
+# retrieved context, settled against actual usage.
+@st.cache_resource
+def get_rate_limits():
+    return configure_rate_limits(
+        st.secrets.get("RATE_LIMIT_RPM", REQUESTS_PER_MINUTE),
+        st.secrets.get("RATE_LIMIT_TPM", TOKENS_PER_MINUTE),
+        st.secrets.get("RATE_LIMIT_CONTEXT_TOKENS", CONTEXT_TOKENS),
     )
 
-def extract_text_from_excel(uploaded_file):
-    output_filename = "temp.txt"
-    df = pd.read_excel(uploaded_file, engine='openpyxl')
-    df['combined_text'] = df.apply(lambda row: ' '.join(row.values.astype(str)), axis=1)
-    json_string = df.to_json(path_or_buf=None)
-    serialized_data = json.dumps(json_string, indent=4)
-    # Write serialized data to a text file.
-    with open(output_filename, "w") as file:
-        file.write(serialized_data)
-    file.close()
-    return output_filename
-
-def copy_pdf(uploaded_file):
-    # Specify the input and output file paths
-    input_pdf_path = uploaded_file
-    output_pdf_path = "temp.pdf"
-    # Read the input PDF
-    reader = PdfReader(input_pdf_path)    
-    # Create a writer object to write the copy
-    writer = PdfWriter()
-    # Add all pages from the input PDF to the writer
-    for page in reader.pages:
-        writer.add_page(page)
-    # Write the copied content to the output file
-    with open(output_pdf_path, "wb") as output_file:
-        writer.write(output_file)    
-    output_file.close()
-    return output_pdf_path
-
-def convert_image_to_pdf(uploaded_file):
-    output_file = "temp.txt"
-    # Open the image file
-    image = Image.open(uploaded_file)
-    # Extract text from the image using pytesseract
-    extracted_text = pytesseract.image_to_string(image)
-    # Write the copied content to the output file
-    with open(output_file, "w") as file:
-        file.write(extracted_text)
-    file.close()
-    return output_file
-    
+# Jobs examine documents at once with the one Standard Examination assistant,
+# each run searching the vector store on its own thread. Stores left on the
+# assistant itself would be searched by every run, so they are detached once
+# per server process.
+@st.cache_resource
+def prepare_examination_assistant(openai_api_key, assistant_id):
+    detach_assistant_stores(get_openai_client(openai_api_key), assistant_id)
+    return True
+
+# Process-wide pool running Standard Examinations and advisory consultations
+# off the script thread, so reruns of the page don't throw the work away.
+@st.cache_resource
+def get_job_queue(_ledger, max_workers):
+    return JobQueue(_ledger, max_workers=max_workers)
+
+# Advisory consultation run as a job on the shared event loop.
+def advisory_job(client, model, vs_id, query_text, agents, fallback_instruction, parallel, agent_timeout,
+                 deadline, hedge_after, max_turns, meter=None):
+    return run_async(generate_response_cmte(
+        client, model, vs_id, query_text, agents, fallback_instruction,
+        parallel=parallel, agent_timeout=agent_timeout, deadline=deadline,
+        hedge_after=hedge_after, max_turns=max_turns, meter=meter,
+    ))
+
+# Write the result of a finished job as the page used to write it after the
+# request, or why it failed.
+def render_job_result(job, show_timings):
+    if job.status == FAILED:
+        if isinstance(job.error, TimeoutError):
+            st.error(f"The request took too long and was stopped. {job.error}")
+        else:
+            st.error(f"The request failed: {job.error}")
+    elif job.mode == "advisory":
+        st.write("*The insights provided reflect expert perspectives but are not a substitute for professional advice. Please consult legal, law enforcement, or threat management professionals before making decisions.*")
+        st.markdown("#### Response")
+        st.markdown(job.result.text)
+        if job.result.source == "fallback":
+            st.caption("The panel was slow to answer, so this is the single-call summary.")
+    elif job.mode == "examination":
+        response, run = job.result
+        status = run.status
+        # Write disclaimer and response from assistant eval of file.
+        st.write("*As the Threat AI system continues to be refined. Users should review the original file and verify the summary for reliability and relevance.*")
+        st.write("#### Summary")
+        if status != "completed":
+            st.warning(f"The examination ended with status: {status}")
+        # Only the assistant's messages from this run are returned.
+        for m in response:
+            st.markdown(m.content[0].text.value)
+    if show_timings and job.trace is not None:
+        if "extract_trace" in job.details:
+            render_trace_breakdown(job.details["extract_trace"], "Extraction timing")
+        render_trace_breakdown(job.trace)
+
+# Write the user's jobs, newest first: queued jobs can be cancelled and
+# finished ones dismissed. Runs as a fragment that refreshes itself while any
+# job is unfinished, so results appear without a rerun of the page.
+def render_jobs(job_queue, owner, show_timings):
+    jobs = job_queue.jobs_for(owner)
+    if not jobs:
+        return
+    st.markdown("#### Requests")
+    for job in jobs:
+        with st.container(border=True):
+            if job.status == QUEUED:
+                st.markdown(f"**{job.label}** · queued for {job.waited:.0f} s")
+                if st.button("Cancel", key=f"cancel_job_{job.id}"):
+                    job_queue.cancel(job.id)
+                    st.rerun(scope="fragment")
+            elif job.status == RUNNING and "queue_position" in job.details:
+                st.markdown(
+                    f"**{job.label}** · waiting for the rate limit, position {job.details['queue_position']:,} "
+                    f"for {job.details['queued_seconds']:.0f} s"
+                )
+            elif job.status == RUNNING:
+                st.markdown(f"**{job.label}** · running for {job.elapsed:.0f} s")
+                st.progress(min(job.elapsed / max(job.details.get("timeout", RUN_TIMEOUT), 1), 1.0))
+            else:
+                st.markdown(f"**{job.label}** · {job.status} in {job.elapsed:.0f} s")
+                if job.status in (DONE, FAILED):
+                    render_job_result(job, show_timings)
+                if st.button("Dismiss", key=f"dismiss_job_{job.id}"):
+                    job_queue.discard(job.id)
+                    st.rerun(scope="fragment")
+
+# Thread of the user's latest completed Standard Examination of the document,
+# or None. Custom queries continue it so the examination stays in context.
+def examination_thread(job_queue, owner, document_sha256):
+    for job in job_queue.jobs_for(owner):
+        if job.mode == "examination" and job.status == DONE and job.details.get("document_sha256") == document_sha256:
+            response, run = job.result
+            if run.status == "completed":
+                return run.thread_id
+    return None
+
+# The account's custom query conversation about the document in this session,
+# started afresh for a new document or when restart is set. Another account
+# logging in to the same session doesn't continue it.
+def get_conversation(owner, document_sha256, restart=False):
+    conversations = st.session_state.setdefault("conversations", {})
+    conversation = conversations.get(owner)
+    if restart or conversation is None or conversation.document_sha256 != document_sha256:
+        conversation = conversations[owner] = Conversation(document_sha256)
+    return conversation
+
+# Tracing is configured once per server process.
+@st.cache_resource
+def get_tracing(path, otlp_endpoint):
+    configure_tracing(path, otlp_endpoint, st.secrets.get("OTLP_HEADERS"))
+    return True
+
+# Extract the uploaded file into a document buffer kept in this session's
+# state. Reruns of the page reuse it, and no two sessions share a file on disk.
+# Raises ValueError when the extracted document is over the size limit.
+def get_session_document(uploaded_file, extract_pdf):
+    key = (uploaded_file.file_id, extract_pdf)
+    current = st.session_state.get("document")
+    if current is not None:
+        if current[0] == key:
+            return current[1]
+        current[1].close()
+        del st.session_state["document"]
+    suffix = Path(uploaded_file.name).suffix.lower()
+    # Read file, for each row combine column information, and serialize the
+    # data for later processing by the openai model.
+    with span("extract", suffix=suffix, bytes=uploaded_file.size) as extract_span:
+        document = extract_document(uploaded_file, extract_pdf)
+        extract_span.set(document_bytes=document.size)
+    # Admins see how long extraction took with the examination breakdown.
+    st.session_state["extract_trace"] = extract_span
+    st.session_state["document"] = (key, document)
+    return document
+
+# Token counts and cost estimate for examining the session's document, computed
+# once per document, model and budget. None for documents that are not text,
+# such as PDFs uploaded as is.
+def get_document_preflight(document, model, budget):
+    if Path(document.name).suffix != ".txt":
+        return None
+    estimates = st.session_state.setdefault("preflight", {})
+    key = (document.sha256, model, budget)
+    if key not in estimates:
+        estimates[key] = preflight(document, STANDARD_EXAMINATION_QUERY, model, budget=budget)
+    return estimates[key]
+
 # Disable the button called via on_click attribute.
 def disable_button():
     st.session_state.disabled = True        
@@ -393,9 +487,54 @@ if st.session_state.get('authentication_status'):
     # Save the API key to the st session.
     # st.session_state["OPENAI_API_KEY"] = api_key_input
     openai_api_key = st.secrets["OPENAI_API_KEY"]
+    # Uploaded documents are kept in openai storage for follow-up queries.
+    doc_cache_ttl = st.secrets.get("DOC_CACHE_TTL", DEFAULT_TTL)
+    vector_lifecycle = get_vector_lifecycle(
+        openai_api_key,
+        doc_cache_ttl,
+        st.secrets.get("ORPHAN_AGE", ORPHAN_AGE),
+        st.secrets.get("REAPER_INTERVAL", REAPER_INTERVAL),
+    )
+    doc_cache = get_doc_cache(
+        openai_api_key,
+        doc_cache_ttl,
+        st.secrets.get("DOC_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES),
+        vector_lifecycle,
+    )
     
     # Retrieve user-selected openai model.
     model: str = st.selectbox("Model", options=MODEL_LIST)
+    # Library answers are streamed into the page unless disabled in secrets.
+    stream_library = st.secrets.get("STREAM_LIBRARY", True)
+    # Repeated library questions are answered from the local answer cache.
+    answer_cache = get_answer_cache(
+        st.secrets.get("ANSWER_CACHE_PATH", str(ANSWER_CACHE_PATH)),
+        st.secrets.get("ANSWER_CACHE_TTL", ANSWER_CACHE_TTL),
+        st.secrets.get("ANSWER_CACHE_MAX_ENTRIES", ANSWER_CACHE_MAX_ENTRIES),
+    )
+    # Every request is metered to the local usage ledger. Users listed in
+    # ADMIN_USERS can view the usage dashboard.
+    usage_ledger = get_usage_ledger(
+        st.secrets.get("METERING_PATH", str(METERING_PATH)),
+        st.secrets.get("METERING_RETENTION", METERING_RETENTION),
+    )
+    # Stage timings are traced to a local JSONL file and, when configured, an
+    # OTLP collector.
+    get_tracing(
+        st.secrets.get("TRACE_PATH", str(TRACE_PATH)),
+        st.secrets.get("OTLP_ENDPOINT"),
+    )
+    # OpenAI requests of every session and job share the rate limits, with
+    # library searches ahead of background jobs.
+    get_rate_limits()
+    # Standard Examinations and advisory consultations run as jobs in the
+    # background.
+    job_queue = get_job_queue(usage_ledger, st.secrets.get("JOB_WORKERS", JOB_WORKERS))
+    # Jobs belong to the account, since display names need not be unique;
+    # requests are metered under the display name.
+    user_name = st.session_state.get('name')
+    user_id = st.session_state.get('username')
+    is_admin = user_id in st.secrets.get("ADMIN_USERS", [])
     
     # Create advanced options dropdown with upload file option.
     with st.expander("Advanced Options", expanded=True):
@@ -403,6 +542,16 @@ if st.session_state.get('authentication_status'):
         lib_ex = st.checkbox("Library Pro - *Search trusted publications for authoritative answers*")
         cmte_ex = st.checkbox("Advisory - *Consult a multidisciplinary panel for personalized insights and perspectives*")
         doc_ex = st.checkbox("Upload Excel, PDF, or image file for examination")
+        # Cached library answers go stale when the library holdings change.
+        # The cache is shared by every user, so only admins can clear it.
+        if is_admin and st.button("Clear cached library answers"):
+            cleared = answer_cache.invalidate()
+            st.toast(f"Cleared {cleared:,} cached answers.")
+        usage_ex = is_admin and st.checkbox("Usage dashboard - *Latency and spend per mode and user*")
+        show_timings = is_admin and st.checkbox("Show timing breakdown of each request")
+        
+    if usage_ex:
+        render_usage_dashboard(usage_ledger)
         
     # If there's no openai api key, stop.
     if not openai_api_key:
@@ -427,15 +576,31 @@ if st.session_state.get('authentication_status'):
             # Query the aitam library vector store and include internet
             # serach results.
             # Set up OpenAI client with your API key
-            with st.spinner('Calculating...'):
-                # event_loop = asyncio.get_running_loop()
-                # if event_loop.is_running():
-                #     response3 = asyncio.create_task(generate_response_cmte(openai_api_key, VECTOR_STORE_ID, query))
-                # else:
-                response3 = asyncio.run(generate_response_cmte(model, VECTOR_STORE_ID, query))
-            st.write("*The insights provided reflect expert perspectives but are not a substitute for professional advice. Please consult legal, law enforcement, or threat management professionals before making decisions.*")
-            st.markdown("#### Response")
-            st.markdown(response3.new_items[0].raw_item.content[0].text) #response3.new_items)
+            # event_loop = asyncio.get_running_loop()
+            # if event_loop.is_running():
+            #     response3 = asyncio.create_task(generate_response_cmte(openai_api_key, VECTOR_STORE_ID, query))
+            # else:
+            # Run on the shared event loop the pooled async client belongs to.
+            configure_agents(openai_api_key)
+            # Reuse the agent graph built for this model and vector store.
+            agents = get_advisory_agents(model, VECTOR_STORE_ID, st.secrets['INSTRUCTION_KEY'])
+            # Consult the panel in the background; the response is written
+            # under Requests when it is ready.
+            job_queue.submit(
+                "advisory", user_id, model, f"Advisory: {query[:80]}", advisory_job,
+                get_async_openai_client(openai_api_key), model, VECTOR_STORE_ID, query, agents,
+                decrypt_instructions(st.secrets['INSTRUCTION_KEY'])["FALLBACK"],
+                st.secrets.get("ADVISORY_PARALLEL", True),
+                st.secrets.get("SPECIALIST_TIMEOUT", SPECIALIST_TIMEOUT),
+                # Latency limits: the consultation is stopped at the deadline,
+                # and the single-call fallback races a panel that hasn't
+                # answered by the hedge time.
+                st.secrets.get("ADVISORY_DEADLINE", ADVISORY_DEADLINE),
+                st.secrets.get("ADVISORY_HEDGE_AFTER", ADVISORY_HEDGE_AFTER),
+                st.secrets.get("ADVISORY_MAX_TURNS", ADVISORY_MAX_TURNS),
+                user=user_name,
+            )
+            st.toast("The advisors are considering your question.")
             # st.markdown(response3.messages[-1]['content'])
             # report all properties of the object
             # for method in dir(response3):
@@ -449,8 +614,32 @@ if st.session_state.get('authentication_status'):
             # st.markdown(response3.choices[0].text)
             # st.markdown(response3.output[1].content[0].text)
 
+    # If both libraries were selected, search them together so the question
+    # takes about as long as the slower library.
+    if lib_ex and lib2_ex:
+        with st.form(key="qa_form_both", clear_on_submit=False):
+            query = st.text_area("**Search Library and Library Pro Holdings:**")
+            submit = st.form_submit_button("Search")
+        if submit:
+            # If form is submitted without a query, stop.
+            if not query:
+                st.error("Enter a question to search the library!")
+                st.stop()
+            # Query both library vector stores at once, streaming the answers.
+            with traced_request(usage_ledger, "library_both", user_name, model) as meter:
+                render_library_searches(
+                    get_openai_client(openai_api_key), model,
+                    [("Library", VECTOR_STORE2_ID, LIBRARY_DISCLAIMER), ("Library Pro", VECTOR_STORE_ID, LIBRARY_PRO_DISCLAIMER)],
+                    query,
+                    stream=stream_library,
+                    answer_cache=answer_cache,
+                    meter=meter,
+                )
+            if show_timings:
+                render_trace_breakdown(st.session_state["last_trace"])
+
     # If Library mode was selected.
-    if lib_ex:
+    elif lib_ex:
         # Create new form to search aitam library vector store.    
         with st.form(key="qa_form", clear_on_submit=False):
             query = st.text_area("**Search Library Pro Holdings:**")
@@ -461,109 +650,22 @@ if st.session_state.get('authentication_status'):
             if not query:
                 st.error("Enter a question to search the library!")
                 st.stop()            
-            # Setup output columns to display results.
-            answer_col, sources_col = st.columns(2)
-            # Create new client for this submission.
-            client2 = OpenAI(api_key=openai_api_key)
-            # Query the aitam library vector store and include internet
-            # serach results.
-            with st.spinner('Calculating...'):
-                response2 = client2.responses.create(
-                    input = query,
-                    model = model,
-                    temperature = 0.3,
-                    tools = [{
-                                "type": "file_search",
-                                "vector_store_ids": [VECTOR_STORE_ID],
-                    }],
-                    include=["output[*].file_search_call.search_results"]
+            # Get the pooled client shared by all sessions.
+            client2 = get_openai_client(openai_api_key)
+            # Query the aitam library vector store, streaming the answer.
+            with traced_request(usage_ledger, "library_pro", user_name, model) as meter:
+                response2 = render_library_search(
+                    client2, model, VECTOR_STORE_ID, query,
+                    LIBRARY_PRO_DISCLAIMER,
+                    stream=stream_library,
+                    answer_cache=answer_cache,
+                    meter=meter,
                 )
-            # Write response to the answer column.    
-            with answer_col:
-                st.write("*Information is drawn from published sources and academic literature. For critical decisions, consult qualified legal, law enforcement, or threat professionals.*")
-                cleaned_response = re.sub(r'【.*?†.*?】', '', response2.output[0].content[0].text) #response2.output[1].content[0].text)
-                st.markdown("#### Response")
-                st.markdown(cleaned_response)
-            # Write files used to generate the answer.
-            with sources_col:            
-                st.markdown("#### Sources")
-                # Extract annotations from the response, and print source files.
-                annotations = response2.output[0].content[0].annotations
-                retrieved_files = set([response2.filename for response2 in annotations])
-                file_list_str = ", ".join(retrieved_files)
-                st.markdown(f"**File(s):** {file_list_str}")
-    
-                st.markdown("#### Token Usage")
-                input_tokens = response2.usage.input_tokens
-                output_tokens = response2.usage.output_tokens
-                total_tokens = input_tokens + output_tokens
-                input_tokens_str = f"{input_tokens:,}"
-                output_tokens_str = f"{output_tokens:,}"
-                total_tokens_str = f"{total_tokens:,}"
-    
-                st.markdown(
-                    f"""
-                    <p style="margin-bottom:0;">Input Tokens: {input_tokens_str}</p>
-                    <p style="margin-bottom:0;">Output Tokens: {output_tokens_str}</p>
-                    """,
-                    unsafe_allow_html=True
-                )
-                st.markdown(f"Total Tokens: {total_tokens_str}")
-    
-                if model == "gpt-4.1-nano":
-                    input_token_cost = .1/1000000
-                    output_token_cost = .4/1000000
-                elif model == "gpt-4o-mini":
-                    input_token_cost = .15/1000000
-                    output_token_cost = .6/1000000
-                elif model == "gpt-4.1":
-                    input_token_cost = 2.00/1000000
-                    output_token_cost = 8.00/1000000
-                elif model == "gpt-4.1-mini":
-                    input_token_cost = .4/1000000
-                    output_token_cost = 1.60/1000000
-                elif model == "o4-mini":
-                    input_token_cost = 1.10/1000000
-                    output_token_cost = 4.40/1000000
-    
-                cost = input_tokens*input_token_cost + output_tokens*output_token_cost
-                formatted_cost = "${:,.4f}".format(cost)
-                
-                st.markdown(f"**Total Cost:** {formatted_cost}")                
-                
-                # st.markdown("#### Sources")
-                # # Extract annotations from the response, and print source files.
-                # annotations = response2.output[1].content[0].annotations
-                # retrieved_files = set([response2.filename for response2 in annotations])
-                # file_list_str = ", ".join(retrieved_files)
-                # st.markdown(f"**File(s):** {file_list_str}")
-    
-                # st.markdown("#### Token Usage")
-                # input_tokens = response2.usage.input_tokens
-                # output_tokens = response2.usage.output_tokens
-                # total_tokens = input_tokens + output_tokens
-                # input_tokens_str = f"{input_tokens:,}"
-                # output_tokens_str = f"{output_tokens:,}"
-                # total_tokens_str = f"{total_tokens:,}"
-    
-                # st.markdown(
-                #     f"""
-                #     <p style="margin-bottom:0;">Input Tokens: {input_tokens_str}</p>
-                #     <p style="margin-bottom:0;">Output Tokens: {output_tokens_str}</p>
-                #     """,
-                #     unsafe_allow_html=True
-                # )
-                # # st.markdown(f"Input Tokens: {input_tokens}")
-                # # st.markdown(f"Output Tokens: {output_tokens}")
-                # st.markdown(f"Total Tokens: {total_tokens}")
-    
-                # cost = input_tokens*.1/1000000 + output_tokens*.4/1000000
-                # formatted_cost = "${:,.4f}".format(cost)
-                
-                # st.markdown(f"**Total Cost:** {formatted_cost}")
+            if show_timings:
+                render_trace_breakdown(st.session_state["last_trace"])
 
     # If Library mode was selected.
-    if lib2_ex:
+    elif lib2_ex:
         # Create new form to search aitam library vector store.    
         with st.form(key="qa_form2", clear_on_submit=False):
             query = st.text_area("**Search Library Holdings:**")
@@ -574,96 +676,47 @@ if st.session_state.get('authentication_status'):
             if not query:
                 st.error("Enter a question to search the library!")
                 st.stop()            
-            # Setup output columns to display results.
-            answer_col, sources_col = st.columns(2)
-            # Create new client for this submission.
-            client4 = OpenAI(api_key=openai_api_key)
-            # Query the aitam library vector store and include internet
-            # serach results.
-            with st.spinner('Calculating...'):
-                response4 = client4.responses.create(
-                    input = query,
-                    model = model,
-                    temperature = 0.3,
-                    tools = [{
-                                "type": "file_search",
-                                "vector_store_ids": [VECTOR_STORE2_ID],
-                    }],
-                    include=["output[*].file_search_call.search_results"]
-                )
-            # Write response to the answer column.    
-            with answer_col:
-                st.write("*Information is drawn from published public sources literature. For critical decisions, consult qualified legal, law enforcement, or threat professionals.*")
-                try:
-                    cleaned_response = re.sub(r'【.*?†.*?】', '', response4.output[0].content[0].text)
-                except:
-                    cleaned_response = re.sub(r'【.*?†.*?】', '', response4.output[1].content[0].text)
-                st.markdown("#### Response")
-                st.markdown(cleaned_response)
-            # Write files used to generate the answer.
-            with sources_col:            
-                st.markdown("#### Sources")
-                # Extract annotations from the response, and print source files.
-                try:
-                    annotations = response4.output[0].content[0].annotations
-                except:
-                    annotations = response4.output[1].content[0].annotations                    
-                retrieved_files = set([response4.filename for response4 in annotations])
-                file_list_str = ", ".join(retrieved_files)
-                st.markdown(f"**File(s):** {file_list_str}")
-    
-                st.markdown("#### Token Usage")
-                input_tokens = response4.usage.input_tokens
-                output_tokens = response4.usage.output_tokens
-                total_tokens = input_tokens + output_tokens
-                input_tokens_str = f"{input_tokens:,}"
-                output_tokens_str = f"{output_tokens:,}"
-                total_tokens_str = f"{total_tokens:,}"
-    
-                st.markdown(
-                    f"""
-                    <p style="margin-bottom:0;">Input Tokens: {input_tokens_str}</p>
-                    <p style="margin-bottom:0;">Output Tokens: {output_tokens_str}</p>
-                    """,
-                    unsafe_allow_html=True
+            # Get the pooled client shared by all sessions.
+            client4 = get_openai_client(openai_api_key)
+            # Query the aitam library vector store, streaming the answer.
+            with traced_request(usage_ledger, "library", user_name, model) as meter:
+                response4 = render_library_search(
+                    client4, model, VECTOR_STORE2_ID, query,
+                    LIBRARY_DISCLAIMER,
+                    stream=stream_library,
+                    answer_cache=answer_cache,
+                    meter=meter,
                 )
-                st.markdown(f"Total Tokens: {total_tokens_str}")
-    
-                if model == "gpt-4.1-nano":
-                    input_token_cost = .1/1000000
-                    output_token_cost = .4/1000000
-                elif model == "gpt-4o-mini":
-                    input_token_cost = .15/1000000
-                    output_token_cost = .6/1000000
-                elif model == "gpt-4.1":
-                    input_token_cost = 2.00/1000000
-                    output_token_cost = 8.00/1000000
-                elif model == "gpt-4.1-mini":
-                    input_token_cost = .4/1000000
-                    output_token_cost = 1.60/1000000
-                elif model == "o4-mini":
-                    input_token_cost = 1.10/1000000
-                    output_token_cost = 4.40/1000000
-    
-                cost = input_tokens*input_token_cost + output_tokens*output_token_cost
-                formatted_cost = "${:,.4f}".format(cost)
-                
-                st.markdown(f"**Total Cost:** {formatted_cost}")                
+            if show_timings:
+                render_trace_breakdown(st.session_state["last_trace"])
                 
     if doc_ex:
         # File uploader for Excel files
-        uploaded_file = st.file_uploader("Choose an Excel, PDF, or image (heif, jpg, png) file", type=["xlsx","pdf","heif","jpg","png"], key="uploaded_file")
+        uploaded_file = st.file_uploader("Choose an Excel, PDF, or image (heif, heic, jpg, png, tiff) file", type=["xlsx","pdf"] + [suffix[1:] for suffix in IMAGE_SUFFIXES], key="uploaded_file")
         # If a file is uploaded, extract the text and write serialized information to a text file, 
         # give options for further processing, and run assistant to process the information.
         if uploaded_file:
-            # Read file, for each row combine column information, create json string, and
-            # serialize the data for later processing by the openai model.
-            if Path(uploaded_file.name).suffix.lower() == ".xlsx":            
-                filename = extract_text_from_excel(uploaded_file)
-            elif Path(uploaded_file.name).suffix.lower() == ".pdf":
-                filename = copy_pdf(uploaded_file)
-            elif Path(uploaded_file.name).suffix.lower() == ".heif" or Path(uploaded_file.name).suffix.lower() == ".jpg" or Path(uploaded_file.name).suffix.lower() == ".png" or Path(uploaded_file.name).suffix.lower() == ".jpeg":
-                filename = convert_image_to_pdf(uploaded_file)
+            # Upload the PDF as is, or extract its text page by page and OCR
+            # scanned pages when requested.
+            extract_pdf = (
+                Path(uploaded_file.name).suffix.lower() == ".pdf"
+                and st.checkbox("Extract PDF text and OCR scanned pages")
+            )
+            try:
+                document = get_session_document(uploaded_file, extract_pdf)
+            except ValueError as e:
+                st.error(str(e))
+                st.stop()
+            # Show the document's token count and the estimated cost before
+            # anything is sent to the model.
+            doc_token_budget = st.secrets.get("DOC_TOKEN_BUDGET", DOC_TOKEN_BUDGET)
+            estimate = get_document_preflight(document, model, doc_token_budget)
+            if estimate is not None:
+                st.caption(f"Document size: {estimate.document_tokens:,} tokens. Estimated examination cost: ${estimate.estimated_cost:,.4f}.")
+                if estimate.over_budget:
+                    st.caption(f"The document is over the {doc_token_budget:,} token budget and will be condensed in {estimate.chunks:,} parts before Standard Examination (about ${estimate.map_reduce_cost:,.4f}).")
+                    if estimate.skipped_chunks:
+                        st.caption(f"Only the first {estimate.chunks:,} parts are condensed; the last {estimate.skipped_chunks:,} parts of the document are left out of the examination.")
             # If there's no openai api key, stop.
             if not openai_api_key:
                 st.error("Please enter your OpenAI API key!")
@@ -674,6 +727,9 @@ if st.session_state.get('authentication_status'):
                 # questions about the file.
                 submit_doc_ex = st.form_submit_button("Standard Examination", on_click=disable_button)
                 query_doc_ex = st.text_area("**Custom Queries**")
+                # Follow-ups keep the document, the Standard Examination and
+                # earlier answers in context server side.
+                follow_up = st.checkbox("Follow up on earlier answers about this document", value=True)
                 submit_doc_ex_form = st.form_submit_button("Submit Query")
                 # If there's no openai api key, stop.
                 if not openai_api_key:
@@ -681,39 +737,70 @@ if st.session_state.get('authentication_status'):
                     st.stop()
                 # Conduct standard aitam eval on the file.
                 if submit_doc_ex and doc_ex:
-                    query_text = "I need your help analyzing the uploaded document."
-                    # Call function to copy file to openai storage, create vector store, and use an 
-                    # assistant to eval the file.
-                    with st.spinner('Calculating...'):
-                        (response, TMP_FILE_ID, TMP_VECTOR_STORE_ID, client, run, thread) = generate_response(filename, openai_api_key, model, MATH_ASSISTANT_ID, query_text)
-                    # Write disclaimer and response from assistant eval of file.
-                    st.write("*As the Threat AI system continues to be refined. Users should review the original file and verify the summary for reliability and relevance.*")
-                    st.write("#### Summary")
-                    i = 0
-                    for m in response:
-                        if i > 0:
-                            st.markdown(m.content[0].text.value)
-                        i += 1
-                    # Reset the button state for standard aitam file eval, and 
-                    # delete the file from openai storage and the associated
-                    # vector store.
+                    # Queue the examination with its own copy of the document,
+                    # so uploading another file meanwhile doesn't affect it.
+                    # Documents over the token budget are condensed first so
+                    # the examination stays bounded in time.
+                    prepare_examination_assistant(openai_api_key, MATH_ASSISTANT_ID)
+                    job_document = DocumentBuffer(document.name)
+                    job_document.write_from(document.open())
+                    timeout = st.secrets.get("RUN_TIMEOUT", RUN_TIMEOUT)
+                    job = job_queue.submit(
+                        "examination", user_id, model, f"Standard Examination of {uploaded_file.name}", standard_examination,
+                        job_document, openai_api_key, model, MATH_ASSISTANT_ID, doc_cache,
+                        budget=doc_token_budget, condense=estimate is not None and estimate.over_budget,
+                        timeout=timeout, lifecycle=vector_lifecycle, user=user_name, cleanup=job_document.close,
+                    )
+                    job.details["timeout"] = timeout
+                    job.details["document_sha256"] = document.sha256
+                    if "extract_trace" in st.session_state:
+                        job.details["extract_trace"] = st.session_state["extract_trace"]
+                    st.toast(f"Standard Examination of {uploaded_file.name} queued.")
+                    # Reset the button state for standard aitam file eval. The file
+                    # and vector store stay cached for follow-up queries and are
+                    # deleted from openai storage when evicted from the cache.
                     submit_doc_ex = False
-                    delete_vectors(client, TMP_FILE_ID, TMP_VECTOR_STORE_ID)
                 # If the user provides a custom query for the file and submits it, 
                 # call different function to use a different assistant to run the 
                 # query on the file.
                 if submit_doc_ex_form:                    
-                    with st.spinner('Calculating...'):
-                        (response, TMP_FILE_ID, TMP_VECTOR_STORE_ID, client) = generate_response_noassist("temp.txt", openai_api_key, model, query_doc_ex)
+                    conversation = get_conversation(user_id, document.sha256, restart=not follow_up)
+                    # The first question after a Standard Examination of this
+                    # document continues the examination's thread.
+                    if follow_up and not conversation.turns:
+                        conversation.thread_id = examination_thread(job_queue, user_id, document.sha256)
+                    with st.spinner('Calculating...'), traced_request(usage_ledger, "custom_query", user_name, model) as meter:
+                        if conversation.thread_id is not None:
+                            follow_up_examination(
+                                document, openai_api_key, MATH_ASSISTANT2_ID, query_doc_ex, doc_cache, conversation,
+                                timeout=st.secrets.get("RUN_TIMEOUT", RUN_TIMEOUT), meter=meter, lifecycle=vector_lifecycle,
+                            )
+                        else:
+                            # Extracted text up to the local index size is searched
+                            # in process, skipping the upload and indexing.
+                            index = None
+                            if can_index_locally(document, st.secrets.get("LOCAL_INDEX_MAX_BYTES", LOCAL_INDEX_MAX_BYTES)):
+                                with metered_stage(meter, "index"):
+                                    index = get_chunk_index(document.sha256, document)
+                            (response, TMP_FILE_ID, TMP_VECTOR_STORE_ID, client) = generate_response_noassist(document, openai_api_key, model, query_doc_ex, doc_cache, meter=meter, lifecycle=vector_lifecycle, index=index, conversation=conversation)
                     # Write disclaimer and response from assistant eval of file.            
                     st.write("*As the Threat AI system continues to be refined. Users should review the original file and verify the summary for reliability and relevance.*")
-                    for m in response:
-                        st.markdown(m.content[0].text.value)
-                    # Reset the button state for the custom aitam file eval, and 
-                    # delete the file from openai storage and the associated
-                    # vector store.            
+                    if len(conversation.turns) > 1:
+                        with st.expander(f"Earlier questions ({len(conversation.turns) - 1})"):
+                            for question, answer in conversation.turns[:-1]:
+                                st.markdown(f"**{question}**")
+                                st.markdown(CITATION_PATTERN.sub('', answer))
+                    st.markdown(CITATION_PATTERN.sub('', conversation.turns[-1][1]))
+                    if show_timings:
+                        render_trace_breakdown(st.session_state["last_trace"])
+                    # Reset the button state for the custom aitam file eval. The
+                    # file and vector store stay cached for follow-up queries.
                     submit_doc_ex_form = False
-                    delete_vectors(client, TMP_FILE_ID, TMP_VECTOR_STORE_ID)
+
+    # Examinations and consultations of this user, including ones started
+    # before the last rerun. Checked every few seconds while any is unfinished.
+    has_unfinished = any(job.status in (QUEUED, RUNNING) for job in job_queue.jobs_for(user_id))
+    st.fragment(render_jobs, run_every=JOB_POLL_SECONDS if has_unfinished else None)(job_queue, user_id, show_timings)
 
 elif st.session_state.get('authentication_status') is False:
     st.error('Username/password is incorrect')